@@ -0,0 +1,62 @@
+'''
+Library initialization benchmark.
+
+Opens and closes a disk 100 times in a row, each time through a new VixDisk, as a
+backup job going through a VM's disks would.  The stand-in library sleeps
+FAKE_VDDK_INIT_US inside VixDiskLib_InitEx, standing in for loading the transport
+plugins.  The library is initialized once per process and reference counted, so
+while anything holds it (here a long lived VixDisk, in a real application the
+connection pool or the job itself) new instances skip InitEx altogether.  Without a
+holder, every instance pays for InitEx as every instance used to.
+
+Run with "make bench".
+'''
+import os, sys, time, tempfile, shutil
+from optparse import OptionParser
+
+# must be set before the library is initialized
+os.environ.setdefault("FAKE_VDDK_INIT_US", "20000")
+
+from vixDiskLib import VixDisk
+from vixDiskLib.vixBase import library_stats
+from bench_threads import create_disk, MB
+
+
+def run(path, count):
+    before = library_stats['initializations']
+    start = time.time()
+    for _ in xrange(count):
+        disk = VixDisk()
+        disk.connect(readonly=True)
+        disk.open(path)
+        disk.close()
+        disk.disconnect()
+        del disk
+    return time.time() - start, library_stats['initializations'] - before
+
+
+def main(argv=None):
+    parser = OptionParser()
+    parser.add_option("-n", "--opens", type="int", default=100, help="number of disks to open")
+    options, _ = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="vixbench-")
+    try:
+        path = os.path.join(workdir, "disk.vmdk")
+        create_disk(path, 16, MB)
+
+        print "InitEx latency: %sus, %d sequential opens" % (os.environ["FAKE_VDDK_INIT_US"], options.opens)
+        print "%-24s %10s %10s %16s" % ("", "seconds", "per open", "initializations")
+        elapsed, inits = run(path, options.opens)
+        print "%-24s %10.3f %9.1fms %16d" % ("no holder", elapsed, elapsed * 1000 / options.opens, inits)
+
+        holder = VixDisk()
+        elapsed, inits = run(path, options.opens)
+        print "%-24s %10.3f %9.1fms %16d" % ("library held", elapsed, elapsed * 1000 / options.opens, inits)
+        holder.finalize()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
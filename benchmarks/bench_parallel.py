@@ -0,0 +1,60 @@
+'''
+Scaling benchmark for ParallelDiskReader.
+
+Reads one disk through 1, 2, 4 and 8 connections, both in order with iter() and
+straight into a file with copy_to().  The stand-in library sleeps
+FAKE_VDDK_LATENCY_US inside every Read call, standing in for an NBD round trip;
+with more handles more of those round trips are in flight at once.
+
+Run with "make bench".
+'''
+import os, sys, time, tempfile, shutil
+from optparse import OptionParser
+
+# must be set before the library is initialized
+os.environ.setdefault("FAKE_VDDK_LATENCY_US", "5000")
+
+from vixDiskLib.parallel import ParallelDiskReader
+from bench_threads import create_disk, MB
+
+
+def run(path, connections, stripe_size, destination=None):
+    with ParallelDiskReader(path, connections=connections, stripe_size=stripe_size) as reader:
+        start = time.time()
+        if destination:
+            nbytes = reader.copy_to(destination)
+        else:
+            nbytes = sum(buff.size for _, buff in reader.iter())
+        elapsed = time.time() - start
+    return nbytes / elapsed / MB
+
+
+def main(argv=None):
+    parser = OptionParser()
+    parser.add_option("-b", "--blocks", type="int", default=256, help="1MB blocks on the disk")
+    parser.add_option("-s", "--stripe-size", type="int", default=2048, help="sectors per stripe")
+    parser.add_option("-c", "--connections", default="1,2,4,8", help="comma separated connection counts")
+    options, _ = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="vixbench-")
+    try:
+        path = os.path.join(workdir, "disk.vmdk")
+        destination = os.path.join(workdir, "copy.raw")
+        create_disk(path, options.blocks, MB)
+
+        print "latency: %sus per call, %dMB disk, %d sector stripes" % (
+            os.environ["FAKE_VDDK_LATENCY_US"], options.blocks, options.stripe_size)
+        print "%12s %12s %9s %12s %9s" % ("connections", "iter MB/s", "speedup", "copy MB/s", "speedup")
+        base = None
+        for count in [int(c) for c in options.connections.split(",")]:
+            rates = (run(path, count, options.stripe_size),
+                     run(path, count, options.stripe_size, destination))
+            base = base or rates
+            print "%12d %12.1f %8.2fx %12.1f %8.2fx" % (
+                count, rates[0], rates[0] / base[0], rates[1], rates[1] / base[1])
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+'''
+Read-ahead benchmark for VixDisk.iter().
+
+Reads a disk block by block and compresses every block, first serially and then with
+the prefetcher keeping reads in flight while the consumer compresses.  With the
+stand-in library's per call latency (FAKE_VDDK_LATENCY_US) the two costs overlap.
+
+Run with "make bench".
+'''
+import os, sys, time, zlib, tempfile, shutil
+from optparse import OptionParser
+
+# must be set before the library is initialized
+os.environ.setdefault("FAKE_VDDK_LATENCY_US", "20000")
+
+from vixDiskLib import VixDisk
+from bench_threads import create_disk, MB
+
+
+def run(path, blocks, block_size, prefetch):
+    disk = VixDisk(block_size=block_size)
+    disk.connect(readonly=False)
+    disk.open(path)
+    start = time.time()
+    for buff in disk.iter(nblocks=1, prefetch=prefetch):
+        zlib.compress(buff, 1)
+    elapsed = time.time() - start
+    stats = getattr(disk, "prefetch_stats", None) if prefetch else None
+    disk.close()
+    disk.disconnect()
+    return blocks * block_size / elapsed / MB, stats
+
+
+def main(argv=None):
+    parser = OptionParser()
+    parser.add_option("-b", "--blocks", type="int", default=64, help="blocks on the disk")
+    parser.add_option("-s", "--block-size", type="int", default=MB, help="block size in bytes")
+    parser.add_option("-d", "--depths", default="0,1,2,4", help="comma separated prefetch depths")
+    options, _ = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="vixbench-")
+    try:
+        path = os.path.join(workdir, "disk.vmdk")
+        create_disk(path, options.blocks, options.block_size)
+        # compressible, but not trivially so
+        disk = VixDisk(block_size=options.block_size)
+        disk.connect(readonly=False)
+        disk.open(path)
+        for block in xrange(options.blocks):
+            disk.write_from(block, os.urandom(options.block_size / 64) * 64)
+        disk.close()
+        disk.disconnect()
+
+        print "latency: %sus per call, %d x %d byte blocks, zlib level 1" % (
+            os.environ["FAKE_VDDK_LATENCY_US"], options.blocks, options.block_size)
+        print "%8s %12s  %s" % ("prefetch", "MB/s", "stats")
+        for depth in [int(d) for d in options.depths.split(",")]:
+            rate, stats = run(path, options.blocks, options.block_size, depth)
+            print "%8d %12.1f  %s" % (depth, rate, stats or "")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+'''
+Thread scaling benchmark for VixDiskBase.read().
+
+Each worker thread gets its own VixDisk (connection + handle) on its own disk
+image and reads it end to end.  The stand-in library in benchmarks/fakevddk
+sleeps FAKE_VDDK_LATENCY_US inside every Read call, standing in for an NBD
+round trip.  Because the GIL is released around VixDiskLib_Read, aggregate
+throughput should rise with the thread count until the latency is hidden.
+
+Run with "make bench".
+'''
+import os, sys, time, threading, tempfile, shutil
+from optparse import OptionParser
+
+# must be set before the library is initialized
+os.environ.setdefault("FAKE_VDDK_LATENCY_US", "2000")
+
+from vixDiskLib import VixDisk, VixDiskLib_CreateParams
+from vixDiskLib.consts import VixDiskLibDiskType, VixDiskLibAdapterType, VixDiskLibHwVersion
+
+MB = 1024 * 1024
+
+
+def create_disk(path, blocks, block_size):
+    disk = VixDisk(block_size=block_size)
+    disk.connect(readonly=False)
+    params = VixDiskLib_CreateParams(
+            disk_type=VixDiskLibDiskType['MONOLITHIC_FLAT'],
+            adapter_type=VixDiskLibAdapterType['SCSI_LSILOGIC'],
+            hw_version=VixDiskLibHwVersion['CURRENT'],
+            blocks=blocks)
+    disk.create(path, params)
+    disk.disconnect()
+
+
+def read_disk(path, blocks, block_size, results, index):
+    disk = VixDisk(block_size=block_size)
+    disk.connect(readonly=True)
+    disk.open(path)
+    nbytes = 0
+    for block in xrange(blocks):
+        nbytes += disk.read(block).size
+    disk.close()
+    disk.disconnect()
+    results[index] = nbytes
+
+
+def run(paths, blocks, block_size):
+    results = [0] * len(paths)
+    threads = [threading.Thread(target=read_disk, args=(path, blocks, block_size, results, i))
+               for i, path in enumerate(paths)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    return sum(results), elapsed
+
+
+def main(argv=None):
+    parser = OptionParser()
+    parser.add_option("-b", "--blocks", type="int", default=64, help="blocks per disk")
+    parser.add_option("-s", "--block-size", type="int", default=MB, help="block size in bytes")
+    parser.add_option("-t", "--threads", default="1,2,4,8", help="comma separated thread counts")
+    options, _ = parser.parse_args(argv)
+
+    counts = [int(c) for c in options.threads.split(",")]
+    workdir = tempfile.mkdtemp(prefix="vixbench-")
+    try:
+        paths = [os.path.join(workdir, "disk%d.vmdk" % i) for i in xrange(max(counts))]
+        for path in paths:
+            create_disk(path, options.blocks, options.block_size)
+
+        print "latency: %sus per call, %d x %d byte blocks per thread" % (
+            os.environ["FAKE_VDDK_LATENCY_US"], options.blocks, options.block_size)
+        print "%8s %12s %10s" % ("threads", "MB/s", "speedup")
+        base = None
+        for count in counts:
+            nbytes, elapsed = run(paths[:count], options.blocks, options.block_size)
+            rate = nbytes / elapsed / MB
+            base = base or rate
+            print "%8d %12.1f %9.2fx" % (count, rate, rate / base)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+'''
+Compares two benchmark runs written by suite.py and reports regressions.
+
+    python benchmarks/compare.py baseline.json current.json [-t 10]
+
+A metric regresses when it is worse than the baseline by more than the threshold, in
+percent.  The exit status is 1 if anything regressed, so it can gate a build.
+'''
+import sys, json
+from optparse import OptionParser
+
+def load(path):
+    with open(path) as fd:
+        return dict((m['name'], m) for m in json.load(fd)['metrics'])
+
+def compare(baseline, current, threshold):
+    """ Returns (name, old, new, change in percent, regressed) for the common metrics """
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name]['value'], current[name]['value']
+        change = (new - old) * 100.0 / old if old else 0.0
+        worse = -change if current[name]['better'] == "higher" else change
+        rows.append((name, old, new, change, worse > threshold))
+    return rows
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog baseline.json current.json")
+    parser.add_option("-t", "--threshold", type="float", default=10.0,
+                      help="percent change counted as a regression")
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error("need a baseline and a current run")
+
+    rows = compare(load(args[0]), load(args[1]), options.threshold)
+    print "%-36s %14s %14s %9s" % ("metric", "baseline", "current", "change")
+    for name, old, new, change, regressed in rows:
+        print "%-36s %14.2f %14.2f %+8.1f%% %s" % (name, old, new, change, "REGRESSED" if regressed else "")
+    regressions = [row for row in rows if row[4]]
+    print "%d of %d metrics regressed by more than %.0f%%" % (len(regressions), len(rows), options.threshold)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1064 @@
+/*
+ * fakeVixDiskLib.c - a local stand-in for libvixDiskLib.
+ *
+ * Every "virtual disk" is a raw image file: sector N lives at byte offset
+ * N * VIXDISKLIB_SECTOR_SIZE.  Connections are just tokens, so remote and
+ * local connects behave the same.  The point is to exercise the Python
+ * bindings (and their threading behaviour) without a vSphere lab, not to
+ * emulate VMDK on-disk formats.
+ *
+ * Environment:
+ *   FAKE_VDDK_LATENCY_US   per Read/Write call latency in microseconds,
+ *                          slept *inside* the call to stand in for a network
+ *                          round trip (default 0).
+ *   FAKE_VDDK_INIT_US      latency of VixDiskLib_InitEx, standing in for
+ *                          loading the transport plugins (default 0).
+ *   FAKE_VDDK_TRANSPORTS   per transport Read/Write latency overriding
+ *                          FAKE_VDDK_LATENCY_US, as "nbd=2000,hotadd=200,san=fail".
+ *                          "fail" makes opens over that transport fail.  A
+ *                          connection uses the first mode of the transportModes
+ *                          it was given, "file" if none.
+ *   FAKE_VDDK_MEMORY       when set (and not "0"), images are mapped into
+ *                          memory at open and Read/Write are a memcpy, so
+ *                          benchmarks measure the bindings rather than the
+ *                          page cache and syscalls.
+ *
+ * Simulator settings come from the configFile given to VixDiskLib_InitEx,
+ * which is read like the real one ("key = value" lines, "#" comments).  Keys
+ * other than the fake.* ones below are ignored, and every InitEx starts over
+ * from the defaults:
+ *
+ *   fake.latency.distribution  fixed (default), uniform, normal or exponential.
+ *   fake.latency.us            the mean per Read/Write latency, as
+ *                              FAKE_VDDK_LATENCY_US (which takes precedence).
+ *   fake.latency.jitterUs      the half width of uniform, or the standard
+ *                              deviation of normal, latencies.
+ *   fake.handle.MBps           a bandwidth cap per open handle, 0 for none.
+ *   fake.connection.MBps       a bandwidth cap shared by the handles opened
+ *                              through one connection, 0 for none.
+ *   fake.maxHandles            opens beyond this many open handles fail with
+ *                              VIX_E_TOO_MANY_HANDLES, 0 for no limit.
+ *   fake.fault.sectors         comma separated sectors: a Read/Write covering
+ *                              any of them fails.
+ *   fake.fault.once            1 to fail each fault.sectors entry only once.
+ *   fake.fault.rate            the probability, 0 to 1, that any Read/Write
+ *                              fails.
+ *   fake.fault.error           the VixError the faults return (default
+ *                              VIX_E_HOST_NETWORK_CONN_REFUSED).
+ *   fake.fault.ops             read, write or readwrite (default).
+ *   fake.seed                  the seed for the latency and fault draws.
+ *
+ * Latency is slept and bandwidth is paced inside the calls, so the Python
+ * bindings see the same blocking a network transport would give them.
+ *
+ * Like the real library, nothing works between VixDiskLib_Exit and the next
+ * VixDiskLib_InitEx: connects and opens fail with VIX_E_FAIL.
+ */
+#define _GNU_SOURCE
+#include <ctype.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <math.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "vixDiskLib.h"
+
+#define FAKE_MAX_KEYS 16
+
+#define FAKE_MODE_LEN 16
+
+#define FAKE_MAX_FAULTS 64
+
+struct VixDiskLibConnectParam {
+   Bool readOnly;
+   char mode[FAKE_MODE_LEN];
+   long long nextFreeUs;         /* when the connection's bandwidth is free */
+};
+
+struct VixDiskLibHandleStruct {
+   int fd;
+   Bool readOnly;
+   long latencyUs;
+   char mode[FAKE_MODE_LEN];
+   VixDiskLibConnection connection;
+   long long nextFreeUs;         /* when the handle's bandwidth is free */
+   uint8 *image;                 /* the mapped image with FAKE_VDDK_MEMORY */
+   size_t imageLen;
+   VixDiskLibSectorType capacity;
+   int nkeys;
+   char *keys[FAKE_MAX_KEYS];
+   char *values[FAKE_MAX_KEYS];
+};
+
+typedef enum {
+   FAKE_FIXED,
+   FAKE_UNIFORM,
+   FAKE_NORMAL,
+   FAKE_EXPONENTIAL,
+} FakeDistribution;
+
+/* the settings read by VixDiskLib_InitEx */
+static struct {
+   FakeDistribution distribution;
+   long latencyUs;
+   long jitterUs;
+   double handleMBps;
+   double connectionMBps;
+   int maxHandles;
+   int nfaults;
+   VixDiskLibSectorType faults[FAKE_MAX_FAULTS];
+   Bool faulted[FAKE_MAX_FAULTS];
+   Bool faultOnce;
+   double faultRate;
+   VixError faultError;
+   Bool faultReads;
+   Bool faultWrites;
+   unsigned long long seed;
+} fake;
+
+static Bool fakeInitialized = 0;
+
+/* guards the handle count, the bandwidth clocks, the faults and the random state */
+static pthread_mutex_t fakeLock = PTHREAD_MUTEX_INITIALIZER;
+static int fakeOpenHandles = 0;
+static unsigned long long fakeRandomState = 1;
+
+
+/*
+ * Looks up a transport in FAKE_VDDK_TRANSPORTS.  Returns the latency to use for
+ * it, or -1 if opens over it should fail.
+ */
+static long
+FakeTransportLatency(const char *mode)
+{
+   const char *spec = getenv("FAKE_VDDK_TRANSPORTS");
+   size_t len = strlen(mode);
+
+   while (spec && *spec) {
+      if (strncmp(spec, mode, len) == 0 && spec[len] == '=') {
+         spec += len + 1;
+         return strncmp(spec, "fail", 4) == 0 ? -1 : atol(spec);
+      }
+      spec = strchr(spec, ',');
+      if (spec) {
+         spec++;
+      }
+   }
+   return fake.latencyUs;
+}
+
+
+/*
+ * A uniform draw in (0, 1) from a xorshift64* generator, so runs with the same
+ * fake.seed see the same latencies and faults.  Call with fakeLock held.
+ */
+static double
+FakeRandom(void)
+{
+   fakeRandomState ^= fakeRandomState >> 12;
+   fakeRandomState ^= fakeRandomState << 25;
+   fakeRandomState ^= fakeRandomState >> 27;
+   return ((fakeRandomState * 2685821657736338717ULL >> 11) + 0.5) / 9007199254740992.0;
+}
+
+
+/*
+ * Draws one call's latency from fake.distribution, around a mean of meanUs.
+ */
+static long
+FakeLatency(long meanUs)
+{
+   double us = meanUs, u, v;
+
+   if (fake.distribution == FAKE_FIXED || meanUs <= 0) {
+      return meanUs;
+   }
+   pthread_mutex_lock(&fakeLock);
+   u = FakeRandom();
+   v = FakeRandom();
+   pthread_mutex_unlock(&fakeLock);
+
+   switch (fake.distribution) {
+   case FAKE_UNIFORM:
+      us = meanUs + (2 * u - 1) * fake.jitterUs;
+      break;
+   case FAKE_NORMAL:
+      us = meanUs + fake.jitterUs * sqrt(-2 * log(u)) * cos(2 * M_PI * v);
+      break;
+   case FAKE_EXPONENTIAL:
+      us = -meanUs * log(u);
+      break;
+   default:
+      break;
+   }
+   return us > 0 ? (long)us : 0;
+}
+
+
+static long long
+FakeNowUs(void)
+{
+   struct timespec ts;
+
+   clock_gettime(CLOCK_MONOTONIC, &ts);
+   return ts.tv_sec * 1000000LL + ts.tv_nsec / 1000;
+}
+
+
+/*
+ * Books a transfer of `bytes` at `MBps` on a bandwidth clock, after whatever is
+ * already booked on it, and returns when the transfer ends.  Call with
+ * fakeLock held.
+ */
+static long long
+FakeReserve(long long *nextFreeUs, long long nowUs, double MBps, size_t bytes)
+{
+   long long start = *nextFreeUs > nowUs ? *nextFreeUs : nowUs;
+
+   *nextFreeUs = start + (long long)(bytes / (MBps * 1048576.0) * 1e6);
+   return *nextFreeUs;
+}
+
+
+static void
+FakeSleepUs(long us)
+{
+   struct timespec ts;
+
+   if (us <= 0) {
+      return;
+   }
+   ts.tv_sec = us / 1000000;
+   ts.tv_nsec = (us % 1000000) * 1000;
+   while (nanosleep(&ts, &ts) == -1 && errno == EINTR) {
+   }
+}
+
+
+/*
+ * Holds a Read/Write of `bytes` back to the handle's and the connection's
+ * bandwidth caps.
+ */
+static void
+FakeThrottle(VixDiskLibHandle h, size_t bytes)
+{
+   long long now, until = 0, end;
+
+   if (fake.handleMBps <= 0 && fake.connectionMBps <= 0) {
+      return;
+   }
+   pthread_mutex_lock(&fakeLock);
+   now = FakeNowUs();
+   if (fake.handleMBps > 0) {
+      until = FakeReserve(&h->nextFreeUs, now, fake.handleMBps, bytes);
+   }
+   if (fake.connectionMBps > 0) {
+      end = FakeReserve(&h->connection->nextFreeUs, now, fake.connectionMBps, bytes);
+      until = end > until ? end : until;
+   }
+   pthread_mutex_unlock(&fakeLock);
+   FakeSleepUs((long)(until - now));
+}
+
+
+/*
+ * Returns the injected error for a Read (or Write) of the given sectors, or
+ * VIX_OK.
+ */
+static VixError
+FakeFault(VixDiskLibSectorType startSector, VixDiskLibSectorType numSectors,
+          Bool write)
+{
+   VixError err = VIX_OK;
+   int i;
+
+   if (write ? !fake.faultWrites : !fake.faultReads) {
+      return VIX_OK;
+   }
+   if (fake.nfaults == 0 && fake.faultRate <= 0) {
+      return VIX_OK;
+   }
+   pthread_mutex_lock(&fakeLock);
+   for (i = 0; i < fake.nfaults; i++) {
+      if (fake.faults[i] >= startSector && fake.faults[i] < startSector + numSectors &&
+          !(fake.faultOnce && fake.faulted[i])) {
+         fake.faulted[i] = 1;
+         err = fake.faultError;
+         break;
+      }
+   }
+   if (err == VIX_OK && fake.faultRate > 0 && FakeRandom() < fake.faultRate) {
+      err = fake.faultError;
+   }
+   pthread_mutex_unlock(&fakeLock);
+   return err;
+}
+
+
+static char *
+FakeStrip(char *s)
+{
+   char *end;
+
+   while (isspace((unsigned char)*s)) {
+      s++;
+   }
+   end = s + strlen(s);
+   while (end > s && isspace((unsigned char)end[-1])) {
+      end--;
+   }
+   if (end - s >= 2 && *s == '"' && end[-1] == '"') {
+      s++;
+      end--;
+   }
+   *end = '\0';
+   return s;
+}
+
+
+static void
+FakeSetting(const char *key, const char *value)
+{
+   if (strcasecmp(key, "fake.latency.distribution") == 0) {
+      if (strcasecmp(value, "uniform") == 0) {
+         fake.distribution = FAKE_UNIFORM;
+      } else if (strcasecmp(value, "normal") == 0) {
+         fake.distribution = FAKE_NORMAL;
+      } else if (strcasecmp(value, "exponential") == 0) {
+         fake.distribution = FAKE_EXPONENTIAL;
+      } else {
+         fake.distribution = FAKE_FIXED;
+      }
+   } else if (strcasecmp(key, "fake.latency.us") == 0) {
+      fake.latencyUs = atol(value);
+   } else if (strcasecmp(key, "fake.latency.jitterUs") == 0) {
+      fake.jitterUs = atol(value);
+   } else if (strcasecmp(key, "fake.handle.MBps") == 0) {
+      fake.handleMBps = atof(value);
+   } else if (strcasecmp(key, "fake.connection.MBps") == 0) {
+      fake.connectionMBps = atof(value);
+   } else if (strcasecmp(key, "fake.maxHandles") == 0) {
+      fake.maxHandles = atoi(value);
+   } else if (strcasecmp(key, "fake.fault.sectors") == 0) {
+      const char *p = value;
+      while (*p && fake.nfaults < FAKE_MAX_FAULTS) {
+         fake.faults[fake.nfaults++] = strtoull(p, NULL, 0);
+         p += strcspn(p, ",");
+         p += *p == ',';
+      }
+   } else if (strcasecmp(key, "fake.fault.once") == 0) {
+      fake.faultOnce = atoi(value) != 0;
+   } else if (strcasecmp(key, "fake.fault.rate") == 0) {
+      fake.faultRate = atof(value);
+   } else if (strcasecmp(key, "fake.fault.error") == 0) {
+      fake.faultError = strtoull(value, NULL, 0);
+   } else if (strcasecmp(key, "fake.fault.ops") == 0) {
+      fake.faultReads = strstr(value, "read") != NULL;
+      fake.faultWrites = strstr(value, "write") != NULL;
+   } else if (strcasecmp(key, "fake.seed") == 0) {
+      fake.seed = strtoull(value, NULL, 0);
+   }
+}
+
+
+/*
+ * Resets the settings to their defaults and reads the fake.* keys of a
+ * VDDK config file.
+ */
+static void
+FakeConfigure(const char *configFile)
+{
+   const char *env = getenv("FAKE_VDDK_LATENCY_US");
+   char line[1024];
+   FILE *f;
+
+   memset(&fake, 0, sizeof fake);
+   fake.faultError = VIX_E_HOST_NETWORK_CONN_REFUSED;
+   fake.faultReads = fake.faultWrites = 1;
+   fake.seed = 1;
+
+   f = configFile && *configFile ? fopen(configFile, "r") : NULL;
+   while (f && fgets(line, sizeof line, f)) {
+      char *eq, *key;
+
+      line[strcspn(line, "#\r\n")] = '\0';
+      eq = strchr(line, '=');
+      if (eq == NULL) {
+         continue;
+      }
+      *eq = '\0';
+      key = FakeStrip(line);
+      if (strncasecmp(key, "fake.", 5) == 0) {
+         FakeSetting(key, FakeStrip(eq + 1));
+      }
+   }
+   if (f) {
+      fclose(f);
+   }
+   if (env) {
+      fake.latencyUs = atol(env);
+   }
+   fakeRandomState = fake.seed ? fake.seed : 1;
+}
+
+
+static VixError
+FakeErrno(void)
+{
+   switch (errno) {
+   case ENOENT:  return VIX_E_FILE_NOT_FOUND;
+   case EACCES:
+   case EPERM:   return VIX_E_FILE_ACCESS_ERROR;
+   case EROFS:   return VIX_E_FILE_READ_ONLY;
+   case EEXIST:  return VIX_E_FILE_ALREADY_EXISTS;
+   case ENOSPC:  return VIX_E_DISK_FULL;
+   case ENOMEM:  return VIX_E_OUT_OF_MEMORY;
+   default:      return VIX_E_FILE_ERROR;
+   }
+}
+
+
+static void
+FakeSetKey(VixDiskLibHandle h, const char *key, const char *val)
+{
+   int i;
+
+   for (i = 0; i < h->nkeys; i++) {
+      if (strcmp(h->keys[i], key) == 0) {
+         free(h->values[i]);
+         h->values[i] = strdup(val);
+         return;
+      }
+   }
+   if (h->nkeys < FAKE_MAX_KEYS) {
+      h->keys[h->nkeys] = strdup(key);
+      h->values[h->nkeys] = strdup(val);
+      h->nkeys++;
+   }
+}
+
+
+VixError
+VixDiskLib_InitEx(uint32 majorVersion, uint32 minorVersion,
+                  VixDiskLibGenericLogFunc *log, VixDiskLibGenericLogFunc *warn,
+                  VixDiskLibGenericLogFunc *panic, const char *libDir,
+                  const char *configFile)
+{
+   const char *init = getenv("FAKE_VDDK_INIT_US");
+
+   pthread_mutex_lock(&fakeLock);
+   FakeConfigure(configFile);
+   pthread_mutex_unlock(&fakeLock);
+   FakeSleepUs(init ? atol(init) : 0);
+   fakeInitialized = 1;
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Init(uint32 majorVersion, uint32 minorVersion,
+                VixDiskLibGenericLogFunc *log, VixDiskLibGenericLogFunc *warn,
+                VixDiskLibGenericLogFunc *panic, const char *libDir)
+{
+   return VixDiskLib_InitEx(majorVersion, minorVersion, log, warn, panic,
+                            libDir, NULL);
+}
+
+
+void
+VixDiskLib_Exit(void)
+{
+   fakeInitialized = 0;
+}
+
+
+const char *
+VixDiskLib_ListTransportModes(void)
+{
+   return "file:san:hotadd:nbdssl:nbd";
+}
+
+
+VixError
+VixDiskLib_Cleanup(const VixDiskLibConnectParams *connectParams,
+                   uint32 *numCleanedUp, uint32 *numRemaining)
+{
+   if (numCleanedUp) {
+      *numCleanedUp = 0;
+   }
+   if (numRemaining) {
+      *numRemaining = 0;
+   }
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_ConnectEx(const VixDiskLibConnectParams *connectParams,
+                     Bool readOnly, const char *snapshotRef,
+                     const char *transportModes,
+                     VixDiskLibConnection *connection)
+{
+   VixDiskLibConnection conn;
+
+   if (!fakeInitialized) {
+      return VIX_E_FAIL;
+   }
+   conn = calloc(1, sizeof *conn);
+   if (conn == NULL) {
+      return VIX_E_OUT_OF_MEMORY;
+   }
+   conn->readOnly = readOnly;
+   if (transportModes && *transportModes) {
+      size_t len = strcspn(transportModes, ":");
+      snprintf(conn->mode, sizeof conn->mode, "%.*s", (int)len, transportModes);
+   } else {
+      strcpy(conn->mode, "file");
+   }
+   *connection = conn;
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Connect(const VixDiskLibConnectParams *connectParams,
+                   VixDiskLibConnection *connection)
+{
+   return VixDiskLib_ConnectEx(connectParams, 0, NULL, NULL, connection);
+}
+
+
+VixError
+VixDiskLib_Disconnect(VixDiskLibConnection connection)
+{
+   free(connection);
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Create(const VixDiskLibConnection connection, const char *path,
+                  const VixDiskLibCreateParams *createParams,
+                  VixDiskLibProgressFunc progressFunc,
+                  void *progressCallbackData)
+{
+   int fd = open(path, O_RDWR | O_CREAT | O_EXCL, 0644);
+
+   if (fd < 0) {
+      return FakeErrno();
+   }
+   if (ftruncate(fd, (off_t)(createParams->capacity * VIXDISKLIB_SECTOR_SIZE))) {
+      VixError err = FakeErrno();
+      close(fd);
+      unlink(path);
+      return err;
+   }
+   close(fd);
+   if (progressFunc) {
+      progressFunc(progressCallbackData, 100);
+   }
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_CreateChild(VixDiskLibHandle diskHandle, const char *childPath,
+                       VixDiskLibDiskType diskType,
+                       VixDiskLibProgressFunc progressFunc,
+                       void *progressCallbackData)
+{
+   return VIX_E_NOT_SUPPORTED;
+}
+
+
+static void
+FakeFreeHandle(VixDiskLibHandle h)
+{
+   int i;
+
+   if (h->image) {
+      munmap(h->image, h->imageLen);
+   }
+   close(h->fd);
+   for (i = 0; i < h->nkeys; i++) {
+      free(h->keys[i]);
+      free(h->values[i]);
+   }
+   free(h);
+}
+
+
+VixError
+VixDiskLib_Open(const VixDiskLibConnection connection, const char *path,
+                uint32 flags, VixDiskLibHandle *diskHandle)
+{
+   VixDiskLibHandle h;
+   struct stat st;
+   Bool readOnly = (flags & VIXDISKLIB_FLAG_OPEN_READ_ONLY) != 0;
+   char buf[32];
+   long latencyUs = FakeTransportLatency(connection->mode);
+   const char *memory = getenv("FAKE_VDDK_MEMORY");
+   int fd;
+
+   *diskHandle = NULL;
+   if (!fakeInitialized || latencyUs < 0) {
+      return VIX_E_FAIL;
+   }
+   fd = open(path, readOnly ? O_RDONLY : O_RDWR);
+   if (fd < 0) {
+      return FakeErrno();
+   }
+   if (fstat(fd, &st)) {
+      VixError err = FakeErrno();
+      close(fd);
+      return err;
+   }
+   h = calloc(1, sizeof *h);
+   if (h == NULL) {
+      close(fd);
+      return VIX_E_OUT_OF_MEMORY;
+   }
+   h->fd = fd;
+   h->readOnly = readOnly;
+   h->latencyUs = latencyUs;
+   h->connection = connection;
+   strcpy(h->mode, connection->mode);
+   h->capacity = st.st_size / VIXDISKLIB_SECTOR_SIZE;
+   if (memory && strcmp(memory, "0") != 0 && st.st_size > 0) {
+      void *image = mmap(NULL, st.st_size, PROT_READ | (readOnly ? 0 : PROT_WRITE),
+                         MAP_SHARED, fd, 0);
+      if (image == MAP_FAILED) {
+         VixError err = FakeErrno();
+         close(fd);
+         free(h);
+         return err;
+      }
+      h->image = image;
+      h->imageLen = st.st_size;
+   }
+
+   FakeSetKey(h, "adapterType", "lsilogic");
+   snprintf(buf, sizeof buf, "%llu", (unsigned long long)(h->capacity / (16 * 63)));
+   FakeSetKey(h, "geometry.cylinders", buf);
+   FakeSetKey(h, "geometry.heads", "16");
+   FakeSetKey(h, "geometry.sectors", "63");
+   FakeSetKey(h, "virtualHWVersion", "7");
+
+   pthread_mutex_lock(&fakeLock);
+   if (fake.maxHandles > 0 && fakeOpenHandles >= fake.maxHandles) {
+      pthread_mutex_unlock(&fakeLock);
+      FakeFreeHandle(h);
+      return VIX_E_TOO_MANY_HANDLES;
+   }
+   fakeOpenHandles++;
+   pthread_mutex_unlock(&fakeLock);
+
+   *diskHandle = h;
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_GetInfo(VixDiskLibHandle diskHandle, VixDiskLibInfo **info)
+{
+   VixDiskLibInfo *i = calloc(1, sizeof *i);
+
+   if (i == NULL) {
+      return VIX_E_OUT_OF_MEMORY;
+   }
+   i->capacity = diskHandle->capacity;
+   i->physGeo.heads = i->biosGeo.heads = 16;
+   i->physGeo.sectors = i->biosGeo.sectors = 63;
+   i->physGeo.cylinders = i->biosGeo.cylinders =
+      (uint32)(diskHandle->capacity / (16 * 63));
+   i->adapterType = VIXDISKLIB_ADAPTER_SCSI_LSILOGIC;
+   i->numLinks = 1;
+   *info = i;
+   return VIX_OK;
+}
+
+
+void
+VixDiskLib_FreeInfo(VixDiskLibInfo *info)
+{
+   free(info);
+}
+
+
+const char *
+VixDiskLib_GetTransportMode(VixDiskLibHandle diskHandle)
+{
+   return diskHandle->mode;
+}
+
+
+VixError
+VixDiskLib_Close(VixDiskLibHandle diskHandle)
+{
+   if (diskHandle == NULL) {
+      return VIX_E_INVALID_ARG;
+   }
+   FakeFreeHandle(diskHandle);
+   pthread_mutex_lock(&fakeLock);
+   fakeOpenHandles--;
+   pthread_mutex_unlock(&fakeLock);
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Read(VixDiskLibHandle diskHandle, VixDiskLibSectorType startSector,
+                VixDiskLibSectorType numSectors, uint8 *readBuffer)
+{
+   size_t want = numSectors * VIXDISKLIB_SECTOR_SIZE;
+   off_t off = startSector * VIXDISKLIB_SECTOR_SIZE;
+   size_t done = 0;
+   VixError err;
+
+   if (startSector + numSectors > diskHandle->capacity) {
+      return VIX_E_DISK_OUTOFRANGE;
+   }
+   FakeSleepUs(FakeLatency(diskHandle->latencyUs));
+   if ((err = FakeFault(startSector, numSectors, 0)) != VIX_OK) {
+      return err;
+   }
+   FakeThrottle(diskHandle, want);
+   if (diskHandle->image) {
+      memcpy(readBuffer, diskHandle->image + off, want);
+      return VIX_OK;
+   }
+   while (done < want) {
+      ssize_t n = pread(diskHandle->fd, readBuffer + done, want - done, off + done);
+      if (n < 0) {
+         if (errno == EINTR) {
+            continue;
+         }
+         return FakeErrno();
+      }
+      if (n == 0) {
+         return VIX_E_HOST_FILE_ERROR_EOF;
+      }
+      done += n;
+   }
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Write(VixDiskLibHandle diskHandle, VixDiskLibSectorType startSector,
+                 VixDiskLibSectorType numSectors, const uint8 *writeBuffer)
+{
+   size_t want = numSectors * VIXDISKLIB_SECTOR_SIZE;
+   off_t off = startSector * VIXDISKLIB_SECTOR_SIZE;
+   size_t done = 0;
+   VixError err;
+
+   if (diskHandle->readOnly) {
+      return VIX_E_FILE_READ_ONLY;
+   }
+   if (startSector + numSectors > diskHandle->capacity) {
+      return VIX_E_DISK_OUTOFRANGE;
+   }
+   FakeSleepUs(FakeLatency(diskHandle->latencyUs));
+   if ((err = FakeFault(startSector, numSectors, 1)) != VIX_OK) {
+      return err;
+   }
+   FakeThrottle(diskHandle, want);
+   if (diskHandle->image) {
+      memcpy(diskHandle->image + off, writeBuffer, want);
+      return VIX_OK;
+   }
+   while (done < want) {
+      ssize_t n = pwrite(diskHandle->fd, writeBuffer + done, want - done, off + done);
+      if (n < 0) {
+         if (errno == EINTR) {
+            continue;
+         }
+         return FakeErrno();
+      }
+      done += n;
+   }
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_ReadMetadata(VixDiskLibHandle diskHandle, const char *key, char *buf,
+                        size_t bufLen, size_t *requiredLen)
+{
+   int i;
+
+   for (i = 0; i < diskHandle->nkeys; i++) {
+      if (strcmp(diskHandle->keys[i], key) == 0) {
+         size_t len = strlen(diskHandle->values[i]) + 1;
+         if (requiredLen) {
+            *requiredLen = len;
+         }
+         if (buf == NULL || bufLen < len) {
+            return VIX_E_BUFFER_TOOSMALL;
+         }
+         memcpy(buf, diskHandle->values[i], len);
+         return VIX_OK;
+      }
+   }
+   return VIX_E_DISK_KEY_NOTFOUND;
+}
+
+
+VixError
+VixDiskLib_WriteMetadata(VixDiskLibHandle diskHandle, const char *key,
+                         const char *val)
+{
+   FakeSetKey(diskHandle, key, val);
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_GetMetadataKeys(VixDiskLibHandle diskHandle, char *keys,
+                           size_t maxLen, size_t *requiredLen)
+{
+   size_t len = 1;
+   char *p = keys;
+   int i;
+
+   for (i = 0; i < diskHandle->nkeys; i++) {
+      len += strlen(diskHandle->keys[i]) + 1;
+   }
+   if (requiredLen) {
+      *requiredLen = len;
+   }
+   if (keys == NULL || maxLen < len) {
+      return VIX_E_BUFFER_TOOSMALL;
+   }
+   for (i = 0; i < diskHandle->nkeys; i++) {
+      size_t n = strlen(diskHandle->keys[i]) + 1;
+      memcpy(p, diskHandle->keys[i], n);
+      p += n;
+   }
+   *p = '\0';
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Unlink(VixDiskLibConnection connection, const char *path)
+{
+   return unlink(path) ? FakeErrno() : VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Grow(VixDiskLibConnection connection, const char *path,
+                VixDiskLibSectorType capacity, Bool updateGeometry,
+                VixDiskLibProgressFunc progressFunc, void *progressCallbackData)
+{
+   return truncate(path, (off_t)(capacity * VIXDISKLIB_SECTOR_SIZE)) ? FakeErrno() : VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Shrink(VixDiskLibHandle diskHandle, VixDiskLibProgressFunc progressFunc,
+                  void *progressCallbackData)
+{
+   if (progressFunc) {
+      progressFunc(progressCallbackData, 100);
+   }
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Defragment(VixDiskLibHandle diskHandle,
+                      VixDiskLibProgressFunc progressFunc,
+                      void *progressCallbackData)
+{
+   if (progressFunc) {
+      progressFunc(progressCallbackData, 100);
+   }
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Rename(const char *srcFileName, const char *dstFileName)
+{
+   return rename(srcFileName, dstFileName) ? FakeErrno() : VIX_OK;
+}
+
+
+VixError
+VixDiskLib_Clone(const VixDiskLibConnection dstConnection, const char *dstPath,
+                 const VixDiskLibConnection srcConnection, const char *srcPath,
+                 const VixDiskLibCreateParams *vixCreateParams,
+                 VixDiskLibProgressFunc progressFunc, void *progressCallbackData,
+                 Bool overWrite)
+{
+   char buf[65536];
+   VixError err = VIX_OK;
+   int in, out;
+   ssize_t n;
+
+   in = open(srcPath, O_RDONLY);
+   if (in < 0) {
+      return FakeErrno();
+   }
+   out = open(dstPath, O_WRONLY | O_CREAT | (overWrite ? O_TRUNC : O_EXCL), 0644);
+   if (out < 0) {
+      err = FakeErrno();
+      close(in);
+      return err;
+   }
+   while ((n = read(in, buf, sizeof buf)) > 0) {
+      if (write(out, buf, n) != n) {
+         err = FakeErrno();
+         break;
+      }
+   }
+   if (n < 0) {
+      err = FakeErrno();
+   }
+   close(in);
+   close(out);
+   if (err == VIX_OK && progressFunc) {
+      progressFunc(progressCallbackData, 100);
+   }
+   return err;
+}
+
+
+char *
+VixDiskLib_GetErrorText(VixError err, const char *locale)
+{
+   char buf[64];
+
+   snprintf(buf, sizeof buf, "fake vixDiskLib error %llu", (unsigned long long)err);
+   return strdup(buf);
+}
+
+
+void
+VixDiskLib_FreeErrorText(char *errMsg)
+{
+   free(errMsg);
+}
+
+
+VixError
+VixDiskLib_Attach(VixDiskLibHandle parent, VixDiskLibHandle child)
+{
+   return VIX_E_NOT_SUPPORTED;
+}
+
+
+VixError
+VixDiskLib_SpaceNeededForClone(VixDiskLibHandle diskHandle,
+                               VixDiskLibDiskType cloneDiskType,
+                               uint64 *spaceNeeded)
+{
+   *spaceNeeded = diskHandle->capacity * VIXDISKLIB_SECTOR_SIZE;
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_CheckRepair(const VixDiskLibConnection connection,
+                       const char *filename, Bool repair)
+{
+   return access(filename, R_OK) ? FakeErrno() : VIX_OK;
+}
+
+
+VixError
+VixDiskLib_GetConnectParams(const VixDiskLibConnection connection,
+                            VixDiskLibConnectParams **connectParams)
+{
+   *connectParams = calloc(1, sizeof **connectParams);
+   return *connectParams ? VIX_OK : VIX_E_OUT_OF_MEMORY;
+}
+
+
+void
+VixDiskLib_FreeConnectParams(VixDiskLibConnectParams *connectParams)
+{
+   free(connectParams);
+}
+
+
+/*
+ * Allocated blocks are the data regions of the (sparse) image file, rounded
+ * out to chunkSize.
+ */
+VixError
+VixDiskLib_QueryAllocatedBlocks(VixDiskLibHandle diskHandle,
+                                VixDiskLibSectorType startSector,
+                                VixDiskLibSectorType numSectors,
+                                VixDiskLibSectorType chunkSize,
+                                VixDiskLibBlockList **blockList)
+{
+   off_t pos = startSector * VIXDISKLIB_SECTOR_SIZE;
+   off_t end = (startSector + numSectors) * VIXDISKLIB_SECTOR_SIZE;
+   off_t chunk = chunkSize * VIXDISKLIB_SECTOR_SIZE;
+   VixDiskLibBlockList *list;
+   uint32 max = 16;
+
+   if (chunkSize < 128 || startSector % chunkSize || numSectors % chunkSize ||
+       startSector + numSectors > diskHandle->capacity) {
+      return VIX_E_INVALID_ARG;
+   }
+   list = malloc(sizeof *list + max * sizeof list->blocks[0]);
+   if (list == NULL) {
+      return VIX_E_OUT_OF_MEMORY;
+   }
+   list->numBlocks = 0;
+
+   while (pos < end) {
+      off_t data = lseek(diskHandle->fd, pos, SEEK_DATA);
+      off_t hole;
+
+      if (data < 0 || data >= end) {
+         break;
+      }
+      hole = lseek(diskHandle->fd, data, SEEK_HOLE);
+      if (hole < 0 || hole > end) {
+         hole = end;
+      }
+      data -= data % chunk;
+      hole += (chunk - hole % chunk) % chunk;
+      if (hole > end) {
+         hole = end;
+      }
+      if (list->numBlocks == max) {
+         VixDiskLibBlockList *grown;
+         max *= 2;
+         grown = realloc(list, sizeof *list + max * sizeof list->blocks[0]);
+         if (grown == NULL) {
+            free(list);
+            return VIX_E_OUT_OF_MEMORY;
+         }
+         list = grown;
+      }
+      list->blocks[list->numBlocks].offset = data / VIXDISKLIB_SECTOR_SIZE;
+      list->blocks[list->numBlocks].length = (hole - data) / VIXDISKLIB_SECTOR_SIZE;
+      list->numBlocks++;
+      pos = hole;
+   }
+   *blockList = list;
+   return VIX_OK;
+}
+
+
+VixError
+VixDiskLib_FreeBlockList(VixDiskLibBlockList *blockList)
+{
+   free(blockList);
+   return VIX_OK;
+}
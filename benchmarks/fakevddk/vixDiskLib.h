@@ -0,0 +1,459 @@
+/*
+ * vixDiskLib.h - stand-in declarations for the VMware VDDK API.
+ *
+ * Only what vixDiskLib/vddk.pxd declares is provided here.  This header (and
+ * fakeVixDiskLib.c) let the extension be built and benchmarked on machines
+ * without the proprietary VDDK.  It is *not* the VMware header.
+ */
+#ifndef _FAKE_VIXDISKLIB_H_
+#define _FAKE_VIXDISKLIB_H_
+
+#include <stdarg.h>
+#include <stddef.h>
+#include <stdint.h>
+
+typedef uint8_t  uint8;
+typedef uint16_t uint16;
+typedef uint32_t uint32;
+typedef uint64_t uint64;
+typedef int8_t   int8;
+typedef int16_t  int16;
+typedef int32_t  int32;
+typedef int64_t  int64;
+typedef char     Bool;
+
+typedef uint64 VixError;
+typedef uint64 VixDiskLibSectorType;
+
+#define VIXDISKLIB_SECTOR_SIZE 512
+
+typedef enum {
+   VIXDISKLIB_FLAG_OPEN_UNBUFFERED  = 1,
+   VIXDISKLIB_FLAG_OPEN_SINGLE_LINK = 2,
+   VIXDISKLIB_FLAG_OPEN_READ_ONLY   = 4
+} VIXDISKLIB_OPEN_FLAGS;
+
+#define VIX_OK                                        0
+#define VIX_E_FAIL                                    1
+#define VIX_E_OUT_OF_MEMORY                           2
+#define VIX_E_INVALID_ARG                             3
+#define VIX_E_FILE_NOT_FOUND                          4
+#define VIX_E_OBJECT_IS_BUSY                          5
+#define VIX_E_NOT_SUPPORTED                           6
+#define VIX_E_FILE_ERROR                              7
+#define VIX_E_DISK_FULL                               8
+#define VIX_E_INCORRECT_FILE_TYPE                     9
+#define VIX_E_CANCELLED                               10
+#define VIX_E_FILE_READ_ONLY                          11
+#define VIX_E_FILE_ALREADY_EXISTS                     12
+#define VIX_E_FILE_ACCESS_ERROR                       13
+#define VIX_E_REQUIRES_LARGE_FILES                    14
+#define VIX_E_FILE_ALREADY_LOCKED                     15
+#define VIX_E_VMDB                                    16
+#define VIX_E_NOT_SUPPORTED_ON_REMOTE_OBJECT          20
+#define VIX_E_FILE_TOO_BIG                            21
+#define VIX_E_FILE_NAME_INVALID                       22
+#define VIX_E_ALREADY_EXISTS                          23
+#define VIX_E_BUFFER_TOOSMALL                         24
+#define VIX_E_OBJECT_NOT_FOUND                        25
+#define VIX_E_HOST_NOT_CONNECTED                      26
+#define VIX_E_INVALID_UTF8_STRING                     27
+#define VIX_E_OPERATION_ALREADY_IN_PROGRESS           31
+#define VIX_E_UNFINISHED_JOB                          29
+#define VIX_E_NEED_KEY                                30
+#define VIX_E_LICENSE                                 32
+#define VIX_E_VM_HOST_DISCONNECTED                    34
+#define VIX_E_AUTHENTICATION_FAIL                     35
+#define VIX_E_INVALID_HANDLE                          1000
+#define VIX_E_NOT_SUPPORTED_ON_HANDLE_TYPE            1001
+#define VIX_E_TOO_MANY_HANDLES                        1002
+#define VIX_E_NOT_FOUND                               2000
+#define VIX_E_TYPE_MISMATCH                           2001
+#define VIX_E_INVALID_XML                             2002
+#define VIX_E_TIMEOUT_WAITING_FOR_TOOLS               3000
+#define VIX_E_UNRECOGNIZED_COMMAND                    3001
+#define VIX_E_OP_NOT_SUPPORTED_ON_GUEST               3003
+#define VIX_E_PROGRAM_NOT_STARTED                     3004
+#define VIX_E_CANNOT_START_READ_ONLY_VM               3005
+#define VIX_E_VM_NOT_RUNNING                          3006
+#define VIX_E_VM_IS_RUNNING                           3007
+#define VIX_E_CANNOT_CONNECT_TO_VM                    3008
+#define VIX_E_POWEROP_SCRIPTS_NOT_AVAILABLE           3009
+#define VIX_E_NO_GUEST_OS_INSTALLED                   3010
+#define VIX_E_VM_INSUFFICIENT_HOST_MEMORY             3011
+#define VIX_E_SUSPEND_ERROR                           3012
+#define VIX_E_VM_NOT_ENOUGH_CPUS                      3013
+#define VIX_E_HOST_USER_PERMISSIONS                   3014
+#define VIX_E_GUEST_USER_PERMISSIONS                  3015
+#define VIX_E_TOOLS_NOT_RUNNING                       3016
+#define VIX_E_GUEST_OPERATIONS_PROHIBITED             3017
+#define VIX_E_ANON_GUEST_OPERATIONS_PROHIBITED        3018
+#define VIX_E_ROOT_GUEST_OPERATIONS_PROHIBITED        3019
+#define VIX_E_MISSING_ANON_GUEST_ACCOUNT              3023
+#define VIX_E_CANNOT_AUTHENTICATE_WITH_GUEST          3024
+#define VIX_E_UNRECOGNIZED_COMMAND_IN_GUEST           3025
+#define VIX_E_CONSOLE_GUEST_OPERATIONS_PROHIBITED     3026
+#define VIX_E_MUST_BE_CONSOLE_USER                    3027
+#define VIX_E_VMX_MSG_DIALOG_AND_NO_UI                3028
+#define VIX_E_NOT_ALLOWED_DURING_VM_RECORDING         3029
+#define VIX_E_NOT_ALLOWED_DURING_VM_REPLAY            3030
+#define VIX_E_OPERATION_NOT_ALLOWED_FOR_LOGIN_TYPE    3031
+#define VIX_E_LOGIN_TYPE_NOT_SUPPORTED                3032
+#define VIX_E_EMPTY_PASSWORD_NOT_ALLOWED_IN_GUEST     3033
+#define VIX_E_INTERACTIVE_SESSION_NOT_PRESENT         3034
+#define VIX_E_INTERACTIVE_SESSION_USER_MISMATCH       3035
+#define VIX_E_UNABLE_TO_REPLAY_VM                     3039
+#define VIX_E_CANNOT_POWER_ON_VM                      3041
+#define VIX_E_NO_DISPLAY_SERVER                       3043
+#define VIX_E_VM_NOT_RECORDING                        3044
+#define VIX_E_VM_NOT_REPLAYING                        3045
+#define VIX_E_VM_NOT_FOUND                            4000
+#define VIX_E_NOT_SUPPORTED_FOR_VM_VERSION            4001
+#define VIX_E_CANNOT_READ_VM_CONFIG                   4002
+#define VIX_E_TEMPLATE_VM                             4003
+#define VIX_E_VM_ALREADY_LOADED                       4004
+#define VIX_E_VM_ALREADY_UP_TO_DATE                   4006
+#define VIX_E_UNRECOGNIZED_PROPERTY                   6000
+#define VIX_E_INVALID_PROPERTY_VALUE                  6001
+#define VIX_E_READ_ONLY_PROPERTY                      6002
+#define VIX_E_MISSING_REQUIRED_PROPERTY               6003
+#define VIX_E_INVALID_SERIALIZED_DATA                 6004
+#define VIX_E_BAD_VM_INDEX                            8000
+#define VIX_E_INVALID_MESSAGE_HEADER                  10000
+#define VIX_E_INVALID_MESSAGE_BODY                    10001
+#define VIX_E_SNAPSHOT_INVAL                          13000
+#define VIX_E_SNAPSHOT_DUMPER                         13001
+#define VIX_E_SNAPSHOT_DISKLIB                        13002
+#define VIX_E_SNAPSHOT_NOTFOUND                       13003
+#define VIX_E_SNAPSHOT_EXISTS                         13004
+#define VIX_E_SNAPSHOT_VERSION                        13005
+#define VIX_E_SNAPSHOT_NOPERM                         13006
+#define VIX_E_SNAPSHOT_CONFIG                         13007
+#define VIX_E_SNAPSHOT_NOCHANGE                       13008
+#define VIX_E_SNAPSHOT_CHECKPOINT                     13009
+#define VIX_E_SNAPSHOT_LOCKED                         13010
+#define VIX_E_SNAPSHOT_INCONSISTENT                   13011
+#define VIX_E_SNAPSHOT_NAMETOOLONG                    13012
+#define VIX_E_SNAPSHOT_VIXFILE                        13013
+#define VIX_E_SNAPSHOT_DISKLOCKED                     13014
+#define VIX_E_SNAPSHOT_DUPLICATEDDISK                 13015
+#define VIX_E_SNAPSHOT_INDEPENDENTDISK                13016
+#define VIX_E_SNAPSHOT_NONUNIQUE_NAME                 13017
+#define VIX_E_SNAPSHOT_MEMORY_ON_INDEPENDENT_DISK     13018
+#define VIX_E_SNAPSHOT_MAXSNAPSHOTS                   13019
+#define VIX_E_SNAPSHOT_MIN_FREE_SPACE                 13020
+#define VIX_E_HOST_DISK_INVALID_VALUE                 14003
+#define VIX_E_HOST_DISK_SECTORSIZE                    14004
+#define VIX_E_HOST_FILE_ERROR_EOF                     14005
+#define VIX_E_HOST_NETBLKDEV_HANDSHAKE                14006
+#define VIX_E_HOST_SOCKET_CREATION_ERROR              14007
+#define VIX_E_HOST_SERVER_NOT_FOUND                   14008
+#define VIX_E_HOST_NETWORK_CONN_REFUSED               14009
+#define VIX_E_HOST_TCP_SOCKET_ERROR                   14010
+#define VIX_E_HOST_TCP_CONN_LOST                      14011
+#define VIX_E_HOST_NBD_HASHFILE_VOLUME                14012
+#define VIX_E_HOST_NBD_HASHFILE_INIT                  14013
+#define VIX_E_DISK_INVAL                              16000
+#define VIX_E_DISK_NOINIT                             16001
+#define VIX_E_DISK_NOIO                               16002
+#define VIX_E_DISK_PARTIALCHAIN                       16003
+#define VIX_E_DISK_NEEDSREPAIR                        16006
+#define VIX_E_DISK_OUTOFRANGE                         16007
+#define VIX_E_DISK_CID_MISMATCH                       16008
+#define VIX_E_DISK_CANTSHRINK                         16009
+#define VIX_E_DISK_PARTMISMATCH                       16010
+#define VIX_E_DISK_UNSUPPORTEDDISKVERSION             16011
+#define VIX_E_DISK_OPENPARENT                         16012
+#define VIX_E_DISK_NOTSUPPORTED                       16013
+#define VIX_E_DISK_NEEDKEY                            16014
+#define VIX_E_DISK_NOKEYOVERRIDE                      16015
+#define VIX_E_DISK_NOTENCRYPTED                       16016
+#define VIX_E_DISK_NOKEY                              16017
+#define VIX_E_DISK_INVALIDPARTITIONTABLE              16018
+#define VIX_E_DISK_NOTNORMAL                          16019
+#define VIX_E_DISK_NOTENCDESC                         16020
+#define VIX_E_DISK_NEEDVMFS                           16022
+#define VIX_E_DISK_RAWTOOBIG                          16024
+#define VIX_E_DISK_TOOMANYOPENFILES                   16027
+#define VIX_E_DISK_TOOMANYREDO                        16028
+#define VIX_E_DISK_RAWTOOSMALL                        16029
+#define VIX_E_DISK_INVALIDCHAIN                       16030
+#define VIX_E_DISK_KEY_NOTFOUND                       16052
+#define VIX_E_DISK_SUBSYSTEM_INIT_FAIL                16053
+#define VIX_E_DISK_INVALID_CONNECTION                 16054
+#define VIX_E_DISK_ENCODING                           16061
+#define VIX_E_DISK_CANTREPAIR                         16062
+#define VIX_E_DISK_INVALIDDISK                        16063
+#define VIX_E_DISK_NOLICENSE                          16064
+#define VIX_E_DISK_NODEVICE                           16065
+#define VIX_E_DISK_UNSUPPORTEDDEVICE                  16066
+#define VIX_E_CRYPTO_UNKNOWN_ALGORITHM                17000
+#define VIX_E_CRYPTO_BAD_BUFFER_SIZE                  17001
+#define VIX_E_CRYPTO_INVALID_OPERATION                17002
+#define VIX_E_CRYPTO_RANDOM_DEVICE                    17003
+#define VIX_E_CRYPTO_NEED_PASSWORD                    17004
+#define VIX_E_CRYPTO_BAD_PASSWORD                     17005
+#define VIX_E_CRYPTO_NOT_IN_DICTIONARY                17006
+#define VIX_E_CRYPTO_NO_CRYPTO                        17007
+#define VIX_E_CRYPTO_ERROR                            17008
+#define VIX_E_CRYPTO_BAD_FORMAT                       17009
+#define VIX_E_CRYPTO_LOCKED                           17010
+#define VIX_E_CRYPTO_EMPTY                            17011
+#define VIX_E_CRYPTO_KEYSAFE_LOCATOR                  17012
+#define VIX_E_CANNOT_CONNECT_TO_HOST                  18000
+#define VIX_E_NOT_FOR_REMOTE_HOST                     18001
+#define VIX_E_INVALID_HOSTNAME_SPECIFICATION          18002
+#define VIX_E_SCREEN_CAPTURE_ERROR                    19000
+#define VIX_E_SCREEN_CAPTURE_BAD_FORMAT               19001
+#define VIX_E_SCREEN_CAPTURE_COMPRESSION_FAIL         19002
+#define VIX_E_SCREEN_CAPTURE_LARGE_DATA               19003
+#define VIX_E_GUEST_VOLUMES_NOT_FROZEN                20000
+#define VIX_E_NOT_A_FILE                              20001
+#define VIX_E_NOT_A_DIRECTORY                         20002
+#define VIX_E_NO_SUCH_PROCESS                         20003
+#define VIX_E_FILE_NAME_TOO_LONG                      20004
+#define VIX_E_TOOLS_INSTALL_NO_IMAGE                  21000
+#define VIX_E_TOOLS_INSTALL_IMAGE_INACCESIBLE         21001
+#define VIX_E_TOOLS_INSTALL_NO_DEVICE                 21002
+#define VIX_E_TOOLS_INSTALL_DEVICE_NOT_CONNECTED      21003
+#define VIX_E_TOOLS_INSTALL_CANCELLED                 21004
+#define VIX_E_TOOLS_INSTALL_INIT_FAILED               21005
+#define VIX_E_TOOLS_INSTALL_AUTO_NOT_SUPPORTED        21006
+#define VIX_E_TOOLS_INSTALL_GUEST_NOT_READY           21007
+#define VIX_E_TOOLS_INSTALL_SIG_CHECK_FAILED          21008
+#define VIX_E_TOOLS_INSTALL_ERROR                     21009
+#define VIX_E_TOOLS_INSTALL_ALREADY_UP_TO_DATE        21010
+#define VIX_E_TOOLS_INSTALL_IN_PROGRESS               21011
+#define VIX_E_WRAPPER_WORKSTATION_NOT_INSTALLED       22001
+#define VIX_E_WRAPPER_VERSION_NOT_FOUND               22002
+#define VIX_E_WRAPPER_SERVICEPROVIDER_NOT_FOUND       22003
+#define VIX_E_WRAPPER_PLAYER_NOT_INSTALLED            22004
+#define VIX_E_MNTAPI_MOUNTPT_NOT_FOUND                24000
+#define VIX_E_MNTAPI_MOUNTPT_IN_USE                   24001
+#define VIX_E_MNTAPI_DISK_NOT_FOUND                   24002
+#define VIX_E_MNTAPI_DISK_NOT_MOUNTED                 24003
+#define VIX_E_MNTAPI_DISK_IS_MOUNTED                  24004
+#define VIX_E_MNTAPI_DISK_NOT_SAFE                    24005
+#define VIX_E_MNTAPI_DISK_CANT_OPEN                   24006
+#define VIX_E_MNTAPI_CANT_READ_PARTS                  24007
+#define VIX_E_MNTAPI_UMOUNT_APP_NOT_FOUND             24008
+#define VIX_E_MNTAPI_UMOUNT                           24009
+#define VIX_E_MNTAPI_NO_MOUNTABLE_PARTITONS           24010
+#define VIX_E_MNTAPI_PARTITION_RANGE                  24011
+#define VIX_E_MNTAPI_PERM                             24012
+#define VIX_E_MNTAPI_DICT                             24013
+#define VIX_E_MNTAPI_DICT_LOCKED                      24014
+#define VIX_E_MNTAPI_OPEN_HANDLES                     24015
+#define VIX_E_MNTAPI_CANT_MAKE_VAR_DIR                24016
+#define VIX_E_MNTAPI_NO_ROOT                          24017
+#define VIX_E_MNTAPI_LOOP_FAILED                      24018
+#define VIX_E_MNTAPI_DAEMON                           24019
+#define VIX_E_MNTAPI_INTERNAL                         24020
+#define VIX_E_MNTAPI_SYSTEM                           24021
+#define VIX_E_MNTAPI_NO_CONNECTION_DETAILS            24022
+#define VIX_E_MNTAPI_INCOMPATIBLE_VERSION             24300
+#define VIX_E_MNTAPI_OS_ERROR                         24301
+#define VIX_E_MNTAPI_DRIVE_LETTER_IN_USE              24302
+#define VIX_E_MNTAPI_DRIVE_LETTER_ALREADY_ASSIGNED    24303
+#define VIX_E_MNTAPI_VOLUME_NOT_MOUNTED               24304
+#define VIX_E_MNTAPI_VOLUME_ALREADY_MOUNTED           24305
+#define VIX_E_MNTAPI_FORMAT_FAILURE                   24306
+#define VIX_E_MNTAPI_NO_DRIVER                        24307
+#define VIX_E_MNTAPI_ALREADY_OPENED                   24308
+#define VIX_E_MNTAPI_ITEM_NOT_FOUND                   24309
+#define VIX_E_MNTAPI_UNSUPPROTED_BOOT_LOADER          24310
+#define VIX_E_MNTAPI_UNSUPPROTED_OS                   24311
+#define VIX_E_MNTAPI_CODECONVERSION                   24312
+#define VIX_E_MNTAPI_REGWRITE_ERROR                   24313
+#define VIX_E_MNTAPI_UNSUPPORTED_FT_VOLUME            24314
+#define VIX_E_MNTAPI_PARTITION_NOT_FOUND              24315
+#define VIX_E_MNTAPI_PUTFILE_ERROR                    24316
+#define VIX_E_MNTAPI_GETFILE_ERROR                    24317
+#define VIX_E_MNTAPI_REG_NOT_OPENED                   24318
+#define VIX_E_MNTAPI_REGDELKEY_ERROR                  24319
+#define VIX_E_MNTAPI_CREATE_PARTITIONTABLE_ERROR      24320
+#define VIX_E_MNTAPI_OPEN_FAILURE                     24321
+#define VIX_E_MNTAPI_VOLUME_NOT_WRITABLE              24322
+
+typedef struct {
+   uint32 cylinders;
+   uint32 heads;
+   uint32 sectors;
+} VixDiskLibGeometry;
+
+typedef enum {
+   VIXDISKLIB_DISK_MONOLITHIC_SPARSE = 1,
+   VIXDISKLIB_DISK_MONOLITHIC_FLAT   = 2,
+   VIXDISKLIB_DISK_SPLIT_SPARSE      = 3,
+   VIXDISKLIB_DISK_SPLIT_FLAT        = 4,
+   VIXDISKLIB_DISK_VMFS_FLAT         = 5,
+   VIXDISKLIB_DISK_STREAM_OPTIMIZED  = 6,
+   VIXDISKLIB_DISK_VMFS_THIN         = 7,
+   VIXDISKLIB_DISK_VMFS_SPARSE       = 8,
+   VIXDISKLIB_DISK_UNKNOWN           = 256
+} VixDiskLibDiskType;
+
+typedef enum {
+   VIXDISKLIB_ADAPTER_IDE            = 1,
+   VIXDISKLIB_ADAPTER_SCSI_BUSLOGIC  = 2,
+   VIXDISKLIB_ADAPTER_SCSI_LSILOGIC  = 3,
+   VIXDISKLIB_ADAPTER_UNKNOWN        = 256
+} VixDiskLibAdapterType;
+
+typedef struct {
+   VixDiskLibDiskType    diskType;
+   VixDiskLibAdapterType adapterType;
+   uint16                hwVersion;
+   VixDiskLibSectorType  capacity;
+} VixDiskLibCreateParams;
+
+typedef enum {
+   VIXDISKLIB_CRED_UID       = 1,
+   VIXDISKLIB_CRED_SESSIONID = 2,
+   VIXDISKLIB_CRED_TICKETID  = 3,
+   VIXDISKLIB_CRED_SSPI      = 4,
+   VIXDISKLIB_CRED_UNKNOWN   = 256
+} VixDiskLibCredType;
+
+typedef struct {
+   char *userName;
+   char *password;
+} VixDiskLibUidPasswdCreds;
+
+typedef struct {
+   char *cookie;
+   char *userName;
+   char *key;
+} VixDiskLibSessionIdCreds;
+
+typedef union {
+   VixDiskLibUidPasswdCreds uid;
+   VixDiskLibSessionIdCreds sessionId;
+} VixDiskLibCreds;
+
+typedef struct {
+   char *vmxSpec;
+   char *serverName;
+   VixDiskLibCredType credType;
+   VixDiskLibCreds creds;
+   uint32 port;
+} VixDiskLibConnectParams;
+
+typedef struct {
+   VixDiskLibGeometry    biosGeo;
+   VixDiskLibGeometry    physGeo;
+   VixDiskLibSectorType  capacity;
+   VixDiskLibAdapterType adapterType;
+   int                   numLinks;
+   char                 *parentFileNameHint;
+} VixDiskLibInfo;
+
+typedef struct {
+   VixDiskLibSectorType offset;
+   VixDiskLibSectorType length;
+} VixDiskLibBlock;
+
+typedef struct {
+   uint32 numBlocks;
+   VixDiskLibBlock blocks[1];
+} VixDiskLibBlockList;
+
+typedef struct VixDiskLibHandleStruct VixDiskLibHandleStruct;
+typedef VixDiskLibHandleStruct *VixDiskLibHandle;
+
+struct VixDiskLibConnectParam;
+typedef struct VixDiskLibConnectParam *VixDiskLibConnection;
+
+typedef void (VixDiskLibGenericLogFunc)(const char *fmt, va_list args);
+typedef Bool (*VixDiskLibProgressFunc)(void *progressData, int percentCompleted);
+
+VixError VixDiskLib_InitEx(uint32 majorVersion, uint32 minorVersion,
+                           VixDiskLibGenericLogFunc *log,
+                           VixDiskLibGenericLogFunc *warn,
+                           VixDiskLibGenericLogFunc *panic,
+                           const char *libDir, const char *configFile);
+VixError VixDiskLib_Init(uint32 majorVersion, uint32 minorVersion,
+                         VixDiskLibGenericLogFunc *log,
+                         VixDiskLibGenericLogFunc *warn,
+                         VixDiskLibGenericLogFunc *panic,
+                         const char *libDir);
+void VixDiskLib_Exit(void);
+const char *VixDiskLib_ListTransportModes(void);
+VixError VixDiskLib_Cleanup(const VixDiskLibConnectParams *connectParams,
+                            uint32 *numCleanedUp, uint32 *numRemaining);
+VixError VixDiskLib_Connect(const VixDiskLibConnectParams *connectParams,
+                            VixDiskLibConnection *connection);
+VixError VixDiskLib_ConnectEx(const VixDiskLibConnectParams *connectParams,
+                              Bool readOnly, const char *snapshotRef,
+                              const char *transportModes,
+                              VixDiskLibConnection *connection);
+VixError VixDiskLib_Disconnect(VixDiskLibConnection connection);
+VixError VixDiskLib_Create(const VixDiskLibConnection connection,
+                           const char *path,
+                           const VixDiskLibCreateParams *createParams,
+                           VixDiskLibProgressFunc progressFunc,
+                           void *progressCallbackData);
+VixError VixDiskLib_CreateChild(VixDiskLibHandle diskHandle,
+                                const char *childPath,
+                                VixDiskLibDiskType diskType,
+                                VixDiskLibProgressFunc progressFunc,
+                                void *progressCallbackData);
+VixError VixDiskLib_Open(const VixDiskLibConnection connection,
+                         const char *path, uint32 flags,
+                         VixDiskLibHandle *diskHandle);
+VixError VixDiskLib_GetInfo(VixDiskLibHandle diskHandle, VixDiskLibInfo **info);
+void VixDiskLib_FreeInfo(VixDiskLibInfo *info);
+const char *VixDiskLib_GetTransportMode(VixDiskLibHandle diskHandle);
+VixError VixDiskLib_Close(VixDiskLibHandle diskHandle);
+VixError VixDiskLib_Read(VixDiskLibHandle diskHandle,
+                         VixDiskLibSectorType startSector,
+                         VixDiskLibSectorType numSectors,
+                         uint8 *readBuffer);
+VixError VixDiskLib_Write(VixDiskLibHandle diskHandle,
+                          VixDiskLibSectorType startSector,
+                          VixDiskLibSectorType numSectors,
+                          const uint8 *writeBuffer);
+VixError VixDiskLib_ReadMetadata(VixDiskLibHandle diskHandle, const char *key,
+                                 char *buf, size_t bufLen, size_t *requiredLen);
+VixError VixDiskLib_WriteMetadata(VixDiskLibHandle diskHandle, const char *key,
+                                  const char *val);
+VixError VixDiskLib_GetMetadataKeys(VixDiskLibHandle diskHandle, char *keys,
+                                    size_t maxLen, size_t *requiredLen);
+VixError VixDiskLib_Unlink(VixDiskLibConnection connection, const char *path);
+VixError VixDiskLib_Grow(VixDiskLibConnection connection, const char *path,
+                         VixDiskLibSectorType capacity, Bool updateGeometry,
+                         VixDiskLibProgressFunc progressFunc,
+                         void *progressCallbackData);
+VixError VixDiskLib_Shrink(VixDiskLibHandle diskHandle,
+                           VixDiskLibProgressFunc progressFunc,
+                           void *progressCallbackData);
+VixError VixDiskLib_Defragment(VixDiskLibHandle diskHandle,
+                               VixDiskLibProgressFunc progressFunc,
+                               void *progressCallbackData);
+VixError VixDiskLib_Rename(const char *srcFileName, const char *dstFileName);
+VixError VixDiskLib_Clone(const VixDiskLibConnection dstConnection,
+                          const char *dstPath,
+                          const VixDiskLibConnection srcConnection,
+                          const char *srcPath,
+                          const VixDiskLibCreateParams *vixCreateParams,
+                          VixDiskLibProgressFunc progressFunc,
+                          void *progressCallbackData, Bool overWrite);
+char *VixDiskLib_GetErrorText(VixError err, const char *locale);
+void VixDiskLib_FreeErrorText(char *errMsg);
+VixError VixDiskLib_Attach(VixDiskLibHandle parent, VixDiskLibHandle child);
+VixError VixDiskLib_SpaceNeededForClone(VixDiskLibHandle diskHandle,
+                                        VixDiskLibDiskType cloneDiskType,
+                                        uint64 *spaceNeeded);
+VixError VixDiskLib_CheckRepair(const VixDiskLibConnection connection,
+                                const char *filename, Bool repair);
+VixError VixDiskLib_GetConnectParams(const VixDiskLibConnection connection,
+                                     VixDiskLibConnectParams **connectParams);
+void VixDiskLib_FreeConnectParams(VixDiskLibConnectParams *connectParams);
+VixError VixDiskLib_QueryAllocatedBlocks(VixDiskLibHandle diskHandle,
+                                         VixDiskLibSectorType startSector,
+                                         VixDiskLibSectorType numSectors,
+                                         VixDiskLibSectorType chunkSize,
+                                         VixDiskLibBlockList **blockList);
+VixError VixDiskLib_FreeBlockList(VixDiskLibBlockList *blockList);
+
+#endif /* _FAKE_VIXDISKLIB_H_ */
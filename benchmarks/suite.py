@@ -0,0 +1,178 @@
+'''
+Benchmark suite for the read/write hot paths, with JSON output.
+
+Runs against the stand-in library in benchmarks/fakevddk, so no VDDK install or
+vSphere lab is needed, and measures:
+
+  * the per call cost of read() and write() at block sizes from 512B to 8MB
+  * VixDisk.iter() throughput, with and without read-ahead
+  * info() and getMetadata() latency
+  * aggregate read throughput with 1 to 8 threads, one handle each, over a transport
+    with FAKE_VDDK_SCALING_LATENCY_US of latency per call
+
+By default the images are mapped into memory by the library (FAKE_VDDK_MEMORY), so the
+numbers are the cost of the bindings rather than of the page cache.
+
+Every result is a metric with a name, a value, a unit and which direction is better.
+Save a run with -o, and compare two runs with compare.py to catch regressions.
+
+Run with "make bench-json".
+'''
+import os, sys, time, json, platform, threading, tempfile, shutil
+from optparse import OptionParser
+
+# must be set before the library is initialized; only the scaling runs have latency
+os.environ.setdefault("FAKE_VDDK_LATENCY_US", "0")
+os.environ.setdefault("FAKE_VDDK_MEMORY", "1")
+os.environ.setdefault("FAKE_VDDK_SCALING_LATENCY_US", "2000")
+os.environ.setdefault("FAKE_VDDK_TRANSPORTS", "nbd=%s" % os.environ["FAKE_VDDK_SCALING_LATENCY_US"])
+
+import numpy as np
+
+from vixDiskLib import VixDisk
+from bench_threads import create_disk, MB
+
+SIZES = [512 << (2 * i) for i in xrange(8)]     # 512B, 2K, ... 8MB
+# every measurement is taken this many times and the best kept, to damp the noise
+REPEAT = 3
+
+class Results(object):
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, name, value, unit, better):
+        self.metrics.append(dict(name=name, value=value, unit=unit, better=better))
+        print "%-36s %14.2f %s" % (name, value, unit)
+
+def timed(fn, min_time, min_calls=10, repeat=REPEAT):
+    """
+    Calls fn() until both min_time and min_calls are reached, `repeat` times over, and
+    returns (calls, seconds) of the fastest round.
+    """
+    best = None
+    for _ in xrange(max(1, repeat)):
+        calls = 0
+        start = time.time()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.time() - start
+            if elapsed >= min_time and calls >= min_calls:
+                break
+        if best is None or elapsed / calls < best[1] / best[0]:
+            best = (calls, elapsed)
+    return best
+
+def open_disk(path, block_size=1024, readonly=True, transport=None):
+    disk = VixDisk(block_size=block_size)
+    disk.connect(transport=transport, readonly=readonly)
+    disk.open(path)
+    return disk
+
+def bench_calls(results, path, image_size, min_time, repeat=REPEAT):
+    for size in SIZES:
+        disk = open_disk(path, size, readonly=False)
+        blocks = image_size // size
+        state = dict(block=0)
+
+        def read():
+            disk.read(state['block'])
+            state['block'] = (state['block'] + 1) % blocks
+        calls, elapsed = timed(read, min_time, repeat=repeat)
+        results.add("read.%d.us_per_call" % size, elapsed * 1e6 / calls, "us", "lower")
+        results.add("read.%d.mbps" % size, calls * size / elapsed / MB, "MB/s", "higher")
+
+        buff = np.ones(size, dtype=np.uint8)
+        def write():
+            disk.write(state['block'], 1, buff)
+            state['block'] = (state['block'] + 1) % blocks
+        calls, elapsed = timed(write, min_time, repeat=repeat)
+        results.add("write.%d.us_per_call" % size, elapsed * 1e6 / calls, "us", "lower")
+        results.add("write.%d.mbps" % size, calls * size / elapsed / MB, "MB/s", "higher")
+
+        disk.close()
+        disk.disconnect()
+
+def bench_iter(results, path, image_size, min_time, repeat=REPEAT):
+    disk = open_disk(path, MB)
+    for prefetch in (0, 2):
+        def scan():
+            for _ in disk.iter(nblocks=1, prefetch=prefetch):
+                pass
+        calls, elapsed = timed(scan, min_time, min_calls=2, repeat=repeat)
+        results.add("iter.prefetch%d.mbps" % prefetch, calls * image_size / elapsed / MB, "MB/s", "higher")
+    disk.close()
+    disk.disconnect()
+
+def bench_info(results, path, min_time, repeat=REPEAT):
+    disk = open_disk(path)
+    calls, elapsed = timed(disk.info, min_time, min_calls=100, repeat=repeat)
+    results.add("info.us_per_call", elapsed * 1e6 / calls, "us", "lower")
+    calls, elapsed = timed(disk.getMetadata, min_time, min_calls=100, repeat=repeat)
+    results.add("getMetadata.us_per_call", elapsed * 1e6 / calls, "us", "lower")
+    disk.close()
+    disk.disconnect()
+
+def bench_threads(results, paths, image_size, counts):
+    base = None
+    for count in counts:
+        disks = [open_disk(path, MB, transport="nbd") for path in paths[:count]]
+
+        def scan(disk):
+            for block in xrange(image_size // MB):
+                disk.read(block)
+        threads = [threading.Thread(target=scan, args=(disk,)) for disk in disks]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        rate = count * image_size / (time.time() - start) / MB
+        base = base or rate
+        results.add("threads.%d.mbps" % count, rate, "MB/s", "higher")
+        results.add("threads.%d.speedup" % count, rate / base, "x", "higher")
+
+        for disk in disks:
+            disk.close()
+            disk.disconnect()
+
+def main(argv=None):
+    parser = OptionParser()
+    parser.add_option("-o", "--output", help="write the results to this JSON file")
+    parser.add_option("-m", "--image-mb", type="int", default=64, help="image size in MB")
+    parser.add_option("-t", "--threads", default="1,2,4,8", help="comma separated thread counts")
+    parser.add_option("--min-time", type="float", default=0.2, help="seconds to run each measurement")
+    parser.add_option("-r", "--repeat", type="int", default=REPEAT, help="rounds per measurement, the best is kept")
+    options, _ = parser.parse_args(argv)
+
+    counts = [int(c) for c in options.threads.split(",")]
+    image_size = options.image_mb * MB
+    workdir = tempfile.mkdtemp(prefix="vixbench-")
+    results = Results()
+    try:
+        paths = [os.path.join(workdir, "disk%d.vmdk" % i) for i in xrange(max(counts))]
+        create_disk(paths[0], options.image_mb, MB)
+        # the scaling images are read end to end by every thread, keep them small
+        for path in paths[1:]:
+            create_disk(path, 8, MB)
+
+        bench_calls(results, paths[0], image_size, options.min_time, options.repeat)
+        bench_iter(results, paths[0], image_size, options.min_time, options.repeat)
+        bench_info(results, paths[0], options.min_time, options.repeat)
+        bench_threads(results, [paths[0]] + paths[1:], 8 * MB, counts)
+    finally:
+        shutil.rmtree(workdir)
+
+    if options.output:
+        report = dict(
+            created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            python=platform.python_version(),
+            numpy=np.__version__,
+            machine=platform.platform(),
+            environment=dict((k, v) for k, v in os.environ.items() if k.startswith("FAKE_VDDK_")),
+            metrics=results.metrics)
+        with open(options.output, "w") as fd:
+            json.dump(report, fd, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
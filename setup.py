@@ -44,7 +44,17 @@ if bits == '32bit':
     libdir = "/usr/lib/vmware-vix-disklib/lib32"
 else:
     libdir = "/usr/lib/vmware-vix-disklib/lib64"
-    
+incdir = "/usr/lib/vmware-vix-disklib/include"
+
+# allow building against another VDDK install (or the stand-in in benchmarks/fakevddk)
+libdir = os.environ.get("VIXDISKLIB_LIBDIR", libdir)
+incdir = os.environ.get("VIXDISKLIB_INCLUDE", incdir)
+
+ext_modules = cythonize(['vixDiskLib/vixBase.pyx', 'vixDiskLib/vixDiskBase.pyx'],
+                        aliases={'VMWARE_LIBDIR': libdir, 'VMWARE_INCDIR': incdir})
+for ext in ext_modules:
+    ext.include_dirs.append(numpy.get_include())
+
 setup( 
     name = 'vixDiskLib',
     version = version,
@@ -57,7 +67,7 @@ setup(
     license = "MIT",
     requires = install_requires,
     include_dirs = [numpy.get_include()],
-    ext_modules = cythonize(['vixDiskLib/vixBase.pyx', 'vixDiskLib/vixDiskBase.pyx'], aliases={'VMWARE_LIBDIR': libdir}),
+    ext_modules = ext_modules,
     packages = ["vixDiskLib"],
     classifiers = ['Development Status :: 4 - Beta',
                    'Framework :: VMWare',
@@ -0,0 +1,86 @@
+'''
+Unittests for the future based AsyncVixDisk.
+'''
+import unittest, threading, os
+import numpy as np
+
+from vixDiskLib.asyncdisk import AsyncVixDisk, HandleExecutor
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import setupConfigs, get_connection, create_local_disk, default_disk_path, libdir
+
+class TestHandleExecutor(unittest.TestCase):
+
+    def testOrderAndThread(self):
+        executor = HandleExecutor()
+        seen = []
+        futures = [executor.submit(lambda i=i: seen.append((i, threading.current_thread().name)) or i)
+                   for i in xrange(10)]
+        self.assertEqual([f.result(5) for f in futures], range(10))
+        self.assertEqual(set(name for _, name in seen), set([executor.thread.name]))
+        
+        def fail():
+            raise VixDiskLibError("boom")
+        with self.assertRaises(VixDiskLibError):
+            executor.submit(fail).result(5)
+        executor.shutdown()
+        with self.assertRaises(VixDiskLibError):
+            executor.submit(fail)
+
+    def testShutdownRace(self):
+        # every submit racing a shutdown either fails at once or gets a future that completes
+        for _ in xrange(20):
+            executor = HandleExecutor()
+            futures = []
+            def submit():
+                for i in xrange(50):
+                    try:
+                        futures.append(executor.submit(lambda i=i: i))
+                    except VixDiskLibError:
+                        return
+            threads = [threading.Thread(target=submit) for _ in xrange(3)]
+            for thread in threads:
+                thread.start()
+            executor.shutdown()
+            for thread in threads:
+                thread.join()
+            for future in futures:
+                future.result(5)
+
+class TestAsyncVixDisk(unittest.TestCase):
+
+    def setUp(self):
+        self.block_size = 1024
+        disk = get_connection(block_size=self.block_size)
+        create_local_disk(disk, blocks=40, fill=False)
+        disk.open(default_disk_path)
+        self.data = np.arange(40 * self.block_size, dtype=np.uint32).astype(np.uint8)
+        disk.write_from(0, self.data)
+        disk.close()
+        disk.disconnect()
+
+    def tearDown(self):
+        if os.path.exists(default_disk_path):
+            os.unlink(default_disk_path)
+
+    def testReadIter(self):
+        disk = AsyncVixDisk(libdir=libdir, config=setupConfigs(), block_size=self.block_size)
+        disk.connect(readonly=False)
+        disk.open(default_disk_path)
+        
+        first, second = disk.read(0, 2), disk.read(2)
+        self.assertEqual(first.result(5).tostring() + second.result(5).tostring(),
+                         self.data[:3 * self.block_size].tostring())
+        
+        futures = list(disk.iter(nblocks=8, depth=3))
+        self.assertEqual(len(futures), 5)
+        self.assertEqual("".join(f.result(5).tostring() for f in futures), self.data.tostring())
+        
+        disk.close().result(5)
+        with self.assertRaises(VixDiskLibError):
+            disk.info().result(5)
+        disk.disconnect()
+        disk.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+'''
+Unittests for the storage backends and the VMDK descriptor.
+'''
+import unittest, os, shutil, tempfile
+import numpy as np
+
+from vixDiskLib import VixDiskLib_CreateParams, VixDiskLibDiskType, VixDiskLibAdapterType, VixDiskLibHwVersion
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.vixExceptions import VixDiskLibError, VixDiskUnimplemented
+from vixDiskLib.vixBase import library_users
+from vixDiskLib.backends import FlatBackend, ExtentFile, MappedExtent, get_backend, \
+    MADV_NORMAL, MADV_SEQUENTIAL, SEQUENTIAL_THRESHOLD
+from vixDiskLib.descriptor import Descriptor, read_descriptor
+
+DESCRIPTOR = '''# Disk DescriptorFile
+version=1
+encoding="UTF-8"
+CID=fffffffe
+parentCID=ffffffff
+createType="twoGbMaxExtentFlat"
+
+# Extent description
+RW 100 FLAT "split disk-f001.vmdk" 0
+RW 50 ZERO
+RDONLY 100 FLAT "split disk-f002.vmdk" 8
+
+# The Disk Data Base
+#DDB
+
+ddb.adapterType = "ide"
+ddb.geometry.cylinders = "3"
+ddb.virtualHWVersion = "4"
+'''
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="vixbackends-")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self, path, readonly=True):
+        disk = VixDisk(backend="flat", block_size=1024)
+        disk.connect(readonly=readonly)
+        disk.open(path)
+        return disk
+
+    def testDescriptor(self):
+        descriptor = Descriptor.parse(DESCRIPTOR)
+        self.assertEqual(descriptor.create_type, "twoGbMaxExtentFlat")
+        self.assertEqual(descriptor.capacity, 250)
+        self.assertEqual([e.type for e in descriptor.extents], ["FLAT", "ZERO", "FLAT"])
+        self.assertEqual(descriptor.extents[0].filename, "split disk-f001.vmdk")
+        self.assertEqual(descriptor.extents[2].offset, 8)
+        self.assertEqual(descriptor.ddb["adapterType"], "ide")
+        # and back again
+        again = Descriptor.parse(descriptor.text())
+        self.assertEqual(again.extents, descriptor.extents)
+        self.assertEqual(again.ddb, descriptor.ddb)
+        self.assertEqual(again.header, descriptor.header)
+        with self.assertRaises(VixDiskLibError):
+            Descriptor.parse("RW 100 BOGUS \"x\" 0")
+
+    def testRawImage(self):
+        path = os.path.join(self.dir, "raw.img")
+        data = (np.arange(64 * 1024) % 253).astype(np.uint8)
+        data.tofile(path)
+        self.assertIsNone(read_descriptor(path))
+
+        disk = self.open(path, readonly=False)
+        self.assertEqual(disk.info()['capacity'], 128)
+        self.assertEqual(disk.transport_mode, "file")
+        self.assertTrue(np.array_equal(disk.read(3, 2), data[3072:5120]))
+        disk.write(0, 1, np.ones(1024, dtype=np.uint8))
+        self.assertEqual(disk.read_extents([(1, 1), (120, 2)]).size, 1536)
+        with self.assertRaises(VixDiskLibError):
+            disk.read(64)
+        with self.assertRaises(VixDiskLibError):
+            disk.setMetadata({"uuid": "1"})
+        disk.close()
+        disk.disconnect()
+        self.assertTrue((np.fromfile(path, dtype=np.uint8)[:1024] == 1).all())
+
+    def testSplitExtents(self):
+        path = os.path.join(self.dir, "split disk.vmdk")
+        with open(path, "w") as fd:
+            fd.write(DESCRIPTOR)
+        first = np.full(100 * 512, 1, dtype=np.uint8)
+        second = np.full(108 * 512, 2, dtype=np.uint8)
+        second[:8 * 512] = 9
+        first.tofile(os.path.join(self.dir, "split disk-f001.vmdk"))
+        second.tofile(os.path.join(self.dir, "split disk-f002.vmdk"))
+
+        disk = self.open(path, readonly=False)
+        info = disk.info()
+        self.assertEqual(info['capacity'], 250)
+        self.assertEqual(info['adapterType'], VixDiskLibAdapterType['IDE'])
+        self.assertEqual(info['physGeo']['cylinders'], 3)
+        # a read across all three extents
+        data = disk.read_extents([(90, 80)])
+        self.assertTrue((data[:10 * 512] == 1).all())
+        self.assertTrue((data[10 * 512:60 * 512] == 0).all())
+        self.assertTrue((data[60 * 512:] == 2).all())
+        # writes stop at the zero and read only extents
+        disk.write_extents([(0, 4)], np.zeros(2048, dtype=np.uint8))
+        with self.assertRaises(VixDiskLibError):
+            disk.write_extents([(98, 4)], np.zeros(2048, dtype=np.uint8))
+        with self.assertRaises(VixDiskLibError):
+            disk.write_extents([(200, 2)], np.zeros(1024, dtype=np.uint8))
+        disk.close()
+        disk.disconnect()
+
+    def testCreate(self):
+        path = os.path.join(self.dir, "new.vmdk")
+        disk = VixDisk(backend="flat", block_size=1024)
+        disk.connect(readonly=False)
+        params = VixDiskLib_CreateParams(VixDiskLibDiskType['MONOLITHIC_FLAT'], VixDiskLibAdapterType['SCSI_LSILOGIC'],
+                                         VixDiskLibHwVersion['CURRENT'], 256)
+        disk.create(path, params)
+        disk.open(path)
+        self.assertEqual(disk.info()['capacity'], 512)
+        disk.write(10, 2, np.full(2048, 5, dtype=np.uint8))
+        disk.setMetadata({"uuid": "60 00 c2 9b"})
+        self.assertEqual(disk.getMetadata()["adapterType"], "lsilogic")
+        disk.close()
+
+        disk.open(path)
+        self.assertEqual(disk.getMetadata()["uuid"], "60 00 c2 9b")
+        self.assertTrue((disk.read(10, 2) == 5).all())
+        with self.assertRaises(VixDiskUnimplemented):
+            disk.shrink()
+        disk.close()
+        self.assertEqual(os.path.getsize(os.path.join(self.dir, "new-flat.vmdk")), 512 * 512)
+        disk.unlink(path)
+        self.assertEqual(os.listdir(self.dir), [])
+        disk.disconnect()
+
+        # SPLIT_FLAT, with small extents to see the split
+        FlatBackend().create(path, 1000, VixDiskLibDiskType['SPLIT_FLAT'], split_size=400)
+        self.assertEqual([(e.sectors, e.filename) for e in read_descriptor(path).extents],
+                         [(400, "new-f001.vmdk"), (400, "new-f002.vmdk"), (200, "new-f003.vmdk")])
+
+    def testNoLibrary(self):
+        users = library_users()
+        path = os.path.join(self.dir, "raw.img")
+        np.zeros(4096, dtype=np.uint8).tofile(path)
+        disk = self.open(path)
+        self.assertEqual(library_users(), users)
+        disk.close()
+        disk.finalize()
+        self.assertEqual(library_users(), users)
+        with self.assertRaises(VixDiskLibError):
+            get_backend("bogus")
+
+    def testMapped(self):
+        path = os.path.join(self.dir, "split disk.vmdk")
+        with open(path, "w") as fd:
+            fd.write(DESCRIPTOR)
+        first = (np.arange(100 * 512) % 251).astype(np.uint8)
+        second = np.full(108 * 512, 2, dtype=np.uint8)
+        first.tofile(os.path.join(self.dir, "split disk-f001.vmdk"))
+        second.tofile(os.path.join(self.dir, "split disk-f002.vmdk"))
+
+        disk = VixDisk(backend="mmap", block_size=1024)
+        disk.connect(readonly=False)
+        disk.open(path)
+        # inside an extent: a read only view of the mapping, that sees later writes
+        data = disk.read(10, 5)
+        self.assertFalse(data.flags.owndata or data.flags.writeable)
+        self.assertTrue(np.array_equal(data, first[10240:15360]))
+        self.assertIsNot(disk.read(20, 5).base, None)
+        disk.write(10, 1, np.full(1024, 7, dtype=np.uint8))
+        self.assertTrue((data[:1024] == 7).all())
+        # across extents, stitched
+        data = disk.read_extents([(90, 80)])
+        self.assertTrue(np.array_equal(data[:10 * 512], first[90 * 512:]))
+        self.assertTrue((data[10 * 512:60 * 512] == 0).all())
+        self.assertTrue((data[60 * 512:] == 2).all())
+        self.assertTrue((disk.read(124, 1) == 2).all())
+        self.assertFalse(disk.read(50, 10).any())
+        disk.close()
+        disk.disconnect()
+        # views outlive the disk
+        self.assertTrue((data[60 * 512:] == 2).all())
+
+    def testSequentialAdvice(self):
+        path = os.path.join(self.dir, "raw.img")
+        np.zeros(4 * SEQUENTIAL_THRESHOLD, dtype=np.uint8).tofile(path)
+        extent = MappedExtent(ExtentFile(path))
+        step = SEQUENTIAL_THRESHOLD // 4
+        for offset in xrange(0, SEQUENTIAL_THRESHOLD, step):
+            self.assertEqual(extent.advice, MADV_NORMAL)
+            extent.view(offset, step)
+        self.assertEqual(extent.advice, MADV_SEQUENTIAL)
+        extent.read_into(np.empty(step, dtype=np.uint8), SEQUENTIAL_THRESHOLD)
+        self.assertEqual(extent.advice, MADV_SEQUENTIAL)
+        # a jump ends the scan
+        extent.view(0, step)
+        self.assertEqual(extent.advice, MADV_NORMAL)
+        self.assertIsNone(extent.view(4 * SEQUENTIAL_THRESHOLD - 512, 1024))
+        extent.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+Unittests for the block read cache.
+'''
+import unittest
+import numpy as np
+
+from vixDiskLib.cache import BlockCache
+
+class TestBlockCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = BlockCache(4 * 512, 512)
+
+    def block(self, value):
+        return np.ones(512, dtype=np.uint8) * value
+
+    def testHitMiss(self):
+        self.assertIsNone(self.cache.get(7))
+        self.cache.put(7, self.block(7))
+        self.assertEqual(self.cache.get(7)[0], 7)
+        self.assertEqual((self.cache.stats.hits, self.cache.stats.misses), (1, 1))
+        
+        # cached data is a read only copy
+        with self.assertRaises(ValueError):
+            self.cache.get(7)[0] = 1
+
+    def testLRUEviction(self):
+        for block in xrange(4):
+            self.cache.put(block, self.block(block))
+        self.cache.get(0)
+        self.cache.put(4, self.block(4))
+        
+        # 1 was the least recently used, 0 was refreshed by the get
+        self.assertNotIn(1, self.cache)
+        self.assertIn(0, self.cache)
+        self.assertEqual(len(self.cache), 4)
+        self.assertEqual(self.cache.size, 4 * 512)
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+    def testInvalidate(self):
+        for block in xrange(4):
+            self.cache.put(block * 10, self.block(block))
+        self.cache.invalidate(5, 20)
+        self.assertEqual(sorted(self.cache.blocks), [0, 30])
+        self.cache.invalidate(0, 1000)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats.invalidations, 4)
+
+    def testClear(self):
+        self.cache.put(1, self.block(1))
+        self.cache.clear(1024)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.max_blocks, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
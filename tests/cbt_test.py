@@ -0,0 +1,55 @@
+'''
+Unittests for Change Block Tracking.
+'''
+import unittest, os, json, tempfile
+
+from vixDiskLib.cbt import areas_to_extents, FileChangeSource, VimChangeSource
+from vixDiskLib.vixExceptions import VixDiskLibError
+
+class Struct(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class FakeVm(object):
+    """ Hands out the changed areas 1MB of disk at a time, like vSphere does """
+    def __init__(self, areas):
+        self.areas = areas
+        
+    def QueryChangedDiskAreas(self, snapshot, deviceKey, startOffset, changeId):
+        end = startOffset + 1048576
+        changed = [Struct(start=s, length=l) for s, l in self.areas if startOffset <= s < end]
+        return Struct(startOffset=startOffset, length=1048576, changedArea=changed)
+
+class TestChangeBlockTracking(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def testAreasToExtents(self):
+        # unaligned areas are widened, overlapping ones merged
+        extents = areas_to_extents([(4096, 4096), (0, 1024), (1000, 100), (8192, 1)])
+        self.assertEqual(extents.tolist(), [[0, 3], [8, 9]])
+        self.assertEqual(areas_to_extents([]).shape, (0, 2))
+
+    def testFileChangeSource(self):
+        json.dump([{"changeId": "a/1", "changedArea": [{"start": 65536, "length": 65536}]},
+                   {"changeId": "a/2", "changedArea": []}], open(self.path, "w"))
+        source = FileChangeSource(self.path)
+        
+        self.assertEqual(source.changed_extents("a/1").tolist(), [[128, 128]])
+        self.assertEqual(source.changed_extents("a/2").shape, (0, 2))
+        with self.assertRaises(VixDiskLibError):
+            source.changed_extents("a/3")
+
+    def testVimChangeSource(self):
+        vm = FakeVm([(0, 512), (1048576 * 2, 4096)])
+        source = VimChangeSource(vm, snapshot=None, device_key=2000, capacity=1048576 * 4)
+        self.assertEqual(source.changed_extents("*").tolist(), [[0, 1], [4096, 8]])
+
+
+if __name__ == "__main__":
+    unittest.main()
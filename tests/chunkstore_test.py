@@ -0,0 +1,89 @@
+'''
+Unittests for the content-addressed chunk store.
+'''
+import unittest, os, shutil
+import numpy as np
+
+from vixDiskLib.chunkstore import ChunkStore
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import test_dir, get_connection, create_local_disk
+
+class TestChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.join(test_dir, "chunks")
+        self.paths = [os.path.join(test_dir, "chunk%d.vmdk" % i) for i in xrange(2)]
+        self.disk = get_connection()
+        for path in self.paths:
+            create_local_disk(self.disk, path=path, blocks=601, fill=False)
+        self.disk.open(self.paths[0])
+        self.capacity = self.disk.info()['capacity']
+        # 16 distinct 4K blocks repeated, and a short (1K) last block
+        pattern = np.repeat(np.arange(16, dtype=np.uint8), 4096)
+        self.data = np.resize(pattern, self.capacity * 512)
+        self.disk.write_from(0, self.data)
+
+    def tearDown(self):
+        self.disk.close()
+        self.disk.disconnect()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+
+    def testPutGet(self):
+        with ChunkStore(self.root, block_size=4096, segment_size=16384) as store:
+            digests = store.put(self.data[:65536])
+            self.assertEqual(digests.shape, (16, 32))
+            digests = store.put(self.data[:65536 * 2])
+            self.assertEqual(len(store), 16)
+            self.assertEqual(store.stats.new_blocks, 16)
+            self.assertEqual(store.stats.bytes_deduplicated, 65536 * 2)
+            # segments roll over
+            self.assertGreater(len(os.listdir(os.path.join(self.root, "segments"))), 1)
+            self.assertTrue(np.array_equal(store.get(digests[3]), self.data[3 * 4096:4 * 4096]))
+            with self.assertRaises(VixDiskLibError):
+                store.get(np.zeros(32, dtype=np.uint8))
+        
+        # the index survives a reopen, and several runs are merged
+        with ChunkStore(self.root, max_runs=1) as store:
+            self.assertEqual(store.block_size, 4096)
+            self.assertEqual(len(store), 16)
+            store.put(np.ones(4096, dtype=np.uint8) * 200)
+            store.commit()
+            store.put(np.ones(4096, dtype=np.uint8) * 201)
+            store.commit()
+            self.assertEqual(len(os.listdir(os.path.join(self.root, "index"))), 2)
+            self.assertEqual(len(store), 18)
+            self.assertTrue(np.array_equal(store.get(digests[15]), self.data[15 * 4096:16 * 4096]))
+
+    def testBackupRestore(self):
+        with ChunkStore(self.root, block_size=4096) as store:
+            manifest = store.backup(self.disk, "monday", read_size=65536)
+            # 151 blocks, but 16 distinct ones and the short last one
+            self.assertEqual(manifest.nblocks, 151)
+            self.assertEqual(len(store), 17)
+            self.assertEqual(store.generations(), ["monday"])
+            with self.assertRaises(VixDiskLibError):
+                store.backup(self.disk, "monday")
+            
+            # a second generation with one changed block stores only that block
+            changed = self.data.copy()
+            changed[5000] = 99
+            self.disk.write_from(0, changed)
+            store.backup(self.disk, "tuesday")
+            self.assertEqual(len(store), 18)
+        
+        with ChunkStore(self.root) as store:
+            self.disk.close()
+            self.disk.open(self.paths[1])
+            self.assertEqual(store.restore("monday", self.disk, read_size=65536), self.data.size)
+            self.assertTrue(np.array_equal(self.disk.read(0, self.capacity // 2), self.data))
+            store.restore("tuesday", self.disk)
+            self.assertTrue(np.array_equal(self.disk.read(0, self.capacity // 2), changed))
+            with self.assertRaises(VixDiskLibError):
+                store.restore("wednesday", self.disk)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+'''
+Unittests for parallel compression and the framed image format.
+'''
+import unittest, os, time, zlib
+import numpy as np
+
+from vixDiskLib.compress import (ordered_map, get_codec, available_codecs, FrameReader,
+                                 FrameWriter, export_compressed, restore_compressed)
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.vixDiskBase import VixDiskBase
+from utils import test_dir, setupConfigs, get_connection, create_local_disk
+
+class TestOrderedMap(unittest.TestCase):
+
+    def testOrder(self):
+        def slow(n):
+            time.sleep(0.001 * (n % 3))
+            return n * n
+        self.assertEqual(list(ordered_map(slow, xrange(50), threads=4)), [n * n for n in xrange(50)])
+
+    def testWindow(self):
+        taken = []
+        def items():
+            for n in xrange(20):
+                taken.append(n)
+                yield n
+        for n in ordered_map(lambda n: n, items(), threads=2, window=3):
+            # never more than the window taken ahead of the consumer
+            self.assertLessEqual(len(taken) - n, 3)
+
+    def testError(self):
+        def fail(n):
+            if n == 5:
+                raise ValueError("five")
+            return n
+        with self.assertRaises(ValueError):
+            list(ordered_map(fail, xrange(10)))
+
+class PlainDisk(VixDiskBase):
+    """ VixDiskBase itself has no instance dictionary to construct with """
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(test_dir, "compress.vmdk")
+        self.image = os.path.join(test_dir, "compress.vdx")
+        self.disk = get_connection()
+        for path in (self.path, self.path + ".copy"):
+            create_local_disk(self.disk, path=path, blocks=601, fill=False)
+        self.disk.open(self.path)
+        size = self.disk.info()['capacity'] * 512
+        # compressible text, then random data that is stored as is
+        self.data = np.resize(np.frombuffer("the quick brown fox " * 100, dtype=np.uint8), size)
+        self.data[-65536:] = np.random.randint(0, 256, 65536)
+        self.disk.write_from(0, self.data)
+
+    def tearDown(self):
+        self.disk.close()
+        self.disk.disconnect()
+        for path in (self.path, self.path + ".copy", self.image):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def testCodecs(self):
+        self.assertIn("zlib", available_codecs())
+        for name in available_codecs():
+            codec = get_codec(name)
+            self.assertEqual(codec.decompress(codec.compress("x" * 1000), 1000), "x" * 1000)
+        with self.assertRaises(VixDiskLibError):
+            get_codec("nosuchcodec")
+
+    def testExportRestore(self):
+        stats = export_compressed(self.disk, self.image, block_size=16384, threads=3, window=4)
+        # 1202 sectors: 37 blocks of 16K and a short one
+        self.assertEqual(stats.blocks, 38)
+        self.assertEqual(stats.bytes_in, self.data.size)
+        self.assertGreater(stats.ratio, 2)
+        self.assertGreaterEqual(stats.stored, 4)
+        
+        with FrameReader(self.image) as reader:
+            self.assertEqual((reader.nblocks, reader.block_size, reader.size), (38, 16384, self.data.size))
+            # random access, to a compressed block and to a stored one
+            for index in (10, 36, 37):
+                block = np.frombuffer(reader.read_block(index), dtype=np.uint8)
+                self.assertTrue(np.array_equal(block, self.data[index * 16384:(index + 1) * 16384]))
+            with self.assertRaises(VixDiskLibError):
+                reader.read_block(38)
+        
+        self.disk.close()
+        self.disk.open(self.path + ".copy")
+        self.assertEqual(restore_compressed(self.image, self.disk, threads=2), self.data.size)
+        self.assertTrue(np.array_equal(self.disk.read(0, self.data.size // 1024), self.data))
+        
+        # a VixDiskBase, which has no write buffer to flush
+        self.disk.close()
+        base = PlainDisk(config=setupConfigs(), block_size=1024)
+        base.connect(readonly=False)
+        base.open(self.path + ".copy")
+        try:
+            base.write_from(0, np.zeros(self.data.size, dtype=np.uint8))
+            self.assertEqual(restore_compressed(self.image, base), self.data.size)
+            self.assertTrue(np.array_equal(base.read(0, self.data.size // 1024), self.data))
+        finally:
+            base.close()
+            base.disconnect()
+            self.disk.open(self.path)
+
+    def testIncomplete(self):
+        with self.assertRaises(ValueError):
+            with FrameWriter(self.image, block_size=4096) as writer:
+                writer.write(["a" * 4096])
+                raise ValueError("export failed")
+        with self.assertRaises(VixDiskLibError):
+            FrameReader(self.image)
+
+if __name__ == "__main__":
+    unittest.main()
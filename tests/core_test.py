@@ -3,7 +3,9 @@ Created on Jul 8, 2011
 
 @author: eplaster
 '''
-import unittest
+import unittest, os, gc
+
+from utils import get_connection, create_local_disk, default_disk_path
 
 class TestCore(unittest.TestCase):
 
@@ -34,6 +36,35 @@ class TestCore(unittest.TestCase):
             "vixDiskLib doesn't have correct sector size: %d" % vixDiskLib.VixDiskLib_SectorsPerBlock)
 
 
+class TestLibrary(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(default_disk_path):
+            os.unlink(default_disk_path)
+
+    def testSharedInitialization(self):
+        from vixDiskLib.vixBase import library_users, library_stats
+        create_local_disk(get_connection(), blocks=16, fill=False).disconnect()
+        
+        first, second = get_connection(), get_connection()
+        users = sum(library_users().values())
+        initializations = library_stats['initializations']
+        
+        # a sibling going away must not take the library down with it
+        first.disconnect()
+        del first
+        gc.collect()
+        self.assertEqual(sum(library_users().values()), users - 1)
+        second.open(default_disk_path)
+        second.read(0)
+        second.close()
+        
+        third = get_connection()
+        self.assertEqual(library_stats['initializations'], initializations)
+        for disk in (second, third):
+            disk.finalize()
+        self.assertEqual(sum(library_users().values()), users - 2)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testCore']
     unittest.main()
\ No newline at end of file
@@ -4,9 +4,12 @@ Created on Jul 8, 2011
 @author: eplaster
 '''
 import unittest, os.path
+import numpy as np
 
+from vixDiskLib import VixDisk
 from vixDiskLib.consts import VixDiskTransportModes
 from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.parallel import ParallelDiskReader
 from utils import test_dir, get_connection, create_local_disk, default_disk_path
 
 class TestLocalDisk(unittest.TestCase):
@@ -36,7 +39,7 @@ class TestLocalDisk(unittest.TestCase):
         modes = self.disk.available_modes
         
         # as a minimum, we should have these modes available
-        for mode in ['file', 'ndbssl', 'ndb']:
+        for mode in ['file', 'nbdssl', 'nbd']:
             self.assertIn('file', modes, 'Transport mode %s is not available' % mode)
         self.disk.close()
         
@@ -70,6 +73,178 @@ class TestLocalDisk(unittest.TestCase):
         self.assertAlmostEqual(os.stat(self.test_disk).st_size, size,
                            msg="File size doesn't match what we where aiming for...", delta=size*.001)
         
+    def testReadIntoWriteFrom(self):
+        create_local_disk(self.disk, blocks=64, fill=False)
+        self.disk.open(default_disk_path)
+        
+        data = bytearray("x" * self.block_size * 4)
+        self.assertEqual(self.disk.write_from(8, data), len(data))
+        
+        out = bytearray(self.block_size * 4)
+        self.assertEqual(self.disk.read_into(8, out), len(out))
+        self.assertEqual(out, data)
+        
+        # the buffer has to hold whole blocks
+        with self.assertRaises(VixDiskLibError):
+            self.disk.read_into(0, bytearray(self.block_size + 1))
+        self.disk.close()
+        
+    def testExtents(self):
+        create_local_disk(self.disk, blocks=64, fill=False)
+        self.disk.open(default_disk_path)
+        
+        extents = [(40, 2), (0, 4), (4, 2), (10, 1)]
+        data = np.arange(9 * 512, dtype=np.uint32).astype(np.uint8)
+        self.disk.write_extents(extents, data)
+        
+        # read back as one array, and scattered into per extent buffers
+        self.assertTrue((self.disk.read_extents(extents) == data).all())
+        out = [bytearray(n * 512) for _, n in extents]
+        self.disk.read_extents(extents, out, max_gap=8)
+        self.assertEqual("".join(map(str, out)), data.tostring())
+        self.disk.close()
+        
+    def testIterChanged(self):
+        create_local_disk(self.disk, blocks=64, fill=False)
+        self.disk.open(default_disk_path)
+        self.disk.write_extents([(10, 2), (100, 1)], np.ones(3 * 512, dtype=np.uint8))
+        
+        changed = [(start, data.sum()) for start, data in self.disk.iter_changed([(100, 1), (8, 4)], max_io=2)]
+        self.assertEqual(changed, [(8, 0), (10, 1024), (100, 512)])
+        self.disk.close()
+        
+    def testQueryAllocated(self):
+        create_local_disk(self.disk, blocks=1024, fill=False)
+        self.disk.open(default_disk_path)
+        self.disk.write_extents([(1000, 8)], np.ones(8 * 512, dtype=np.uint8))
+        
+        allocated = self.disk.query_allocated().tolist()
+        if self.disk.allocation_supported:
+            self.assertEqual(allocated, [[896, 128]])
+            self.assertEqual([start for start, _ in self.disk.iter_allocated()], [896])
+        else:
+            self.assertEqual(allocated, [[0, 2048]])
+        
+        # ranges that are not chunk aligned are trimmed to what was asked for
+        self.assertEqual(self.disk.query_allocated(1000, 10).tolist(), [[1000, 10]])
+        
+        # chunks bigger than a single query still make progress
+        self.assertEqual(self.disk.query_allocated(1000, 8, chunk=4194304).tolist(), [[1000, 8]])
+        for chunk in (0, -128, 64):
+            with self.assertRaises(VixDiskLibError):
+                self.disk.query_allocated(chunk=chunk)
+        self.disk.close()
+        
+    def testIter(self):
+        create_local_disk(self.disk, blocks=100, fill=False)
+        self.disk.open(default_disk_path)
+        data = np.arange(100 * self.block_size, dtype=np.uint32).astype(np.uint8)
+        self.disk.write_from(0, data)
+        
+        serial = [buff.copy() for buff in self.disk.iter(nblocks=8)]
+        prefetched = [buff.copy() for buff in self.disk.iter(nblocks=8, prefetch=3)]
+        self.assertEqual(len(serial), 13)
+        self.assertEqual(np.concatenate(serial).tostring(), data.tostring())
+        self.assertEqual(np.concatenate(prefetched).tostring(), data.tostring())
+        self.assertEqual(self.disk.prefetch_stats.reads, 13)
+        
+        # stopping early leaves the disk usable
+        for buff in self.disk.iter(nblocks=1, prefetch=2):
+            break
+        self.assertEqual(self.disk.read(99).tostring(), data[99 * self.block_size:].tostring())
+        self.disk.close()
+        
+    def testReadCache(self):
+        create_local_disk(self.disk, blocks=64, fill=False)
+        disk = VixDisk(libdir=self.disk.libdir, config=self.disk.config, block_size=self.block_size,
+                       cache_size=8 * self.block_size)
+        disk.connect(readonly=False)
+        disk.open(default_disk_path)
+        stats = disk.cache.stats
+        
+        self.assertEqual(disk.read(0, 4).sum(), 0)
+        self.assertEqual(disk.read(2, 4).sum(), 0)
+        self.assertEqual((stats.hits, stats.misses), (2, 6))
+        
+        # writes drop the blocks they overlap, through every write method
+        disk.write(3, 1, np.ones(self.block_size, dtype=np.uint8))
+        self.assertEqual(disk.read(3).sum(), self.block_size)
+        disk.write_from(3, np.zeros(self.block_size, dtype=np.uint8))
+        self.assertEqual(disk.read(3).sum(), 0)
+        disk.write_extents([(9, 1)], np.ones(512, dtype=np.uint8))
+        self.assertEqual(disk.read(2, 4).sum(), 512)
+        
+        disk.reopen()
+        self.assertEqual(len(disk.cache), 0)
+        disk.close()
+        disk.disconnect()
+        
+    def testWriteBuffer(self):
+        create_local_disk(self.disk, blocks=64, fill=False)
+        disk = VixDisk(libdir=self.disk.libdir, config=self.disk.config, block_size=self.block_size,
+                       write_buffer_size=16 * self.block_size)
+        disk.connect(readonly=False)
+        disk.open(default_disk_path)
+        
+        for block in xrange(20):
+            disk.write(block, 1, np.ones(self.block_size, dtype=np.uint8) * block)
+        self.assertEqual(disk.write_buffer.stats.flushes, 1)
+        # reads see what is still buffered
+        self.assertEqual(disk.read(19)[0], 19)
+        self.assertEqual(disk.write_buffer.stats.flushes, 2)
+        
+        disk.write_from(40, np.ones(self.block_size * 2, dtype=np.uint8))
+        disk.close()
+        disk.open(default_disk_path)
+        self.assertEqual(disk.read(40, 2).sum(), self.block_size * 2)
+        disk.close()
+        disk.disconnect()
+        
+    def testSkipZeros(self):
+        create_local_disk(self.disk, blocks=64, fill=False)
+        disk = VixDisk(libdir=self.disk.libdir, config=self.disk.config, block_size=self.block_size,
+                       skip_zeros=True)
+        disk.connect(readonly=False)
+        disk.open(default_disk_path)
+        
+        data = np.zeros(8 * self.block_size, dtype=np.uint8)
+        data[3 * self.block_size:5 * self.block_size] = 7
+        self.assertEqual(disk.write_from(8, data), data.size)
+        self.assertEqual(disk.zero_stats.bytes_saved, 6 * self.block_size)
+        
+        runs = [(block, buff.size) for block, buff in disk.iter_nonzero(nblocks=16)]
+        self.assertEqual(runs, [(11, 2 * self.block_size)])
+        self.assertEqual(disk.zero_stats.zero_blocks, 6 + 62)
+        disk.close()
+        disk.disconnect()
+        
+    def testParallelReader(self):
+        create_local_disk(self.disk, blocks=100, fill=False)
+        self.disk.open(default_disk_path)
+        data = np.arange(100 * self.block_size, dtype=np.uint32).astype(np.uint8)
+        self.disk.write_from(0, data)
+        self.disk.close()
+        
+        copy = os.path.join(test_dir, "copy.raw")
+        reader = ParallelDiskReader(default_disk_path, libdir=self.disk.libdir, config=self.disk.config,
+                                    connections=3, stripe_size=24)
+        with reader:
+            stripes = [(start, buff.tostring()) for start, buff in reader.iter(window=4)]
+            self.assertEqual([start for start, _ in stripes], range(0, 200, 24))
+            self.assertEqual("".join(buff for _, buff in stripes), data.tostring())
+            try:
+                # an older, larger file is cut to the copy
+                with open(copy, "wb") as fd:
+                    fd.write("x" * (2 * len(data)))
+                self.assertEqual(reader.copy_to(copy), len(data))
+                self.assertEqual(open(copy, "rb").read(), data.tostring())
+            finally:
+                os.unlink(copy)
+            # a destination that can not be written fails the copy
+            with self.assertRaises(IOError):
+                reader.copy_to(test_dir)
+        self.assertEqual(reader.disks, [])
+        
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testDisk']
@@ -0,0 +1,72 @@
+'''
+Unittests for DiskSet, several disks on one connection.
+'''
+import unittest, os
+import numpy as np
+
+from vixDiskLib.diskset import DiskSet
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import test_dir, get_connection, create_local_disk
+
+class TestDiskSet(unittest.TestCase):
+
+    def setUp(self):
+        self.block_size = 1024
+        self.paths = [os.path.join(test_dir, "set%d.vmdk" % i) for i in xrange(3)]
+        creator = get_connection(block_size=self.block_size)
+        for index, path in enumerate(self.paths):
+            create_local_disk(creator, path=path, blocks=10 * (index + 1), fill=False)
+            creator.open(path)
+            creator.write_from(0, np.ones(creator.block_size, dtype=np.uint8) * (index + 1))
+            creator.close()
+        creator.disconnect()
+
+    def tearDown(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def testOpenMany(self):
+        with DiskSet(block_size=self.block_size) as disks:
+            disks.connect(readonly=False)
+            for path in self.paths:
+                disks.open(path)
+            self.assertEqual(len(disks), 3)
+            with self.assertRaises(VixDiskLibError):
+                disks.open(self.paths[0])
+            
+            # every disk has its own handle and buffers
+            self.assertEqual([disk.read(0)[0] for disk in disks], [1, 2, 3])
+            
+            disks.close(self.paths[1])
+            self.assertEqual(len(disks), 2)
+            with self.assertRaises(VixDiskLibError):
+                disks.close(self.paths[1])
+            self.assertTrue(disks.connection.connected)
+            self.assertEqual(disks[self.paths[2]].read(0)[0], 3)
+
+    def testParallel(self):
+        with DiskSet(block_size=self.block_size) as disks:
+            disks.connect()
+            for path in self.paths:
+                disks.open(path)
+            
+            firsts = {}
+            def first(path, block, data):
+                if block == 0:
+                    firsts[path] = data[0]
+            blocks = disks.for_each(first, nblocks=4, prefetch=1)
+            self.assertEqual(blocks, dict(zip(self.paths, [10, 20, 30])))
+            self.assertEqual([firsts[path] for path in self.paths], [1, 2, 3])
+            
+            reads = list(disks.iter(nblocks=4, depth=2))
+            self.assertEqual(len(reads), 3 + 5 + 8)
+            self.assertEqual(sorted((path, block) for path, block, _ in reads if block == 0),
+                             [(path, 0) for path in self.paths])
+            
+            for _ in disks.iter(nblocks=1):
+                break
+
+
+if __name__ == "__main__":
+    unittest.main()
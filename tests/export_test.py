@@ -0,0 +1,125 @@
+'''
+Unittests for the resumable export and its extent journal.
+'''
+import unittest, os
+import numpy as np
+
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.export import DiskExport, ExtentJournal
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import test_dir, get_connection, create_local_disk
+
+class FlakyDisk(VixDisk):
+    """ Fails the reads numbered in `failures` with the given library error code """
+    def __init__(self, *args, **kwargs):
+        self.failures = kwargs.pop('failures', {})
+        self.reads = 0
+        self.reopens = 0
+        super(FlakyDisk, self).__init__(*args, **kwargs)
+
+    def read_extents(self, extents, out=None, *args, **kwargs):
+        self.reads += 1
+        if self.reads in self.failures:
+            raise VixDiskLibError("injected", code=self.failures[self.reads])
+        return super(FlakyDisk, self).read_extents(extents, out, *args, **kwargs)
+
+    def reopen(self):
+        self.reopens += 1
+        super(FlakyDisk, self).reopen()
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(test_dir, "export.vmdk")
+        self.image = os.path.join(test_dir, "export.raw")
+        creator = get_connection()
+        create_local_disk(creator, path=self.path, blocks=512, fill=False)
+        creator.open(self.path)
+        self.capacity = creator.info()['capacity']
+        self.data = np.zeros(self.capacity * 512, dtype=np.uint8)
+        # data in the first and last quarters, zeros in between
+        quarter = self.data.size // 4
+        self.data[:quarter] = np.arange(quarter) % 251
+        self.data[-quarter:] = 7
+        creator.write_from(0, self.data)
+        creator.close()
+        creator.disconnect()
+
+    def tearDown(self):
+        for path in (self.path, self.image, self.image + ".journal"):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def open(self, **kwargs):
+        disk = FlakyDisk(**kwargs)
+        disk.connect()
+        disk.open(self.path)
+        return disk
+
+    def check_image(self):
+        image = np.fromfile(self.image, dtype=np.uint8)
+        self.assertTrue(np.array_equal(image, self.data))
+        self.assertFalse(os.path.exists(self.image + ".journal"))
+
+    def testExport(self):
+        disk = self.open()
+        stats = DiskExport(disk, self.image, max_io=64).run()
+        disk.close()
+        self.assertEqual(stats.bytes, self.data.size)
+        self.assertEqual(stats.zero_bytes, self.data.size // 2)
+        self.assertEqual(stats.resumed_bytes, 0)
+        self.check_image()
+
+    def testResume(self):
+        # a permanent error half way through stops the export
+        disk = self.open(failures={5: 16007})
+        export = DiskExport(disk, self.image, max_io=64, checkpoint_interval=0)
+        with self.assertRaises(VixDiskLibError):
+            export.run()
+        disk.close()
+        self.assertEqual(disk.reopens, 0)
+        self.assertTrue(os.path.exists(self.image + ".journal"))
+        
+        # and the next run reads only the rest
+        disk = self.open()
+        stats = DiskExport(disk, self.image, max_io=64).run()
+        disk.close()
+        self.assertEqual(stats.resumed_bytes, 4 * 64 * 512)
+        self.assertEqual(stats.bytes, self.data.size - stats.resumed_bytes)
+        self.check_image()
+
+    def testRetry(self):
+        # dropped connections are retried after reopening the disk
+        disk = self.open(failures={3: 26, 4: 26})
+        stats = DiskExport(disk, self.image, max_io=64, backoff=0).run()
+        disk.close()
+        self.assertEqual(stats.retries, 2)
+        self.assertEqual(disk.reopens, 2)
+        self.check_image()
+        
+        disk = self.open(failures=dict((n, 26) for n in xrange(2, 10)))
+        with self.assertRaises(VixDiskLibError):
+            DiskExport(disk, self.image, max_io=64, retries=3, backoff=0).run()
+        disk.close()
+
+    def testJournal(self):
+        journal_path = self.image + ".journal"
+        journal = ExtentJournal(journal_path, 1000)
+        journal.record(0, 100)
+        journal.record(100, 100)
+        journal.commit()
+        journal.record(500, 10)
+        journal.close()
+        # a torn record at the end is ignored
+        with open(journal_path, "ab") as fd:
+            fd.write("\x01\x02\x03")
+        
+        journal = ExtentJournal(journal_path, 1000)
+        self.assertEqual(journal.completed.tolist(), [[0, 200]])
+        self.assertEqual(os.path.getsize(journal_path), 32)
+        journal.close()
+        with self.assertRaises(VixDiskLibError):
+            ExtentJournal(journal_path, 2000)
+
+if __name__ == "__main__":
+    unittest.main()
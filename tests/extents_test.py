@@ -0,0 +1,53 @@
+'''
+Unittests for the extent list helpers.
+'''
+import unittest
+
+from vixDiskLib.extents import as_extents, coalesce, normalize, subtract, total_sectors
+from vixDiskLib.vixExceptions import VixDiskLibError
+
+class TestExtents(unittest.TestCase):
+
+    def testAsExtents(self):
+        self.assertEqual(as_extents([]).shape, (0, 2))
+        self.assertEqual(as_extents([(0, 8), (16, 8)]).shape, (2, 2))
+        with self.assertRaises(VixDiskLibError):
+            as_extents([1, 2, 3])
+
+    def testCoalesceAdjacent(self):
+        runs, members = coalesce([(16, 8), (0, 8), (8, 8)], max_gap=0)
+        self.assertEqual(runs.tolist(), [[0, 24]])
+        self.assertEqual(members, [[1, 2, 0]])
+
+    def testCoalesceGap(self):
+        extents = [(0, 8), (10, 8), (100, 8)]
+        runs, members = coalesce(extents, max_gap=0)
+        self.assertEqual(runs.tolist(), [[0, 8], [10, 8], [100, 8]])
+        
+        runs, members = coalesce(extents, max_gap=2)
+        self.assertEqual(runs.tolist(), [[0, 18], [100, 8]])
+        self.assertEqual(members, [[0, 1], [2]])
+
+    def testCoalesceMaxIO(self):
+        extents = [(i * 8, 8) for i in xrange(10)]
+        runs, members = coalesce(extents, max_io=32)
+        self.assertEqual(runs.tolist(), [[0, 32], [32, 32], [64, 16]])
+        
+        # a single large extent is never split
+        runs, members = coalesce([(0, 100)], max_io=32)
+        self.assertEqual(runs.tolist(), [[0, 100]])
+
+    def testNormalize(self):
+        self.assertEqual(normalize([(10, 10), (0, 15), (30, 5)]).tolist(), [[0, 20], [30, 5]])
+        self.assertEqual(total_sectors([(10, 10), (0, 15)]), 25)
+
+    def testSubtract(self):
+        self.assertEqual(subtract([(0, 100)], []).tolist(), [[0, 100]])
+        self.assertEqual(subtract([(0, 100)], [(0, 100)]).shape, (0, 2))
+        self.assertEqual(subtract([(0, 100)], [(10, 10), (50, 60)]).tolist(), [[0, 10], [20, 30]])
+        # a cut spanning several extents
+        self.assertEqual(subtract([(0, 10), (20, 10), (40, 10)], [(5, 40)]).tolist(), [[0, 5], [45, 5]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+Unittests for block digests and manifests.
+'''
+import unittest, os, hashlib
+import numpy as np
+
+from vixDiskLib.manifest import Manifest, digest_disk, verify, hasher
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import test_dir, get_connection, create_local_disk
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(test_dir, "manifest.vmdk")
+        self.saved = os.path.join(test_dir, "manifest.bin")
+        self.disk = get_connection()
+        create_local_disk(self.disk, path=self.path, blocks=601, fill=False)
+        self.disk.open(self.path)
+        self.data = (np.arange(self.disk.info()['capacity'] * 512) % 253).astype(np.uint8)
+        self.disk.write_from(0, self.data)
+
+    def tearDown(self):
+        self.disk.close()
+        self.disk.disconnect()
+        for path in (self.path, self.saved):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def testDigests(self):
+        manifest = digest_disk(self.disk, block_size=4096, threads=3, read_size=16384)
+        # 1202 sectors is 151 blocks of 4K, the last one short
+        self.assertEqual(manifest.digests.shape, (151, 32))
+        for block in (0, 40, 150):
+            expected = hashlib.sha256(self.data[block * 4096:(block + 1) * 4096].tostring()).digest()
+            self.assertEqual(manifest.digests[block].tostring(), expected)
+        self.assertEqual(manifest.info['capacity'], 1202)
+        self.assertIn('adapterType', manifest.metadata)
+        
+        with self.assertRaises(VixDiskLibError):
+            digest_disk(self.disk, block_size=1000)
+        with self.assertRaises(VixDiskLibError):
+            hasher("nosuchhash")
+
+    def testSaveLoad(self):
+        manifest = digest_disk(self.disk, block_size=4096, algorithm="sha1")
+        manifest.save(self.saved)
+        loaded = Manifest.load(self.saved)
+        self.assertEqual((loaded.algorithm, loaded.block_size, loaded.capacity), ("sha1", 4096, 1202))
+        self.assertTrue(np.array_equal(loaded.digests, manifest.digests))
+        self.assertFalse(loaded.changed(manifest).any())
+        self.assertEqual(loaded.metadata, manifest.metadata)
+
+    def testCompare(self):
+        before = digest_disk(self.disk, block_size=4096)
+        self.assertEqual(len(verify(self.disk, before)), 0)
+        
+        # change blocks 2 and 150, and copy block 10 over block 20
+        changed = self.data.copy()
+        changed[2 * 4096 + 5] ^= 0xff
+        changed[-1] ^= 0xff
+        changed[20 * 4096:21 * 4096] = self.data[10 * 4096:11 * 4096]
+        self.disk.write_from(0, changed)
+        
+        after = digest_disk(self.disk, block_size=4096)
+        self.assertEqual(np.flatnonzero(after.changed(before)).tolist(), [2, 20, 150])
+        self.assertEqual(verify(self.disk, before).tolist(), [2, 20, 150])
+        self.assertEqual(after.changed_extents(before).tolist(), [[16, 8], [160, 8], [1200, 2]])
+        # block 20 is new in place, but its content was already backed up
+        self.assertEqual(np.flatnonzero(~after.known(before)).tolist(), [2, 150])
+        
+        with self.assertRaises(VixDiskLibError):
+            after.changed(digest_disk(self.disk, block_size=8192))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+'''
+Unittests for the connection pool.
+'''
+import unittest, os, time
+
+from vixDiskLib import VixDisk, VixCredentials
+from vixDiskLib.vixBase import ConnectionPool
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import setupConfigs, get_connection, create_local_disk, default_disk_path, libdir
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(libdir, setupConfigs(), max_per_host=1)
+
+    def tearDown(self):
+        self.pool.close()
+        if os.path.exists(default_disk_path):
+            os.unlink(default_disk_path)
+
+    def credentials(self, vm):
+        return VixCredentials(vm, "esx01", "root", "secret")
+
+    def testReuse(self):
+        conn = self.pool.checkout(self.credentials("vm-1"), "snapshot-1")
+        self.assertTrue(conn.connected)
+        self.pool.checkin(conn)
+        self.assertIs(self.pool.checkout(self.credentials("moref=vm-1"), "snapshot-1"), conn)
+        self.assertEqual((self.pool.stats.created, self.pool.stats.reused), (1, 1))
+
+    def testPerHostLimit(self):
+        first = self.pool.checkout(self.credentials("vm-1"))
+        with self.assertRaises(VixDiskLibError):
+            self.pool.checkout(self.credentials("vm-2"), timeout=0.05)
+        
+        # an idle connection for another key is closed to make room
+        self.pool.checkin(first)
+        second = self.pool.checkout(self.credentials("vm-2"))
+        self.assertFalse(first.connected)
+        self.assertEqual(self.pool.idle(), 0)
+        self.pool.checkin(second)
+
+    def testExpiryAndHealth(self):
+        conn = self.pool.checkout(self.credentials("vm-1"))
+        self.pool.checkin(conn)
+        self.pool.health_check = lambda conn: False
+        fresh = self.pool.checkout(self.credentials("vm-1"))
+        self.assertIsNot(fresh, conn)
+        self.assertEqual(self.pool.stats.unhealthy, 1)
+        
+        self.pool.max_idle = 0
+        self.pool.checkin(fresh)
+        time.sleep(0.01)
+        self.pool.prune()
+        self.assertEqual(self.pool.stats.expired, 1)
+        self.assertFalse(fresh.connected)
+
+    def testOpenBorrows(self):
+        create_local_disk(get_connection(), blocks=16, fill=False).disconnect()
+        pool = ConnectionPool(max_idle=None)
+        disk = VixDisk()
+        disk.open(default_disk_path, pool=pool, readonly=False)
+        disk.reopen()
+        self.assertEqual(disk.read(0).size, disk.block_size)
+        disk.close()
+        self.assertFalse(disk.connected)
+        self.assertEqual(pool.idle(), 1)
+        
+        disk.open(default_disk_path, pool=pool, readonly=False)
+        disk.close()
+        self.assertEqual((pool.stats.created, pool.stats.reused), (1, 1))
+        pool.close()
+        self.assertEqual(pool.idle(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+'''
+Unittests for the multi-VM backup scheduler.
+'''
+import unittest, os, sys, time, shutil, tempfile, multiprocessing, Queue
+from multiprocessing.util import Finalize
+import numpy as np
+
+from vixDiskLib import VixCredentials
+from vixDiskLib import scheduler as scheduler_module
+from vixDiskLib.scheduler import Scheduler, BackupJob, output_names
+from vixDiskLib.paths import datastore_of
+from utils import test_dir, get_connection, create_local_disk
+
+def timed_job(job):
+    """ Stands in for a backup, reporting when it ran through the byte count """
+    start = time.time()
+    time.sleep(0.2)
+    if job.name == "broken":
+        raise RuntimeError("backup failed")
+    if job.name == "crash":
+        os._exit(3)
+    if job.name == "quiet":
+        sys.exit(0)
+    if job.name == "late":
+        # dies once the result is flushed to the scheduler, like a crash in library teardown
+        Finalize(None, os._exit, (5,), exitpriority=-10)
+    return int(start * 1000)
+
+class LateQueue(object):
+    """
+    A result queue whose first wait times out only once the workers are done, so their
+    results are already waiting when the scheduler looks for dead workers.  With
+    `hidden`, the first look finds nothing either, so the result arrives after the job
+    was given up on.
+    """
+    def __init__(self, hidden=False):
+        self.queue = multiprocessing.Queue()
+        self.waits = 1
+        self.looks = 1 if hidden else 0
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def get(self, timeout=None):
+        if self.waits:
+            self.waits -= 1
+            time.sleep(1)
+            raise Queue.Empty
+        return self.queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        if self.looks:
+            self.looks -= 1
+            raise Queue.Empty
+        return self.queue.get_nowait()
+
+class TestScheduler(unittest.TestCase):
+
+    def job(self, name, host, datastore, size=0):
+        return BackupJob(name, VixCredentials("vm-" + name, host, "root", "secret"), None,
+                         ["[%s] %s/%s.vmdk" % (datastore, name, name)], "/tmp", size=size)
+
+    def testDatastore(self):
+        self.assertEqual(datastore_of("[ds 1] vm/vm.vmdk"), "ds 1")
+        self.assertEqual(datastore_of("/local/disk.vmdk"), None)
+
+    def testOutputNames(self):
+        self.assertEqual(output_names(["[ds1] vm/vm.vmdk", "[ds1] vm/vm_1.vmdk"]), ["vm", "vm_1"])
+        self.assertEqual(output_names(["[ds1] vm/vm.vmdk", "[ds2] vm/vm.vmdk", "/a/vm.vmdk"]),
+                         ["ds1-vm", "ds2-vm", "vm"])
+        self.assertEqual(output_names(["[ds1] a/vm.vmdk", "[ds1] b/vm.vmdk"]), ["ds1-vm-0", "ds1-vm-1"])
+
+    def testLimitsAndOrder(self):
+        jobs = [self.job("a", "esx1", "ds1", 10), self.job("b", "esx1", "ds2", 30),
+                self.job("c", "esx1", "ds2", 20), self.job("d", "esx2", "ds3", 5)]
+        scheduler = Scheduler(max_workers=3, per_host=1, per_datastore=1, worker=timed_job)
+        results = scheduler.run(jobs)
+        self.assertTrue(all(result.ok for result in results))
+        
+        # one job per host at a time, largest first on esx1
+        starts = dict((result.job.name, result.bytes) for result in results)
+        self.assertLess(starts["b"], starts["c"])
+        self.assertLess(starts["c"], starts["a"])
+        self.assertLess(abs(starts["b"] - starts["d"]), 150)
+        self.assertEqual(scheduler.stats.max_running, 2)
+
+    def testFailureIsolation(self):
+        jobs = [self.job("broken", "esx1", "ds1"), self.job("crash", "esx2", "ds2"),
+                self.job("fine", "esx3", "ds3")]
+        scheduler = Scheduler(worker=timed_job)
+        results = scheduler.run(jobs)
+        self.assertEqual([result.ok for result in results], [False, False, True])
+        self.assertIn("backup failed", results[0].error)
+        self.assertIn("code 3", results[1].error)
+        self.assertEqual((scheduler.stats.succeeded, scheduler.stats.failed), (1, 2))
+
+    def testQuietExit(self):
+        scheduler = Scheduler(worker=timed_job)
+        result, = scheduler.run([self.job("quiet", "esx1", "ds1")])
+        self.assertFalse(result.ok)
+        self.assertIn("code 0 without a result", result.error)
+
+    def run_late(self, queue):
+        original = scheduler_module.multiprocessing.Queue
+        scheduler_module.multiprocessing.Queue = lambda: queue
+        try:
+            return Scheduler(worker=timed_job).run([self.job("late", "esx1", "ds1")])[0]
+        finally:
+            scheduler_module.multiprocessing.Queue = original
+
+    def testLateResult(self):
+        # posted just before the worker died: the result wins
+        result = self.run_late(LateQueue())
+        self.assertTrue(result.ok, result.error)
+        # posted after the job was given up on: ignored
+        result = self.run_late(LateQueue(hidden=True))
+        self.assertIn("code 5", result.error)
+
+class TestBackupJob(unittest.TestCase):
+
+    def setUp(self):
+        self.source = os.path.join(test_dir, "source.vmdk")
+        self.destination = tempfile.mkdtemp(prefix="vixbackup-")
+        disk = get_connection()
+        create_local_disk(disk, path=self.source, blocks=2048, fill=False)
+        disk.open(self.source)
+        disk.write_from(1000, np.ones(disk.block_size, dtype=np.uint8))
+        disk.close()
+        disk.disconnect()
+
+    def tearDown(self):
+        os.unlink(self.source)
+        shutil.rmtree(self.destination)
+
+    def testBackup(self):
+        job = BackupJob("local", None, None, [self.source], self.destination, block_size=65536)
+        scheduler = Scheduler()
+        result, = scheduler.run([job])
+        self.assertTrue(result.ok, result.error)
+        self.assertEqual(result.bytes, 2048 * 1024)
+        
+        with open(os.path.join(self.destination, "source.raw"), "rb") as fd:
+            image = fd.read()
+        self.assertEqual(len(image), 2048 * 1024)
+        self.assertEqual(image.count("\x01"), 1024)
+        self.assertEqual(image[1000 * 1024], "\x01")
+
+
+if __name__ == "__main__":
+    unittest.main()
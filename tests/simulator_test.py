@@ -0,0 +1,131 @@
+'''
+Unittests for the transport simulator in the stand-in library, configured through
+the config file given to VixDiskLib_InitEx.
+'''
+import unittest, os, time
+import numpy as np
+
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.export import DiskExport
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import test_dir, create_local_disk
+
+VIX_E_TOO_MANY_HANDLES = 1002
+VIX_E_HOST_NETWORK_CONN_REFUSED = 14009
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(test_dir, "simulated.vmdk")
+        self.image = os.path.join(test_dir, "simulated.raw")
+        self.configs = []
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.open(fill=True).finalize()
+
+    def tearDown(self):
+        # the settings live until the next InitEx, so leave the defaults behind
+        self.open().finalize()
+        for path in [self.path, self.image, self.image + ".journal"] + self.configs:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def open(self, settings=None, fill=False):
+        """ Returns a disk whose library was initialized with the given fake.* settings """
+        config = os.path.join(test_dir, "simulated%d.cfg" % len(self.configs))
+        self.configs.append(config)
+        with open(config, "w") as fd:
+            fd.write("# simulator settings\n")
+            for key, value in sorted((settings or {}).items()):
+                fd.write('%s = "%s"\n' % (key, value))
+        disk = VixDisk(config=config, block_size=1024)
+        disk.connect(readonly=False)
+        if fill:
+            create_local_disk(disk, path=self.path, blocks=1024)
+        elif settings is not None:
+            disk.open(self.path)
+        return disk
+
+    def timed_reads(self, disk, count, nblocks=1):
+        start = time.time()
+        for block in xrange(count):
+            disk.read(block * nblocks, nblocks)
+        return time.time() - start
+
+    def testLatency(self):
+        disk = self.open({"fake.latency.us": 5000})
+        self.assertGreaterEqual(self.timed_reads(disk, 10), 0.05)
+        disk.close()
+        disk.finalize()
+
+        disk = self.open({"fake.latency.us": 4000, "fake.latency.jitterUs": 2000,
+                          "fake.latency.distribution": "uniform", "fake.seed": 7})
+        self.assertGreaterEqual(self.timed_reads(disk, 20), 20 * 0.002)
+        disk.close()
+        disk.finalize()
+
+    def testBandwidth(self):
+        # 1MB at 10MB/s per handle
+        disk = self.open({"fake.handle.MBps": 10})
+        elapsed = self.timed_reads(disk, 16, 64)
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 1.0)
+        disk.close()
+        disk.finalize()
+
+        # and the same through the connection's cap
+        disk = self.open({"fake.connection.MBps": 10})
+        start = time.time()
+        self.timed_reads(disk, 16, 64)
+        self.assertGreaterEqual(time.time() - start, 0.09)
+        disk.close()
+        disk.finalize()
+
+    def testHandleLimit(self):
+        first = self.open({"fake.maxHandles": 1})
+        second = VixDisk(config=self.configs[-1], block_size=1024)
+        second.connect()
+        with self.assertRaises(VixDiskLibError) as raised:
+            second.open(self.path)
+        self.assertEqual(raised.exception.code, VIX_E_TOO_MANY_HANDLES)
+
+        # closing one frees its slot
+        first.close()
+        second.open(self.path)
+        second.read(0)
+        second.close()
+        for disk in (first, second):
+            disk.finalize()
+
+    def testFaults(self):
+        disk = self.open({"fake.fault.sectors": "100,1500", "fake.fault.ops": "read"})
+        disk.read(0)
+        with self.assertRaises(VixDiskLibError) as raised:
+            disk.read(50)
+        self.assertEqual(raised.exception.code, VIX_E_HOST_NETWORK_CONN_REFUSED)
+        # writes are not faulted
+        disk.write(50, 1, np.zeros(disk.block_size, dtype=np.uint8))
+        disk.close()
+        disk.finalize()
+
+        disk = self.open({"fake.fault.rate": 1, "fake.fault.error": 16007})
+        with self.assertRaises(VixDiskLibError) as raised:
+            disk.read(0)
+        self.assertEqual(raised.exception.code, 16007)
+        disk.close()
+        disk.finalize()
+
+    def testExportRetries(self):
+        # each faulted sector fails once, and the export retries past it
+        disk = self.open({"fake.fault.sectors": "100,1500", "fake.fault.once": 1})
+        stats = DiskExport(disk, self.image, max_io=64, backoff=0).run()
+        self.assertEqual(stats.retries, 2)
+        capacity = disk.info()['capacity']
+        data = np.fromfile(self.image, dtype=np.uint8)
+        self.assertEqual(data.size, capacity * 512)
+        self.assertTrue((data == 42).all())
+        disk.close()
+        disk.finalize()
+
+if __name__ == "__main__":
+    unittest.main()
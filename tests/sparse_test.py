@@ -0,0 +1,195 @@
+'''
+Unittests for the sparse VMDK reader and the sparse backend.
+'''
+import unittest, os, shutil, tempfile, zlib
+import numpy as np
+
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.backends import ExtentFile
+from vixDiskLib.sparse import SparseExtent, HEADER, GRAIN_MARKER, SPARSE_MAGIC, GD_AT_END, \
+    FLAG_COMPRESSED, FLAG_MARKERS, SECTOR_SIZE
+
+DESCRIPTOR = '''# Disk DescriptorFile
+version=1
+CID=fffffffe
+parentCID=ffffffff
+createType="%s"
+
+# Extent description
+RW %d SPARSE "%s"
+
+# The Disk Data Base
+ddb.adapterType = "lsilogic"
+ddb.virtualHWVersion = "7"
+'''
+
+def write_sparse(path, data, grain_size=16, per_table=32, stream=False, interleave=True):
+    """
+    Writes `data` as a sparse extent with an embedded descriptor, leaving its all zero
+    grains unallocated.  With `stream`, as a stream optimized one: compressed grains
+    with markers, and the grain directory in a footer.  With `interleave`, the odd
+    grains are stored first, so that no neighbours are next to each other in the file.
+    """
+    capacity = data.size // SECTOR_SIZE
+    grain_bytes = grain_size * SECTOR_SIZE
+    ngrains = -(-capacity // grain_size)
+    ntables = -(-ngrains // per_table)
+    table_sectors = -(-per_table * 4 // SECTOR_SIZE)
+    descriptor = DESCRIPTOR % ("streamOptimized" if stream else "monolithicSparse",
+                               capacity, os.path.basename(path))
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = SPARSE_MAGIC
+    header['version'] = 3 if stream else 1
+    header['flags'] = 1 | (FLAG_COMPRESSED | FLAG_MARKERS if stream else 0)
+    header['capacity'] = capacity
+    header['grainSize'] = grain_size
+    header['descriptorOffset'] = 1
+    header['descriptorSize'] = 2
+    header['numGTEsPerGT'] = per_table
+    header['newlineChars'] = "\n \r\n"
+    header['compressAlgorithm'] = 1 if stream else 0
+
+    out = bytearray(3 * SECTOR_SIZE)
+    out[SECTOR_SIZE:SECTOR_SIZE + len(descriptor)] = descriptor
+    grains = np.zeros(ntables * per_table, dtype='<u4')
+    padded = np.zeros(ngrains * grain_bytes, dtype=np.uint8)
+    padded[:data.size] = data
+    order = range(ngrains)
+    if interleave:
+        order = order[1::2] + order[::2]
+    for index in order:
+        grain = padded[index * grain_bytes:(index + 1) * grain_bytes]
+        if not grain.any():
+            continue
+        grains[index] = len(out) // SECTOR_SIZE
+        if stream:
+            packed = zlib.compress(grain.tostring())
+            marker = np.array([(index * grain_size, len(packed))], dtype=GRAIN_MARKER)
+            chunk = marker.tostring() + packed
+            out += chunk + "\0" * (-len(chunk) % SECTOR_SIZE)
+        else:
+            out += grain.tostring()
+
+    def metadata(payload):
+        # stream optimized metadata follows a marker sector
+        if stream:
+            out.extend("\0" * SECTOR_SIZE)
+        offset = len(out) // SECTOR_SIZE
+        out.extend(payload + "\0" * (-len(payload) % SECTOR_SIZE))
+        return offset
+    directory = np.zeros(ntables, dtype='<u4')
+    for table in xrange(ntables):
+        entries = grains[table * per_table:(table + 1) * per_table]
+        if entries.any():
+            directory[table] = metadata(entries.tostring() + "\0" * (table_sectors * SECTOR_SIZE - entries.nbytes))
+    gd_offset = metadata(directory.tostring())
+
+    if stream:
+        header['gdOffset'] = GD_AT_END
+        out[:SECTOR_SIZE] = header.tostring()
+        header['gdOffset'] = gd_offset
+        out += "\0" * SECTOR_SIZE + header.tostring() + "\0" * SECTOR_SIZE
+    else:
+        header['gdOffset'] = gd_offset
+        out[:SECTOR_SIZE] = header.tostring()
+    with open(path, "wb") as fd:
+        fd.write(out)
+
+class TestSparse(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="vixsparse-")
+        # 10 grains of 8KB and a short one: data in grains 0, 1, 4 and 10
+        self.data = np.zeros(10 * 8192 + 2048, dtype=np.uint8)
+        self.data[:16384] = np.arange(16384) % 249
+        self.data[4 * 8192 + 512:5 * 8192] = 3
+        self.data[-1024:] = 4
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, extent):
+        self.assertEqual(extent.capacity, self.data.size // 512)
+        self.assertEqual(np.flatnonzero(extent.grains > 1).tolist(), [0, 1, 4, 10])
+        self.assertEqual(extent.allocated(0, extent.capacity).tolist(), [[0, 32], [64, 16], [160, 4]])
+        self.assertEqual(extent.allocated(20, 50).tolist(), [[20, 12], [64, 6]])
+        # every alignment and length, across grains and holes
+        for start, count in ((0, 164), (3, 1), (15, 2), (30, 40), (65, 15), (100, 64), (161, 3)):
+            out = np.empty(count * 512, dtype=np.uint8)
+            extent.read_into(out, start * 512)
+            self.assertTrue(np.array_equal(out, self.data[start * 512:(start + count) * 512]), (start, count))
+        with self.assertRaises(VixDiskLibError):
+            extent.read_into(np.empty(1024, dtype=np.uint8), 163 * 512)
+
+    def testMonolithicSparse(self):
+        path = os.path.join(self.dir, "sparse.vmdk")
+        write_sparse(path, self.data)
+        extent = SparseExtent(ExtentFile(path))
+        self.assertFalse(extent.compressed)
+        self.assertEqual(extent.descriptor.ddb["adapterType"], "lsilogic")
+        self.check(extent)
+        extent.close()
+
+        # grains stored in order are read together
+        write_sparse(path, self.data, interleave=False)
+        extent = SparseExtent(ExtentFile(path))
+        self.assertEqual(np.diff(extent.grains[:2]).tolist(), [16])
+        self.check(extent)
+        extent.close()
+
+    def testStreamOptimized(self):
+        path = os.path.join(self.dir, "stream.vmdk")
+        write_sparse(path, self.data, stream=True)
+        extent = SparseExtent(ExtentFile(path))
+        self.assertTrue(extent.compressed)
+        self.check(extent)
+        extent.close()
+
+        # a grain marked with the wrong sector is caught
+        with open(path, "r+b") as fd:
+            fd.seek(int(extent.grains[1]) * 512)
+            fd.write(np.array([(0, 0)], dtype=GRAIN_MARKER).tostring()[:8])
+        extent = SparseExtent(ExtentFile(path))
+        with self.assertRaises(VixDiskLibError):
+            extent.read_into(np.empty(512, dtype=np.uint8), 16 * 512)
+        extent.close()
+
+    def testBackend(self):
+        path = os.path.join(self.dir, "split.vmdk")
+        with open(path, "w") as fd:
+            fd.write(DESCRIPTOR.replace('RW %d SPARSE "%s"', 'RW %d SPARSE "%s"\nRW 100 ZERO') % (
+                "twoGbMaxExtentSparse", self.data.size // 512, "split-s001.vmdk"))
+        write_sparse(os.path.join(self.dir, "split-s001.vmdk"), self.data, stream=True)
+
+        disk = VixDisk(backend="sparse", block_size=1024)
+        disk.connect()
+        disk.open(path)
+        self.assertEqual(disk.info()['capacity'], 264)
+        self.assertEqual(disk.getMetadata()["virtualHWVersion"], "7")
+        self.assertTrue(disk.allocation_supported)
+        self.assertEqual(disk.query_allocated().tolist(), [[0, 32], [64, 16], [160, 4]])
+        self.assertTrue(np.array_equal(disk.read(0, 82)[:self.data.size], self.data))
+        self.assertEqual([start for start, _ in disk.iter_allocated()], [0, 64, 160])
+        with self.assertRaises(VixDiskLibError):
+            disk.write(0, 1, np.zeros(1024, dtype=np.uint8))
+        disk.close()
+        disk.disconnect()
+
+        # a monolithic sparse file is its own descriptor, and can't be opened for writing
+        path = os.path.join(self.dir, "sparse.vmdk")
+        write_sparse(path, self.data)
+        disk.connect(readonly=False)
+        with self.assertRaises(VixDiskLibError):
+            disk.open(path)
+        disk.disconnect()
+        disk.connect()
+        disk.open(path)
+        self.assertEqual(disk.getMetadata()["adapterType"], "lsilogic")
+        self.assertTrue(np.array_equal(disk.read_extents([(0, 164)]), self.data))
+        disk.close()
+        disk.finalize()
+
+if __name__ == "__main__":
+    unittest.main()
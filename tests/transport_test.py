@@ -0,0 +1,78 @@
+'''
+Unittests for TransportSelector, using the per transport latency and failures of the
+stand-in library (FAKE_VDDK_TRANSPORTS).
+'''
+import unittest, os, time
+
+from vixDiskLib.transport import TransportSelector
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.vixExceptions import VixDiskLibError
+from utils import test_dir, get_connection, create_local_disk
+
+class TestTransportSelector(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(test_dir, "transport.vmdk")
+        creator = get_connection()
+        create_local_disk(creator, path=self.path, blocks=64, fill=False)
+        creator.disconnect()
+        self.saved = os.environ.get("FAKE_VDDK_TRANSPORTS")
+        os.environ["FAKE_VDDK_TRANSPORTS"] = "file=20000,nbd=2000,hotadd=0,san=fail"
+
+    def tearDown(self):
+        if self.saved is None:
+            del os.environ["FAKE_VDDK_TRANSPORTS"]
+        else:
+            os.environ["FAKE_VDDK_TRANSPORTS"] = self.saved
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def testProbe(self):
+        selector = TransportSelector(candidates=['file', 'san', 'hotadd', 'nbd'], sample_size=16384)
+        results = selector.probe(None, self.path)
+        self.assertEqual([r.transport for r in results], ['hotadd', 'nbd', 'file', 'san'])
+        self.assertFalse(results[-1].ok)
+        self.assertTrue(all(r.throughput > 0 for r in results[:3]))
+        self.assertEqual(selector.ranking(None, self.path), ['hotadd', 'nbd', 'file'])
+
+    def testCacheAndTTL(self):
+        selector = TransportSelector(candidates=['nbd', 'hotadd'], ttl=3600, sample_size=16384)
+        self.assertEqual(selector.ranking(None, self.path)[0], 'hotadd')
+        
+        # the ranking is trusted until it expires
+        os.environ["FAKE_VDDK_TRANSPORTS"] = "nbd=0,hotadd=20000"
+        self.assertEqual(selector.ranking(None, self.path)[0], 'hotadd')
+        selector.ttl = 0
+        selector.invalidate()
+        self.assertEqual(selector.ranking(None, self.path)[0], 'nbd')
+
+    def testOpenFallsBack(self):
+        selector = TransportSelector(candidates=['hotadd', 'nbd'], sample_size=16384)
+        self.assertEqual(selector.ranking(None, self.path), ['hotadd', 'nbd'])
+        
+        # hotadd stops working after the probe
+        os.environ["FAKE_VDDK_TRANSPORTS"] = "hotadd=fail,nbd=0"
+        disk = VixDisk()
+        self.assertEqual(selector.open(disk, self.path), 'nbd')
+        disk.read(0)
+        disk.close()
+        disk.disconnect()
+        self.assertEqual(selector.ranking(None, self.path), ['nbd'])
+        
+        # and once nothing in the ranking works, the library chooses
+        os.environ["FAKE_VDDK_TRANSPORTS"] = "nbd=fail"
+        disk = VixDisk()
+        self.assertEqual(selector.open(disk, self.path), 'file')
+        disk.close()
+        disk.disconnect()
+
+    def testOpenFails(self):
+        os.environ["FAKE_VDDK_TRANSPORTS"] = "file=fail"
+        selector = TransportSelector(candidates=['file'], sample_size=16384)
+        disk = VixDisk()
+        with self.assertRaises(VixDiskLibError):
+            selector.open(disk, self.path)
+        self.assertFalse(disk.connected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,7 @@ Unittest utility methods
 import os.path, platform
 from vixDiskLib import VixDisk, VixDiskLib_CreateParams
 from vixDiskLib.consts import VixDiskLibDiskType, VixDiskLibAdapterType, VixDiskLibHwVersion
+from vixDiskLib.writebuffer import WriteBuffer
 import numpy as np
 
 test_dir = os.path.abspath(os.path.dirname(__file__))
@@ -60,8 +61,11 @@ def create_local_disk(
         buffer = np.zeros(vix_disk.block_size, dtype=np.uint8)
         buffer.fill(42) # it's the answer
     
+        # merge the block writes into 1MB library calls
+        staging = WriteBuffer(vix_disk.write_from, 1048576, vix_disk.block_size)
         for block in xrange(blocks):
-            vix_disk.write(block, 1, buffer)
+            staging.write(block, buffer)
+        staging.flush()
         
     vix_disk.close()
     return vix_disk
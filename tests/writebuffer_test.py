@@ -0,0 +1,60 @@
+'''
+Unittests for the write coalescing buffer.
+'''
+import unittest
+import numpy as np
+
+from vixDiskLib.writebuffer import WriteBuffer
+from vixDiskLib.vixExceptions import VixDiskLibError
+
+class TestWriteBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.staging = WriteBuffer(self.writer, 4 * 512, 512)
+
+    def writer(self, offset, data):
+        self.calls.append((offset, data.size, int(data[0])))
+
+    def block(self, value, nblocks=1):
+        return np.ones(512 * nblocks, dtype=np.uint8) * value
+
+    def testMergeSequential(self):
+        for block in xrange(10):
+            self.staging.write(block, self.block(block))
+        self.assertEqual(self.calls, [(0, 2048, 0), (4, 2048, 4)])
+        self.assertEqual(self.staging.pending, 1024)
+        self.staging.flush()
+        self.assertEqual(self.calls[-1], (8, 1024, 8))
+        self.assertEqual((self.staging.stats.writes, self.staging.stats.flushes), (10, 3))
+
+    def testFlushOnGap(self):
+        self.staging.write(0, self.block(1))
+        self.staging.write(5, self.block(2))
+        self.staging.write(4, self.block(3))
+        self.staging.flush()
+        self.assertEqual(self.calls, [(0, 512, 1), (5, 512, 2), (4, 512, 3)])
+
+    def testLargeWrite(self):
+        self.staging.write(0, self.block(1))
+        self.staging.write(1, self.block(2, 6))
+        self.staging.write(20, self.block(3, 8))
+        self.staging.flush()
+        self.assertEqual(self.calls, [(0, 2048, 1), (4, 1536, 2), (20, 4096, 3)])
+        self.assertEqual(self.staging.stats.bytes, 7680)
+
+    def testErrorAtFlush(self):
+        def failing(offset, data):
+            raise VixDiskLibError("write failed")
+        staging = WriteBuffer(failing, 4 * 512, 512)
+        staging.write(0, self.block(1))
+        with self.assertRaises(VixDiskLibError):
+            staging.flush()
+        self.assertEqual(staging.pending, 0)
+        
+        with self.assertRaises(VixDiskLibError):
+            staging.write(0, bytearray(100))
+
+
+if __name__ == "__main__":
+    unittest.main()
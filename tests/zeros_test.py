@@ -0,0 +1,36 @@
+'''
+Unittests for zero block detection.
+'''
+import unittest
+import numpy as np
+
+from vixDiskLib.zeros import ZeroStats, zero_mask, data_runs
+
+class TestZeros(unittest.TestCase):
+
+    def testMask(self):
+        data = np.zeros(8 * 512, dtype=np.uint8)
+        data[512 * 2] = 1
+        data[512 * 7 + 511] = 1
+        self.assertEqual(zero_mask(data, 512).tolist(), [True, True, False, True, True, True, True, False])
+        
+        # unaligned views, odd block sizes and a short last block
+        self.assertEqual(zero_mask(data[1:], 512).tolist(), [True, False, True, True, True, True, True, False])
+        self.assertEqual(zero_mask(data[:1000], 100).tolist(), [True] * 10)
+        self.assertEqual(zero_mask(bytearray(3), 512).tolist(), [True])
+        self.assertEqual(zero_mask("", 512).size, 0)
+
+    def testDataRuns(self):
+        mask = np.array([True, False, False, True, False], dtype=bool)
+        self.assertEqual(data_runs(mask), [(1, 2), (4, 1)])
+        self.assertEqual(data_runs(np.ones(3, dtype=bool)), [])
+        self.assertEqual(data_runs(np.zeros(3, dtype=bool)), [(0, 3)])
+
+    def testStats(self):
+        stats = ZeroStats()
+        stats.count(np.array([True, False, True]), 512)
+        self.assertEqual((stats.blocks, stats.zero_blocks, stats.bytes_saved), (3, 2, 1024))
+
+
+if __name__ == "__main__":
+    unittest.main()
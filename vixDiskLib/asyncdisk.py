@@ -0,0 +1,229 @@
+'''
+A future based front end for event loops.
+
+Every vix-disklib call blocks, and a handle must never be used by two threads at
+once.  AsyncVixDisk gives each disk its own worker thread: calls are queued to it and
+return a Future straight away, so one event loop can drive many disks with exactly one
+thread per handle rather than an unbounded pool.
+
+The futures are ``concurrent.futures.Future`` objects when that module is available
+(Python 3, or the "futures" backport), so they can be handed to
+``asyncio.wrap_future`` or yielded from a tornado coroutine; otherwise a small
+compatible Future is used.
+'''
+import sys, threading, Queue, logging
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.vixDisk import VixDisk
+
+log = logging.getLogger("vixDiskLib.asyncdisk")
+
+try:
+    from concurrent.futures import Future
+except ImportError:
+    class Future(object):
+        """ The subset of concurrent.futures.Future used here """
+        def __init__(self):
+            self._done = threading.Event()
+            self._result = None
+            self._exc_info = None
+            self._callbacks = []
+            self._lock = threading.Lock()
+
+        def done(self):
+            return self._done.is_set()
+
+        def result(self, timeout=None):
+            if not self._done.wait(timeout):
+                raise VixDiskLibError("Timed out waiting for a result")
+            if self._exc_info:
+                raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+            return self._result
+
+        def exception(self, timeout=None):
+            if not self._done.wait(timeout):
+                raise VixDiskLibError("Timed out waiting for a result")
+            return self._exc_info[1] if self._exc_info else None
+
+        def add_done_callback(self, fn):
+            with self._lock:
+                if not self._done.is_set():
+                    self._callbacks.append(fn)
+                    return
+            fn(self)
+
+        def set_result(self, result):
+            self._result = result
+            self._finish()
+
+        def set_exception_info(self, exc, tb):
+            self._exc_info = (type(exc), exc, tb)
+            self._finish()
+
+        def set_exception(self, exc):
+            self.set_exception_info(exc, None)
+
+        def _finish(self):
+            with self._lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for fn in callbacks:
+                try:
+                    fn(self)
+                except Exception:
+                    log.exception("Future callback failed")
+
+class HandleExecutor(object):
+    """
+    Runs calls one at a time, in order, on a single dedicated thread.
+    """
+    def __init__(self, name="vixdisk"):
+        self.tasks = Queue.Queue()
+        self._shutdown = False
+        # orders submit() against shutdown(), so nothing is queued behind the sentinel
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._work, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """ Queues fn(*args, **kwargs) and returns a Future for its result """
+        with self._lock:
+            if self._shutdown:
+                raise VixDiskLibError("Executor has been shut down")
+            future = Future()
+            self.tasks.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """ Stops the thread once the queued calls are done """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            self.tasks.put(None)
+        if wait:
+            self.thread.join()
+
+    def _work(self):
+        tasks = self.tasks
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            future, fn, args, kwargs = task
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException, e:
+                if hasattr(future, "set_exception_info"):
+                    future.set_exception_info(e, sys.exc_info()[2])
+                else:
+                    future.set_exception(e)
+            else:
+                future.set_result(result)
+        # whatever still got queued behind the sentinel is never run, but must not hang
+        while True:
+            try:
+                task = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            if task is not None:
+                task[0].set_exception(VixDiskLibError("Executor has been shut down"))
+
+class AsyncVixDisk(object):
+    """
+    A :py:class:`vixDiskLib.vixDisk.VixDisk` driven through its own worker thread.
+    Every method queues the call and returns a Future.  The library is initialized on
+    the worker too, so even the constructor does not block.
+
+    Takes the same arguments as :py:class:`vixDiskLib.vixDisk.VixDisk`.
+    """
+    def __init__(self, *args, **kwargs):
+        self.executor = HandleExecutor()
+        self.disk = None
+        self.created = self.executor.submit(self._create, args, kwargs)
+
+    def _create(self, args, kwargs):
+        self.disk = VixDisk(*args, **kwargs)
+
+    def _submit(self, fn):
+        def run():
+            if self.disk is None:
+                raise VixDiskLibError("The disk could not be created: %s" % self.created.exception())
+            return fn()
+        return self.executor.submit(run)
+
+    def _call(self, name, *args, **kwargs):
+        return self._submit(lambda: getattr(self.disk, name)(*args, **kwargs))
+
+    def connect(self, snapshotRef=None, transport=None, readonly=True):
+        """ See :py:meth:`VixBase.connect` """
+        return self._call("connect", snapshotRef, transport, readonly)
+
+    def disconnect(self):
+        """ See :py:meth:`VixBase.disconnect` """
+        return self._call("disconnect")
+
+    def open(self, path, single=False):
+        """ See :py:meth:`VixDiskBase.open` """
+        return self._call("open", path, single)
+
+    def close(self):
+        """ See :py:meth:`VixDiskBase.close` """
+        return self._call("close")
+
+    def info(self):
+        """ See :py:meth:`VixDiskBase.info` """
+        return self._call("info")
+
+    def read(self, offset, nblocks=1):
+        """
+        Reads `nblocks` blocks at block `offset`.  Unlike :py:meth:`VixDiskBase.read`,
+        every read gets its own np.ndarray, since several may be in flight.
+        """
+        def read():
+            buff = np.empty(nblocks * self.disk.block_size, dtype=np.uint8)
+            self.disk.read_into(offset, buff)
+            return buff
+        return self._submit(read)
+
+    def write(self, offset, nblocks, buff):
+        """ See :py:meth:`VixDiskBase.write` """
+        return self._call("write", offset, nblocks, buff)
+
+    def write_from(self, offset, buffer):
+        """ See :py:meth:`VixDiskBase.write_from` """
+        return self._call("write_from", offset, buffer)
+
+    def iter(self, nblocks=1, depth=4, start=0, count=None):
+        """
+        Returns an iterator over Futures for consecutive reads, keeping up to `depth`
+        reads queued ahead of the one being waited on.
+
+        :param nblocks: The number of blocks per read.
+        :param depth: The most reads in flight at once.
+        :param start: The first block to read.
+        :param count: The number of blocks to read.  Pass it (for example from an awaited
+                      :py:meth:`info`) to avoid a blocking info() call here.
+        :return: Futures resolving to np.ndarray, in disk order.
+        """
+        if count is None:
+            capacity = self.info().result()['capacity']
+            count = capacity * 512 // self.disk.block_size - start
+        reads = ((block, min(nblocks, start + count - block)) for block in xrange(start, start + count, nblocks))
+
+        pending = []
+        for block, n in reads:
+            pending.append(self.read(block, n))
+            if len(pending) >= max(1, depth):
+                yield pending.pop(0)
+        while pending:
+            yield pending.pop(0)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker thread after the queued calls.  Close and disconnect first.
+        """
+        self.executor.shutdown(wait)
@@ -0,0 +1,563 @@
+'''
+Storage backends for :py:class:`VixDiskBase`.
+
+By default a VixDiskBase goes through the vix-disklib C API, which needs the VDDK
+installed and initialized even to read a local file.  Given a `backend`, it hands
+open, close, read, write, info and the metadata calls to that object instead, and
+never initializes or connects the library, so local restores and CI runs get plain
+file I/O with no library init cost:
+
+    disk = VixDisk(backend="flat")
+    disk.connect()
+    disk.open("/images/disk.vmdk")
+
+A backend is any object with the methods of :py:class:`Backend`.  The ones here are:
+
+  * "flat" (:py:class:`FlatBackend`): raw images, and MONOLITHIC_FLAT, SPLIT_FLAT and
+    VMFS_FLAT disks, read and written with positioned I/O on the extent files.
+  * "sparse" (:py:class:`SparseBackend`): the flat disks and also MONOLITHIC_SPARSE,
+    SPLIT_SPARSE and STREAM_OPTIMIZED ones (see :py:mod:`vixDiskLib.sparse`), read only.
+  * "mmap" (:py:class:`MappedBackend`): the flat disks again, with the extent files
+    memory mapped, so that `VixDiskBase.read` returns views of the page cache rather
+    than copies.
+
+This module does not need the VDDK, and the backends can be used on their own.
+'''
+import os, io, mmap, ctypes, ctypes.util, threading, random
+from bisect import bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError, VixDiskUnimplemented
+from vixDiskLib.consts import VixDiskLibDiskType, VixDiskLibAdapterType, VixDiskLibHwVersion
+from vixDiskLib.descriptor import Descriptor, Extent, read_descriptor
+from vixDiskLib.sparse import SparseExtent, is_sparse
+
+SECTOR_SIZE = 512
+# the extent size of SPLIT_FLAT disks (2GB)
+SPLIT_EXTENT_SECTORS = 4194304
+
+ADAPTER_NAMES = {
+    VixDiskLibAdapterType['IDE']: "ide",
+    VixDiskLibAdapterType['SCSI_BUSLOGIC']: "buslogic",
+    VixDiskLibAdapterType['SCSI_LSILOGIC']: "lsilogic",
+}
+ADAPTER_TYPES = dict((name, value) for value, name in ADAPTER_NAMES.items())
+
+CREATE_TYPES = {
+    VixDiskLibDiskType['MONOLITHIC_FLAT']: "monolithicFlat",
+    VixDiskLibDiskType['SPLIT_FLAT']: "twoGbMaxExtentFlat",
+    VixDiskLibDiskType['VMFS_FLAT']: "vmfs",
+}
+
+class ExtentFile(object):
+    """
+    An open extent file, read and written at given offsets.  Python 3 has os.preadv
+    and os.pwrite for that; on Python 2 the seek and the transfer are done under a
+    lock instead, so one file can still be shared between threads.  Either way the GIL
+    is released while the data moves.
+    """
+    def __init__(self, path, readonly=True):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR)
+        self._io = io.FileIO(self.fd, "r" if readonly else "r+", closefd=False)
+        self._lock = threading.Lock()
+
+    def size(self):
+        return os.fstat(self.fd).st_size
+
+    def read_into(self, out, offset):
+        """ Fills the uint8 array `out` from `offset`; what is past the end of the file reads as zeros """
+        view = memoryview(out)
+        done = 0
+        while done < len(view):
+            if hasattr(os, "preadv"):
+                n = os.preadv(self.fd, [view[done:]], offset + done)
+            else:
+                with self._lock:
+                    os.lseek(self.fd, offset + done, os.SEEK_SET)
+                    n = self._io.readinto(view[done:])
+            if not n:
+                out[done:] = 0
+                break
+            done += n
+
+    def write_from(self, data, offset):
+        """ Writes the uint8 array `data` at `offset` """
+        view = memoryview(data)
+        done = 0
+        while done < len(view):
+            if hasattr(os, "pwrite"):
+                done += os.pwrite(self.fd, view[done:], offset + done)
+            else:
+                with self._lock:
+                    os.lseek(self.fd, offset + done, os.SEEK_SET)
+                    done += os.write(self.fd, view[done:])
+
+    def close(self):
+        self._io.close()
+        os.close(self.fd)
+
+# madvise() advice, in the mmap module from Python 3.8 on (these are the Linux values)
+MADV_NORMAL = getattr(mmap, "MADV_NORMAL", 0)
+MADV_RANDOM = getattr(mmap, "MADV_RANDOM", 1)
+MADV_SEQUENTIAL = getattr(mmap, "MADV_SEQUENTIAL", 2)
+MADV_WILLNEED = getattr(mmap, "MADV_WILLNEED", 3)
+
+# how far a sequential scan must have gone before the kernel is told about it, and how
+# much of the file is then asked for ahead of the reads
+SEQUENTIAL_THRESHOLD = 1048576
+READAHEAD_SIZE = 8388608
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+except (OSError, AttributeError):
+    _libc = None
+
+class MappedExtent(object):
+    """
+    An extent file mapped into memory, read through numpy views of the mapping.  Writes
+    still go through the file with `write_from`; the mapping shares the page cache with
+    it, so it sees them.
+
+    Reads are watched for sequential scans: once one has read SEQUENTIAL_THRESHOLD
+    bytes, the mapping is advised MADV_SEQUENTIAL and the next READAHEAD_SIZE bytes
+    MADV_WILLNEED, so the kernel reads ahead of the scan; a jump elsewhere sets it back
+    to MADV_NORMAL.  The current advice is in `advice`.
+
+    :param fd: The open :py:class:`ExtentFile`, closed by :py:meth:`close`.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.path = fd.path
+        self._size = fd.size()
+        # an empty file can not be mapped, and reads as zeros anyway
+        self._map = mmap.mmap(fd.fd, self._size, access=mmap.ACCESS_READ) if self._size else None
+        self.data = np.frombuffer(self._map, dtype=np.uint8) if self._size else np.empty(0, dtype=np.uint8)
+        self.advice = MADV_NORMAL
+        self._next = None
+        self._run = 0
+        self._ahead = 0
+        self._lock = threading.Lock()
+
+    def size(self):
+        return self._size
+
+    def view(self, offset, nbytes):
+        """
+        Returns the read only array of `nbytes` bytes from `offset`, a view of the
+        mapping, or None if that goes past the end of the file.
+        """
+        if offset + nbytes > self._size:
+            return None
+        self._advise_read(offset, nbytes)
+        return self.data[offset:offset + nbytes]
+
+    def read_into(self, out, offset):
+        """ Fills the uint8 array `out` from `offset`; what is past the end of the file reads as zeros """
+        self._advise_read(offset, out.size)
+        present = max(0, min(out.size, self._size - offset))
+        out[:present] = self.data[offset:offset + present]
+        out[present:] = 0
+
+    def write_from(self, data, offset):
+        self.fd.write_from(data, offset)
+
+    def _advise_read(self, offset, nbytes):
+        with self._lock:
+            if offset != self._next:
+                self._run = 0
+                self._ahead = 0
+                if self.advice != MADV_NORMAL:
+                    self._madvise(0, self._size, MADV_NORMAL)
+            self._next = offset + nbytes
+            self._run += nbytes
+            if self._run < SEQUENTIAL_THRESHOLD:
+                return
+            if self.advice != MADV_SEQUENTIAL:
+                self._madvise(0, self._size, MADV_SEQUENTIAL)
+            # ask for the next window when the scan is half way through the last one
+            if self._next + READAHEAD_SIZE // 2 > self._ahead:
+                start = max(self._next, self._ahead)
+                self._ahead = min(self._next + READAHEAD_SIZE, self._size)
+                if self._ahead > start:
+                    self._madvise(start, self._ahead - start, MADV_WILLNEED)
+
+    def _madvise(self, start, length, advice):
+        """ Gives the kernel a hint about a range of the mapping.  Hints that fail are dropped. """
+        if advice != MADV_WILLNEED:
+            self.advice = advice
+        if self._map is None:
+            return
+        # the range must start on a page
+        length += start % mmap.PAGESIZE
+        start -= start % mmap.PAGESIZE
+        if hasattr(self._map, "madvise"):
+            try:
+                self._map.madvise(advice, start, length)
+            except (OSError, ValueError):
+                pass
+        elif _libc is not None:
+            _libc.madvise(self.data.ctypes.data + start, length, advice)
+
+    def close(self):
+        # the mapping is not closed here: arrays handed out by view() may still point into
+        # it, and it is unmapped once the last of them is gone
+        self.fd.close()
+        self.data = np.empty(0, dtype=np.uint8)
+        self._map = None
+        self._size = 0
+
+class Backend(object):
+    """
+    What :py:class:`VixDiskBase` needs from a backend.  Sectors are 512 bytes, and the
+    buffers are uint8 numpy arrays of exactly the bytes asked for.  A backend that can
+    hand out data without copying it also has a `view(sector, nsectors)` method, like
+    :py:meth:`MappedBackend.view`, which `VixDiskBase.read` then uses.
+    """
+    name = None
+    # the transport mode VixDiskBase reports
+    transport_mode = "file"
+    # True if allocated() can tell allocated from unallocated space
+    allocation_supported = False
+
+    def open(self, path, readonly=True):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def read(self, sector, nsectors, out):
+        """ Reads `nsectors` sectors from `sector` into `out` """
+        raise NotImplementedError
+
+    def write(self, sector, nsectors, data):
+        """ Writes `nsectors` sectors from `data` at `sector` """
+        raise NotImplementedError
+
+    def info(self):
+        """ Returns a dict like :py:meth:`VixDiskBase.info`, without 'blocks' """
+        raise NotImplementedError
+
+    def metadata(self):
+        """ Returns the metadata as a dict of strings """
+        raise NotImplementedError
+
+    def set_metadata(self, metadata):
+        """ Adds or replaces the given metadata entries """
+        raise NotImplementedError
+
+    def allocated(self, start, count):
+        """
+        Returns the allocated parts of a sector range as (start, nsectors) pairs, or
+        None when that can not be told.
+        """
+        return None
+
+    def create(self, path, capacity, disk_type, adapter_type, hw_version):
+        """ Creates a disk of `capacity` sectors at `path` """
+        raise VixDiskUnimplemented("The %s backend can not create disks" % self.name)
+
+    def unlink(self, path):
+        """ Deletes the disk at `path` and its extents """
+        raise VixDiskUnimplemented("The %s backend can not delete disks" % self.name)
+
+class FlatBackend(Backend):
+    """
+    Raw images and flat VMDKs.  A path holding a descriptor is opened as the disk it
+    describes, with FLAT, VMFS and ZERO extents; anything else is taken as a raw
+    image, sector N at byte N * 512.
+    """
+    name = "flat"
+    # the descriptor extent types this backend reads
+    extent_types = ("FLAT", "VMFS", "ZERO")
+
+    def __init__(self):
+        self.path = None
+        self.readonly = True
+        self.descriptor = None
+        self._files = []
+        self._extents = []
+        self._starts = []
+
+    def open(self, path, readonly=True):
+        if self.path is not None:
+            raise VixDiskLibError("%s is already open" % self.path)
+        if not os.path.exists(path):
+            raise VixDiskLibError("No such disk: %s" % path)
+        descriptor = read_descriptor(path)
+        if descriptor is None:
+            descriptor, extents, files = self._open_image(path, readonly)
+        else:
+            extents = descriptor.extents
+            for extent in extents:
+                if extent.type not in self.extent_types:
+                    raise VixDiskLibError("The %s backend can not read %s extents: %s" % (self.name, extent.type, path))
+            directory = os.path.dirname(os.path.abspath(path))
+            files = []
+            try:
+                for extent in extents:
+                    files.append(self._open_extent(os.path.join(directory, extent.filename or ""), extent,
+                                                   readonly or extent.access != "RW"))
+            except (OSError, VixDiskLibError), e:
+                for fd in files:
+                    if fd is not None:
+                        fd.close()
+                raise VixDiskLibError("Can not open the extents of %s: %s" % (path, e))
+        self.path = path
+        self.readonly = readonly
+        self.descriptor = descriptor
+        self._files = files
+        self._extents = extents
+        self._starts = np.cumsum([0] + [extent.sectors for extent in extents]).tolist()
+
+    def _open_image(self, path, readonly):
+        """ Opens a file without a descriptor, returns (descriptor, extents, files) """
+        fd = ExtentFile(path, readonly)
+        return None, [Extent("RW", fd.size() // SECTOR_SIZE, "FLAT", path, 0)], [fd]
+
+    def _open_extent(self, path, extent, readonly):
+        """ Returns what reads (and writes) an extent, None for ZERO ones """
+        if extent.type == "ZERO":
+            return None
+        return ExtentFile(path, readonly)
+
+    def close(self):
+        for fd in self._files:
+            if fd is not None:
+                fd.close()
+        self.path = None
+        self.descriptor = None
+        self._files = []
+        self._extents = []
+        self._starts = []
+
+    @property
+    def capacity(self):
+        return self._starts[-1] if self._starts else 0
+
+    def pieces(self, sector, nsectors):
+        """
+        Maps a sector range onto the extents: yields (index, sector in the extent,
+        nsectors, position in the range) for each extent the range covers.
+        """
+        if self.path is None:
+            raise VixDiskLibError("No disk is open")
+        if sector + nsectors > self.capacity:
+            raise VixDiskLibError("Sectors %d-%d are past the end of the disk (%d)" % (sector, sector + nsectors, self.capacity))
+        index = bisect_right(self._starts, sector) - 1
+        done = 0
+        while done < nsectors:
+            inside = sector + done - self._starts[index]
+            count = min(nsectors - done, self._extents[index].sectors - inside)
+            yield index, inside, count, done
+            done += count
+            index += 1
+
+    def read(self, sector, nsectors, out):
+        for index, inside, count, done in self.pieces(sector, nsectors):
+            dest = out[done * SECTOR_SIZE:(done + count) * SECTOR_SIZE]
+            if self._files[index] is None:
+                dest[:] = 0
+            else:
+                self._files[index].read_into(dest, (self._extents[index].offset + inside) * SECTOR_SIZE)
+
+    def write(self, sector, nsectors, data):
+        if self.readonly:
+            raise VixDiskLibError("%s is open read only" % self.path)
+        for index, inside, count, done in self.pieces(sector, nsectors):
+            extent = self._extents[index]
+            if self._files[index] is None or extent.access != "RW":
+                raise VixDiskLibError("Sectors %d-%d are in a %s %s extent" % (sector, sector + nsectors, extent.access, extent.type))
+            self._files[index].write_from(data[done * SECTOR_SIZE:(done + count) * SECTOR_SIZE],
+                                          (extent.offset + inside) * SECTOR_SIZE)
+
+    def info(self):
+        ddb = self.descriptor.ddb if self.descriptor else {}
+        heads = int(ddb.get("geometry.heads", 16))
+        sectors = int(ddb.get("geometry.sectors", 63))
+        geometry = {
+            "cylinders": int(ddb.get("geometry.cylinders", self.capacity // (heads * sectors))),
+            "heads": heads,
+            "sectors": sectors}
+        bios = {
+            "cylinders": int(ddb.get("geometry.biosCylinders", geometry["cylinders"])),
+            "heads": int(ddb.get("geometry.biosHeads", heads)),
+            "sectors": int(ddb.get("geometry.biosSectors", sectors))}
+        return {
+            'bios': bios,
+            'physGeo': geometry,
+            'capacity': self.capacity,
+            'adapterType': ADAPTER_TYPES.get(ddb.get("adapterType"), VixDiskLibAdapterType['UNKNOWN']),
+            'links': 1}
+
+    def metadata(self):
+        return dict(self.descriptor.ddb) if self.descriptor else {}
+
+    def set_metadata(self, metadata):
+        if self.descriptor is None:
+            raise VixDiskLibError("%s is a raw image, it has no metadata" % self.path)
+        if self.readonly:
+            raise VixDiskLibError("%s is open read only" % self.path)
+        self.descriptor.ddb.update(metadata)
+        self.descriptor.save(self.path)
+
+    def create(self, path, capacity, disk_type=VixDiskLibDiskType['MONOLITHIC_FLAT'],
+               adapter_type=VixDiskLibAdapterType['SCSI_LSILOGIC'],
+               hw_version=VixDiskLibHwVersion['CURRENT'], split_size=SPLIT_EXTENT_SECTORS):
+        """
+        Creates a flat disk: a descriptor at `path` and its extent files next to it,
+        sparse until written.
+
+        :param disk_type: MONOLITHIC_FLAT, SPLIT_FLAT or VMFS_FLAT.
+        :param split_size: The extent size of SPLIT_FLAT disks, in sectors.
+        """
+        if disk_type not in CREATE_TYPES:
+            raise VixDiskUnimplemented("The %s backend can not create disks of type %d" % (self.name, disk_type))
+        if os.path.exists(path):
+            raise VixDiskLibError("%s already exists" % path)
+        base = os.path.splitext(os.path.basename(path))[0]
+        directory = os.path.dirname(os.path.abspath(path))
+
+        extents = []
+        if disk_type == VixDiskLibDiskType['SPLIT_FLAT']:
+            for i, start in enumerate(xrange(0, capacity, split_size)):
+                extents.append(Extent("RW", min(split_size, capacity - start), "FLAT", "%s-f%03d.vmdk" % (base, i + 1), 0))
+        else:
+            extent_type = "VMFS" if disk_type == VixDiskLibDiskType['VMFS_FLAT'] else "FLAT"
+            extents.append(Extent("RW", capacity, extent_type, "%s-flat.vmdk" % base, 0))
+        for extent in extents:
+            with open(os.path.join(directory, extent.filename), "wb") as fd:
+                fd.truncate(extent.sectors * SECTOR_SIZE)
+
+        header = OrderedDict([
+            ("version", "1"), ("encoding", "UTF-8"), ("CID", "%08x" % random.getrandbits(32)),
+            ("parentCID", "ffffffff"), ("createType", CREATE_TYPES[disk_type])])
+        ddb = OrderedDict([
+            ("adapterType", ADAPTER_NAMES.get(adapter_type, "lsilogic")),
+            ("geometry.cylinders", str(min(capacity // (16 * 63), 65535))),
+            ("geometry.heads", "16"),
+            ("geometry.sectors", "63"),
+            ("virtualHWVersion", str(hw_version))])
+        Descriptor(header, extents, ddb).save(path)
+
+    def unlink(self, path):
+        descriptor = read_descriptor(path)
+        if descriptor is not None:
+            directory = os.path.dirname(os.path.abspath(path))
+            for extent in descriptor.extents:
+                if extent.filename is not None and os.path.exists(os.path.join(directory, extent.filename)):
+                    os.unlink(os.path.join(directory, extent.filename))
+        os.unlink(path)
+
+class SparseBackend(FlatBackend):
+    """
+    Sparse VMDKs, as well as everything :py:class:`FlatBackend` reads, for offline
+    analysis.  A path holding a sparse extent is opened as a MONOLITHIC_SPARSE or
+    STREAM_OPTIMIZED disk, with the metadata of its embedded descriptor.  The grain
+    tables also give the allocated parts of the disk without reading any data.  Disks
+    are opened read only.
+    """
+    name = "sparse"
+    extent_types = FlatBackend.extent_types + ("SPARSE",)
+    allocation_supported = True
+
+    def open(self, path, readonly=True):
+        if not readonly:
+            raise VixDiskLibError("The %s backend is read only: %s" % (self.name, path))
+        super(SparseBackend, self).open(path, readonly)
+
+    def _open_image(self, path, readonly):
+        fd = ExtentFile(path, readonly)
+        with open(path, "rb") as head:
+            if not is_sparse(head.read(4)):
+                return None, [Extent("RW", fd.size() // SECTOR_SIZE, "FLAT", path, 0)], [fd]
+        extent = self._sparse(fd)
+        return extent.descriptor, [Extent("RDONLY", extent.capacity, "SPARSE", path, 0)], [extent]
+
+    def _open_extent(self, path, extent, readonly):
+        if extent.type != "SPARSE":
+            return super(SparseBackend, self)._open_extent(path, extent, readonly)
+        return self._sparse(ExtentFile(path, readonly))
+
+    @staticmethod
+    def _sparse(fd):
+        try:
+            return SparseExtent(fd)
+        except Exception:
+            fd.close()
+            raise
+
+    def allocated(self, start, count):
+        result = []
+        for index, inside, length, done in self.pieces(start, count):
+            extent, base = self._extents[index], start + done - inside
+            if extent.type == "SPARSE":
+                result.extend((base + s, n) for s, n in self._files[index].allocated(inside, length).tolist())
+            elif extent.type != "ZERO":
+                result.append((start + done, length))
+        return result
+
+class MappedBackend(FlatBackend):
+    """
+    The disks :py:class:`FlatBackend` reads, with the extent files memory mapped (see
+    :py:class:`MappedExtent`).  Its :py:meth:`view` returns the data of a sector range
+    without copying it when the range lies in one extent file, and
+    :py:meth:`VixDiskBase.read` returns those views instead of filling its buffer, so
+    scanning a local flat disk costs no more than the page cache.
+    """
+    name = "mmap"
+
+    def _open_image(self, path, readonly):
+        descriptor, extents, files = super(MappedBackend, self)._open_image(path, readonly)
+        return descriptor, extents, [self._mapped(fd) for fd in files]
+
+    def _open_extent(self, path, extent, readonly):
+        fd = super(MappedBackend, self)._open_extent(path, extent, readonly)
+        return None if fd is None else self._mapped(fd)
+
+    @staticmethod
+    def _mapped(fd):
+        try:
+            return MappedExtent(fd)
+        except (EnvironmentError, ValueError), e:
+            fd.close()
+            raise VixDiskLibError("Can not map %s: %s" % (fd.path, e))
+
+    def view(self, sector, nsectors):
+        """
+        Returns `nsectors` sectors from `sector` as a read only uint8 array.  A range
+        in one extent file is a view of its mapping, which also shows later writes to
+        those sectors; one that crosses extents, or covers a ZERO extent, is stitched
+        together into a new array.
+        """
+        pieces = list(self.pieces(sector, nsectors))
+        if len(pieces) == 1:
+            index, inside, count, _ = pieces[0]
+            if self._files[index] is not None:
+                data = self._files[index].view((self._extents[index].offset + inside) * SECTOR_SIZE, count * SECTOR_SIZE)
+                if data is not None:
+                    return data
+        out = np.empty(nsectors * SECTOR_SIZE, dtype=np.uint8)
+        self.read(sector, nsectors, out)
+        out.flags.writeable = False
+        return out
+
+BACKENDS = {
+    FlatBackend.name: FlatBackend,
+    SparseBackend.name: SparseBackend,
+    MappedBackend.name: MappedBackend,
+}
+
+def get_backend(backend):
+    """
+    Returns a backend instance: `backend` itself, or a new one of the backend named
+    `backend` (see BACKENDS).
+    """
+    if isinstance(backend, basestring):
+        if backend not in BACKENDS:
+            raise VixDiskLibError("Unknown backend %s, expected one of %s" % (backend, ", ".join(sorted(BACKENDS))))
+        return BACKENDS[backend]()
+    return backend
@@ -0,0 +1,102 @@
+'''
+Block read cache.
+
+Filesystem inspection (partition tables, superblocks, MFT and inode tables) reads the
+same few blocks over and over, and over NBD every one of those reads is a round trip.
+BlockCache keeps recently read blocks, keyed by block number, within a byte budget and
+evicts the least recently used ones first.  :py:class:`vixDiskLib.vixDisk.VixDisk`
+uses it in `read()` when created with a `cache_size`, and drops the blocks a write
+overlaps, as well as everything on close and reopen.
+'''
+from collections import OrderedDict
+
+import numpy as np
+
+class CacheStats(object):
+    """ Counts what a BlockCache did """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return "<CacheStats hits=%d misses=%d evictions=%d invalidations=%d>" % (
+            self.hits, self.misses, self.evictions, self.invalidations)
+
+class BlockCache(object):
+    """
+    A least recently used cache of whole blocks.
+
+    :param capacity: The byte budget.  At most capacity / block_size blocks are kept.
+    :param block_size: The size of a block, in bytes.
+    """
+    def __init__(self, capacity, block_size):
+        self.capacity = capacity
+        self.block_size = block_size
+        self.blocks = OrderedDict()
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block):
+        return block in self.blocks
+
+    @property
+    def max_blocks(self):
+        return self.capacity // self.block_size
+
+    @property
+    def size(self):
+        """ The number of bytes held """
+        return len(self.blocks) * self.block_size
+
+    def get(self, block):
+        """
+        Returns the cached (read only) data of `block` and marks it as recently used, or
+        None on a miss.
+        """
+        data = self.blocks.pop(block, None)
+        if data is None:
+            self.stats.misses += 1
+            return None
+        self.blocks[block] = data
+        self.stats.hits += 1
+        return data
+
+    def put(self, block, data):
+        """
+        Caches a copy of the data of `block`, evicting the least recently used blocks to
+        stay within the budget.
+        """
+        if self.max_blocks < 1:
+            return
+        self.blocks.pop(block, None)
+        while len(self.blocks) >= self.max_blocks:
+            self.blocks.popitem(last=False)
+            self.stats.evictions += 1
+        data = np.array(data, dtype=np.uint8, copy=True)
+        data.flags.writeable = False
+        self.blocks[block] = data
+
+    def invalidate(self, first, count):
+        """
+        Drops the cached blocks in [first, first + count).
+        """
+        if count < len(self.blocks):
+            doomed = [block for block in xrange(first, first + count) if block in self.blocks]
+        else:
+            doomed = [block for block in self.blocks if first <= block < first + count]
+        for block in doomed:
+            del self.blocks[block]
+        self.stats.invalidations += len(doomed)
+
+    def clear(self, block_size=None):
+        """
+        Drops every cached block, and optionally changes the block size.
+        """
+        self.stats.invalidations += len(self.blocks)
+        self.blocks.clear()
+        if block_size is not None:
+            self.block_size = block_size
@@ -0,0 +1,101 @@
+'''
+Changed Block Tracking.
+
+vix-disklib itself knows nothing about changed blocks, vSphere does: the areas of a
+disk that changed since a given change id come from the QueryChangedDiskAreas call
+on the virtual machine.  A change source turns a change id into a sorted extent list
+(see :py:mod:`vixDiskLib.extents`) that :py:meth:`vixDiskLib.vixDisk.VixDisk.iter_changed`
+can read.
+'''
+import json
+
+import numpy as np
+
+from vixDiskLib.extents import as_extents, normalize
+from vixDiskLib.vixExceptions import VixDiskLibError, VixDiskUnimplemented
+
+SECTOR_SIZE = 512
+
+def areas_to_extents(areas):
+    """
+    Converts (start, length) byte ranges into a sorted sector extent list.  Ranges that
+    are not sector aligned are widened to whole sectors.
+    """
+    areas = np.asarray(areas, dtype=np.uint64)
+    if areas.size == 0:
+        return as_extents([])
+    starts = areas[:, 0] // SECTOR_SIZE
+    ends = (areas[:, 0] + areas[:, 1] + SECTOR_SIZE - 1) // SECTOR_SIZE
+    return normalize(np.column_stack((starts, ends - starts)))
+
+class ChangeSource(object):
+    """ Base class for anything that can answer "what changed since change id X?" """
+
+    def changed_areas(self, change_id):
+        """
+        Returns the changed (start, length) byte ranges since `change_id`.
+        """
+        raise VixDiskUnimplemented("Currently unimplemented")
+
+    def changed_extents(self, change_id):
+        """
+        Returns the sectors changed since `change_id` as a sorted, non-overlapping
+        extent list.
+
+        :param change_id: The change id recorded with the previous backup, or "*" for
+                          every allocated area of the disk.
+        """
+        return areas_to_extents(self.changed_areas(change_id))
+
+class VimChangeSource(ChangeSource):
+    """
+    Asks vSphere through QueryChangedDiskAreas.  The answer comes back a piece at a time,
+    so the call is repeated until the whole disk is covered.
+
+    :param vm: The virtual machine managed object (pyVmomi style QueryChangedDiskAreas).
+    :param snapshot: The snapshot managed object the backup reads from.
+    :param device_key: The key of the virtual disk device.
+    :param capacity: The disk capacity in bytes.
+    """
+    def __init__(self, vm, snapshot, device_key, capacity):
+        self.vm = vm
+        self.snapshot = snapshot
+        self.device_key = device_key
+        self.capacity = capacity
+
+    def changed_areas(self, change_id):
+        areas = []
+        offset = 0
+        while offset < self.capacity:
+            info = self.vm.QueryChangedDiskAreas(snapshot=self.snapshot, deviceKey=self.device_key,
+                                                 startOffset=offset, changeId=change_id)
+            for area in (info.changedArea or []):
+                areas.append((area.start, area.length))
+            if not info.length:
+                break
+            offset = info.startOffset + info.length
+        return areas
+
+class FileChangeSource(ChangeSource):
+    """
+    Reads changed areas from a JSON file laid out like vSphere's DiskChangeInfo, or a
+    list of them::
+
+        {"changeId": "52 de 8a ... 2f/14",
+         "changedArea": [{"start": 0, "length": 65536}, ...]}
+
+    Used for tests, and for replaying a change set recorded elsewhere.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def changed_areas(self, change_id):
+        with open(self.path) as fd:
+            infos = json.load(fd)
+        if isinstance(infos, dict):
+            infos = [infos]
+
+        for info in infos:
+            if info.get("changeId") == change_id:
+                return [(area["start"], area["length"]) for area in info.get("changedArea", [])]
+        raise VixDiskLibError("No changed areas recorded for change id %s in %s" % (change_id, self.path))
@@ -0,0 +1,375 @@
+'''
+A content-addressed chunk store for deduplicated backups.
+
+Disks are cut into fixed size blocks, and each distinct block is written once, keyed by
+its digest, to packed segment files.  A backup generation is the list of digests of
+its blocks, kept as a :py:class:`vixDiskLib.manifest.Manifest`; restoring it streams the
+blocks back through :py:meth:`VixDiskBase.write`.
+
+The index has to scale to hundreds of millions of chunks, so it is not a dict.  It is a
+few runs, each a sorted array of digests plus a parallel array of locations, saved as
+plain files and memory-mapped: a lookup is a binary search (np.searchsorted, for a whole
+read buffer of blocks at once) over pages the OS caches or drops as it likes.  Chunks
+added since the last :py:meth:`ChunkStore.commit` are held in a dict and written as a
+new run at the commit.  Once there are more than `max_runs` runs they are merged into
+one.
+
+Layout under the store directory::
+
+    store.json                  block size and digest algorithm
+    segments/00000000.seg       chunks back to back
+    index/00000000.keys         sorted digests of one run
+    index/00000000.locs         (segment, length, offset) of each of them
+    generations/<name>.manifest the digests of one backup
+
+Segments are synced before the run that refers to them is written, and a generation is
+written last, so a crash leaves at most some unreferenced bytes at the end of a segment.
+'''
+import os, json, threading, logging
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.manifest import Manifest, hasher, DEFAULT_DIGEST_BLOCK
+
+log = logging.getLogger("vixDiskLib.chunkstore")
+
+SECTOR_SIZE = 512
+LOCATION = np.dtype([('segment', '<u4'), ('length', '<u4'), ('offset', '<u8')])
+
+class StoreStats(object):
+    """ Counts the blocks stored, the ones that were new, and the bytes written or saved """
+    def __init__(self):
+        self.blocks = 0
+        self.new_blocks = 0
+        self.bytes_written = 0
+        self.bytes_deduplicated = 0
+
+    def __repr__(self):
+        return "<StoreStats blocks=%d new_blocks=%d bytes_written=%d bytes_deduplicated=%d>" % (
+            self.blocks, self.new_blocks, self.bytes_written, self.bytes_deduplicated)
+
+class _Run(object):
+    """ One sorted, memory-mapped run of the index """
+    def __init__(self, base, key_dtype):
+        self.base = base
+        self.keys = self._map(base + ".keys", key_dtype)
+        self.locs = self._map(base + ".locs", LOCATION)
+
+    @staticmethod
+    def _map(path, dtype):
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return self.keys.size
+
+    def find(self, keys):
+        """ Returns (found mask, indexes into this run) for an array of keys """
+        if not len(self):
+            return np.zeros(keys.size, dtype=bool), np.zeros(keys.size, dtype=np.intp)
+        index = np.searchsorted(self.keys, keys)
+        clipped = np.minimum(index, len(self) - 1)
+        return (index < len(self)) & (self.keys[clipped] == keys), clipped
+
+class ChunkStore(object):
+    """
+    A directory of deduplicated blocks and the backup generations made of them.
+
+    :param root: The store directory.  It is created if missing.
+    :param block_size: The chunk size in bytes, a multiple of 512.  Ignored for an
+                       existing store, which keeps the size it was created with.
+    :param algorithm: The digest algorithm, see :py:func:`vixDiskLib.manifest.hasher`.
+                      Ignored for an existing store.
+    :param segment_size: Start a new segment file once one grows past this many bytes.
+    :param max_runs: Merge the index runs into one once there are more than this many.
+    """
+    def __init__(self, root, block_size=DEFAULT_DIGEST_BLOCK, algorithm="sha256",
+                 segment_size=1073741824, max_runs=8):
+        self.root = root
+        self.segment_size = segment_size
+        self.max_runs = max_runs
+        self.stats = StoreStats()
+        self._lock = threading.RLock()
+
+        config = os.path.join(root, "store.json")
+        if os.path.exists(config):
+            with open(config) as fd:
+                settings = json.load(fd)
+            block_size, algorithm = settings['block_size'], str(settings['algorithm'])
+        else:
+            if block_size <= 0 or block_size % SECTOR_SIZE:
+                raise VixDiskLibError("The chunk size must be a multiple of %d" % SECTOR_SIZE)
+            for sub in ("segments", "index", "generations"):
+                path = os.path.join(root, sub)
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            with open(config, "w") as fd:
+                json.dump(dict(block_size=block_size, algorithm=algorithm), fd)
+        self.block_size = block_size
+        self.algorithm = algorithm
+        self._new = hasher(algorithm)
+        self.digest_size = self._new().digest_size
+        self.key_dtype = np.dtype("S%d" % self.digest_size)
+
+        self._runs = [_Run(os.path.join(root, "index", name[:-5]), self.key_dtype)
+                      for name in sorted(os.listdir(os.path.join(root, "index"))) if name.endswith(".keys")]
+        self._pending = {}      # digest -> (segment, length, offset), not yet in a run
+        self._readers = {}
+        segments = sorted(os.listdir(os.path.join(root, "segments")))
+        self._segment = int(segments[-1][:-4]) if segments else 0
+        self._writer = self._open_segment(self._segment)
+
+    def _open_segment(self, segment):
+        writer = open(self._segment_path(segment), "ab")
+        # tell() is only at the end of the file after the first write otherwise
+        writer.seek(0, os.SEEK_END)
+        return writer
+
+    def _segment_path(self, segment):
+        return os.path.join(self.root, "segments", "%08d.seg" % segment)
+
+    def __len__(self):
+        """ The number of distinct chunks """
+        return sum(len(run) for run in self._runs) + len(self._pending)
+
+    def _keys(self, digests):
+        return np.ascontiguousarray(digests, dtype=np.uint8).view(self.key_dtype).ravel()
+
+    def locate(self, digests):
+        """
+        Finds chunks in the store.
+
+        :param digests: An (n, digest_size) uint8 array.
+        :return: (found mask, locations) where locations is an array of `LOCATION`
+                 records, valid where found.
+        """
+        keys = self._keys(digests)
+        found = np.zeros(keys.size, dtype=bool)
+        locs = np.zeros(keys.size, dtype=LOCATION)
+        with self._lock:
+            for run in self._runs:
+                hit, index = run.find(keys)
+                hit &= ~found
+                locs[hit] = run.locs[index[hit]]
+                found |= hit
+            if self._pending:
+                for i in np.flatnonzero(~found).tolist():
+                    loc = self._pending.get(keys[i])
+                    if loc is not None:
+                        locs[i] = loc
+                        found[i] = True
+        return found, locs
+
+    def put(self, data):
+        """
+        Stores the blocks of `data`, each block at most once.
+
+        :param data: A buffer of whole blocks, except perhaps a short last one.
+        :return: The (nblocks, digest_size) uint8 array of their digests.
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        bs = self.block_size
+        nblocks = -(-data.size // bs)
+        digests = np.empty((nblocks, self.digest_size), dtype=np.uint8)
+        for i in xrange(nblocks):
+            digests[i] = np.frombuffer(self._new(data[i * bs:(i + 1) * bs]).digest(), dtype=np.uint8)
+
+        with self._lock:
+            found, _ = self.locate(digests)
+            keys = self._keys(digests)
+            for i in np.flatnonzero(~found).tolist():
+                # the same block can be new twice in one buffer
+                if keys[i] in self._pending:
+                    found[i] = True
+                    continue
+                self._append(keys[i], data[i * bs:(i + 1) * bs])
+            self.stats.blocks += nblocks
+            self.stats.bytes_deduplicated += int(sum(min(bs, data.size - i * bs) for i in np.flatnonzero(found).tolist()))
+        return digests
+
+    def _append(self, key, chunk):
+        if self._writer.tell() >= self.segment_size:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+            self._segment += 1
+            self._writer = self._open_segment(self._segment)
+        offset = self._writer.tell()
+        self._writer.write(chunk)
+        self._pending[key] = (self._segment, chunk.size, offset)
+        self.stats.new_blocks += 1
+        self.stats.bytes_written += chunk.size
+
+    def get(self, digest, out=None):
+        """
+        Reads one chunk.
+
+        :param digest: The digest, as a uint8 array or a string.
+        :param out: Where to read it, by default a new np.ndarray.
+        :return: The chunk.
+        """
+        digest = np.frombuffer(digest, dtype=np.uint8).reshape(1, -1)
+        found, locs = self.locate(digest)
+        if not found[0]:
+            raise VixDiskLibError("Chunk %s is not in the store" % digest.tostring().encode("hex"))
+        return self._read(locs[0], out)
+
+    def _read(self, loc, out=None):
+        segment, length, offset = int(loc['segment']), int(loc['length']), int(loc['offset'])
+        if out is None:
+            out = np.empty(length, dtype=np.uint8)
+        with self._lock:
+            if segment == self._segment:
+                self._writer.flush()
+            reader = self._readers.get(segment)
+            if reader is None:
+                reader = self._readers[segment] = open(self._segment_path(segment), "rb")
+            reader.seek(offset)
+            if reader.readinto(out[:length]) != length:
+                raise VixDiskLibError("Segment %d is truncated" % segment)
+        return out[:length]
+
+    def commit(self):
+        """
+        Makes the chunks added so far durable: syncs the segment, then writes them to
+        the index as a new run.
+        """
+        with self._lock:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            if not self._pending:
+                return
+            keys = np.array(self._pending.keys(), dtype=self.key_dtype)
+            locs = np.array(self._pending.values(), dtype=LOCATION)
+            order = np.argsort(keys, kind="mergesort")
+            self._write_run(keys[order], locs[order])
+            self._pending = {}
+            if len(self._runs) > self.max_runs:
+                self.compact()
+
+    def _write_run(self, keys, locs):
+        number = int(os.path.basename(self._runs[-1].base)) + 1 if self._runs else 0
+        base = os.path.join(self.root, "index", "%08d" % number)
+        # the .keys file is what makes a run visible, so it goes last
+        for suffix, array in ((".locs", locs), (".keys", keys)):
+            with open(base + suffix + ".tmp", "wb") as fd:
+                fd.write(array.tostring())
+                fd.flush()
+                os.fsync(fd.fileno())
+            os.rename(base + suffix + ".tmp", base + suffix)
+        self._runs.append(_Run(base, self.key_dtype))
+
+    def compact(self):
+        """ Merges every index run into one """
+        with self._lock:
+            if len(self._runs) < 2:
+                return
+            old = list(self._runs)
+            keys = np.concatenate([np.asarray(run.keys) for run in old])
+            locs = np.concatenate([np.asarray(run.locs) for run in old])
+            order = np.argsort(keys, kind="mergesort")
+            self._write_run(keys[order], locs[order])
+            self._runs = self._runs[-1:]
+            for run in old:
+                os.unlink(run.base + ".keys")
+                os.unlink(run.base + ".locs")
+
+    def close(self):
+        """ Commits, and closes the segment files """
+        with self._lock:
+            self.commit()
+            self._writer.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _generation_path(self, name):
+        return os.path.join(self.root, "generations", name + ".manifest")
+
+    def generations(self):
+        """ The names of the stored generations """
+        return sorted(name[:-9] for name in os.listdir(os.path.join(self.root, "generations"))
+                      if name.endswith(".manifest"))
+
+    def generation(self, name):
+        """ The :py:class:`Manifest` of a generation """
+        if not os.path.exists(self._generation_path(name)):
+            raise VixDiskLibError("No generation %s in %s" % (name, self.root))
+        return Manifest.load(self._generation_path(name))
+
+    def backup(self, disk, name, read_size=8388608):
+        """
+        Stores every block of an open disk as a new generation.
+
+        :param disk: An open :py:class:`VixDisk`.
+        :param name: The generation name.  It must not exist yet.
+        :param read_size: The bytes per read, rounded down to a whole number of chunks.
+        :return: The generation's :py:class:`Manifest`.
+        """
+        if os.path.exists(self._generation_path(name)):
+            raise VixDiskLibError("Generation %s already exists" % name)
+        capacity = disk.info()['capacity']
+        read_sectors = max(self.block_size, read_size // self.block_size * self.block_size) // SECTOR_SIZE
+        buff = np.empty(read_sectors * SECTOR_SIZE, dtype=np.uint8)
+
+        digests = []
+        for sector in xrange(0, capacity, read_sectors):
+            count = min(read_sectors, capacity - sector)
+            data = buff[:count * SECTOR_SIZE]
+            disk.read_extents([(sector, count)], data)
+            digests.append(self.put(data))
+        self.commit()
+
+        digests = np.concatenate(digests) if digests else np.empty((0, self.digest_size), dtype=np.uint8)
+        manifest = Manifest(digests, self.algorithm, self.block_size, capacity, disk.info(), disk.getMetadata())
+        manifest.save(self._generation_path(name))
+        return manifest
+
+    def restore(self, name, disk, read_size=8388608):
+        """
+        Writes a generation back to an open disk of at least the same capacity, through
+        :py:meth:`VixDiskBase.write`.  The chunk size must be a multiple of the disk's
+        block size.
+
+        :param name: The generation name.
+        :param disk: A :py:class:`VixDisk` opened for writing.
+        :param read_size: The bytes per write, rounded down to a whole number of chunks.
+        :return: The number of bytes written.
+        """
+        manifest = self.generation(name)
+        if self.block_size % disk.block_size:
+            raise VixDiskLibError("The chunk size %d is not a multiple of the disk block size %d" % (
+                self.block_size, disk.block_size))
+        if disk.info()['capacity'] < manifest.capacity:
+            raise VixDiskLibError("The disk is smaller than generation %s" % name)
+
+        found, locs = self.locate(manifest.digests)
+        if not found.all():
+            raise VixDiskLibError("Generation %s refers to %d missing chunks" % (name, int((~found).sum())))
+
+        per_write = max(1, read_size // self.block_size)
+        buff = np.empty(per_write * self.block_size, dtype=np.uint8)
+        total = manifest.capacity * SECTOR_SIZE
+        for first in xrange(0, manifest.nblocks, per_write):
+            last = min(first + per_write, manifest.nblocks)
+            nbytes = 0
+            for i in xrange(first, last):
+                nbytes += self._read(locs[i], buff[nbytes:]).size
+            offset = first * self.block_size
+            whole = nbytes // disk.block_size * disk.block_size
+            if whole:
+                disk.write(offset // disk.block_size, whole // disk.block_size, buff[:whole])
+            if nbytes > whole:
+                # a last chunk that ends part way through a disk block
+                disk.write_extents([((offset + whole) // SECTOR_SIZE, (nbytes - whole) // SECTOR_SIZE)],
+                                   buff[whole:nbytes])
+        disk.flush()
+        return total
@@ -136,6 +136,28 @@ cdef extern from "numpy/arrayobject.h":
     
 ctypedef unsigned short Bool
 
+# Looks up `name` in the shared library that defines `known`, without linking against it.
+# Used for entry points that only newer versions of a library export.
+cdef extern from *:
+    """
+    #include <dlfcn.h>
+    static void *vix_lookup_symbol(void *known, const char *name)
+    {
+        Dl_info info;
+        void *lib, *sym = NULL;
+
+        if (!dladdr(known, &info) || info.dli_fname == NULL)
+            return NULL;
+        lib = dlopen(info.dli_fname, RTLD_NOW | RTLD_NOLOAD);
+        if (lib != NULL) {
+            sym = dlsym(lib, name);
+            dlclose(lib);
+        }
+        return sym;
+    }
+    """
+    void *vix_lookup_symbol(void *known, const char *name)
+
 # PIDs are too long for 16 bits, short enough to fit in 32
 ctypedef uint32   PID
 
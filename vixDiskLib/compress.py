@@ -0,0 +1,350 @@
+'''
+Parallel compression of exported disks.
+
+Compressing in the thread that reads caps an export at what one core can compress,
+well below what the transports can deliver.  Here blocks are compressed on a pool of
+threads (zlib, lzma and zstd all release the GIL while they work) by
+:py:func:`ordered_map`, which hands the results back in their original order and keeps
+no more than a fixed window of blocks in memory at once.
+
+The output is a framed file that can be read from any block::
+
+    header   "VDXFRAM1", codec name (8 bytes), block size (uint32), reserved (uint32),
+             uncompressed size (uint64)
+    frames   the compressed blocks, back to back
+    index    one (offset uint64, length uint32, size uint32) record per block
+    footer   index offset (uint64), number of blocks (uint64), "VDXFEND1"
+
+All little endian.  A block that does not get smaller is stored as is, which the index
+shows as length == size.  Restoring decompresses on the pool as well and writes through
+:py:meth:`VixDiskBase.write`.
+
+zlib is always available.  lzma needs Python 3 or the backports.lzma package, zstd the
+zstandard package.
+'''
+import sys, zlib, threading, Queue, logging
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.prefetch import _Failure
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger("vixDiskLib.compress")
+
+SECTOR_SIZE = 512
+FRAME_MAGIC = "VDXFRAM1"
+FOOTER_MAGIC = "VDXFEND1"
+HEADER = np.dtype([('codec', 'S8'), ('block_size', '<u4'), ('reserved', '<u4'), ('size', '<u8')])
+FRAME = np.dtype([('offset', '<u8'), ('length', '<u4'), ('size', '<u4')])
+FOOTER = np.dtype([('index', '<u8'), ('nblocks', '<u8')])
+
+class Codec(object):
+    """ A compression algorithm: compress(data) and decompress(data, size) """
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+def _zstd_compress(level):
+    local = threading.local()
+    def compress(data):
+        # a ZstdCompressor must not be shared between threads
+        if not hasattr(local, "compressor"):
+            local.compressor = zstandard.ZstdCompressor(level=level)
+        return local.compressor.compress(data)
+    return compress
+
+def get_codec(name, level=None):
+    """
+    Returns the :py:class:`Codec` for "zlib", "lzma" or "zstd", at `level` or the
+    codec's default level.
+    """
+    if name == "zlib":
+        level = 6 if level is None else level
+        return Codec(name, lambda data: zlib.compress(data, level), lambda data, size: zlib.decompress(data))
+    if name == "lzma":
+        if lzma is None:
+            raise VixDiskLibError("lzma needs Python 3 or the backports.lzma package")
+        preset = 6 if level is None else level
+        return Codec(name, lambda data: lzma.compress(data, preset=preset), lambda data, size: lzma.decompress(data))
+    if name == "zstd":
+        if zstandard is None:
+            raise VixDiskLibError("zstd needs the zstandard package")
+        return Codec(name, _zstd_compress(3 if level is None else level),
+                     lambda data, size: zstandard.ZstdDecompressor().decompress(data, max_output_size=size))
+    raise VixDiskLibError("Unknown codec: %s" % name)
+
+def available_codecs():
+    """ The names of the codecs that can be used here """
+    return ["zlib"] + (["lzma"] if lzma is not None else []) + (["zstd"] if zstandard is not None else [])
+
+def ordered_map(fn, items, threads=4, window=None):
+    """
+    Yields fn(item) for every item, in order, computing them on `threads` threads.
+    Items are taken from the iterable only as results are consumed, so at most `window`
+    items (by default twice the number of threads) are in flight at once.
+    """
+    threads = max(1, threads)
+    window = max(1, window or 2 * threads)
+    tasks = Queue.Queue()
+    results = {}
+    ready = threading.Condition()
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            seq, item = task
+            try:
+                result = fn(item)
+            except Exception:
+                result = _Failure(sys.exc_info())
+            with ready:
+                results[seq] = result
+                ready.notify_all()
+
+    def wait(seq):
+        with ready:
+            while seq not in results:
+                ready.wait(1)
+            result = results.pop(seq)
+        if isinstance(result, _Failure):
+            raise result.exc_info[0], result.exc_info[1], result.exc_info[2]
+        return result
+
+    workers = [threading.Thread(target=work) for _ in xrange(threads)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    submitted = consumed = 0
+    try:
+        for item in items:
+            tasks.put((submitted, item))
+            submitted += 1
+            if submitted - consumed >= window:
+                yield wait(consumed)
+                consumed += 1
+        while consumed < submitted:
+            yield wait(consumed)
+            consumed += 1
+    finally:
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+class CompressStats(object):
+    """ Counts the blocks compressed, the ones stored as is, and the bytes in and out """
+    def __init__(self):
+        self.blocks = 0
+        self.stored = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def ratio(self):
+        return float(self.bytes_in) / self.bytes_out if self.bytes_out else 0.0
+
+    def __repr__(self):
+        return "<CompressStats blocks=%d stored=%d bytes_in=%d bytes_out=%d ratio=%.2f>" % (
+            self.blocks, self.stored, self.bytes_in, self.bytes_out, self.ratio)
+
+class FrameWriter(object):
+    """
+    Writes the framed format to a file.  Blocks are added with :py:meth:`write` in
+    order; every block is `block_size` bytes except the last.
+
+    :param path: The file to create.
+    :param codec: The codec name, see :py:func:`get_codec`.
+    :param block_size: The uncompressed bytes per block.
+    :param level: The compression level, or None for the codec's default.
+    :param threads: The number of compressing threads.
+    :param window: The most blocks held in memory at once, see :py:func:`ordered_map`.
+    """
+    def __init__(self, path, codec="zlib", block_size=1048576, level=None, threads=4, window=None):
+        self.codec = get_codec(codec, level)
+        self.block_size = block_size
+        self.threads = threads
+        self.window = window
+        self.stats = CompressStats()
+        self._frames = []
+        self._fd = open(path, "wb")
+        self._fd.write(FRAME_MAGIC)
+        self._fd.write(np.zeros(1, dtype=HEADER).tostring())
+
+    def _encode(self, data):
+        packed = self.codec.compress(data)
+        if len(packed) >= len(data):
+            return data
+        return packed
+
+    def write(self, blocks):
+        """
+        Compresses and writes blocks.
+
+        :param blocks: An iterable of strings (or other buffers) of one block each.
+                       It is consumed lazily, so it can read the disk as it goes.
+        """
+        blocks = (block if isinstance(block, str) else np.frombuffer(block, dtype=np.uint8).tostring()
+                  for block in blocks)
+        pairs = ((block, len(block)) for block in blocks)
+        for payload, size in ordered_map(lambda pair: (self._encode(pair[0]), pair[1]), pairs,
+                                         self.threads, self.window):
+            self._frames.append((self._fd.tell(), len(payload), size))
+            self._fd.write(payload)
+            self.stats.blocks += 1
+            self.stats.stored += len(payload) == size
+            self.stats.bytes_in += size
+            self.stats.bytes_out += len(payload)
+
+    def close(self):
+        """ Writes the index, the footer and the header, and closes the file """
+        index = self._fd.tell()
+        self._fd.write(np.array(self._frames, dtype=FRAME).tostring())
+        self._fd.write(np.array([(index, len(self._frames))], dtype=FOOTER).tostring())
+        self._fd.write(FOOTER_MAGIC)
+        self._fd.seek(len(FRAME_MAGIC))
+        self._fd.write(np.array([(self.codec.name, self.block_size, 0, self.stats.bytes_in)], dtype=HEADER).tostring())
+        self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            # leave no footer, so the partial file is not mistaken for a whole one
+            self._fd.close()
+        else:
+            self.close()
+
+class FrameReader(object):
+    """
+    Reads a framed file, by block or in order.
+
+    :param path: The file written by :py:class:`FrameWriter`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = open(path, "rb")
+        self._lock = threading.Lock()
+        if self._fd.read(len(FRAME_MAGIC)) != FRAME_MAGIC:
+            raise VixDiskLibError("%s is not a compressed disk image" % path)
+        header = np.fromstring(self._fd.read(HEADER.itemsize), dtype=HEADER)[0]
+        self._fd.seek(-(FOOTER.itemsize + len(FOOTER_MAGIC)), 2)
+        footer = np.fromstring(self._fd.read(FOOTER.itemsize), dtype=FOOTER)[0]
+        if self._fd.read(len(FOOTER_MAGIC)) != FOOTER_MAGIC:
+            raise VixDiskLibError("%s is incomplete" % path)
+        self._fd.seek(int(footer['index']))
+        self.frames = np.fromfile(self._fd, dtype=FRAME, count=int(footer['nblocks']))
+        self.codec = get_codec(str(header['codec']))
+        self.block_size = int(header['block_size'])
+        self.size = int(header['size'])
+
+    @property
+    def nblocks(self):
+        return self.frames.size
+
+    def _raw(self, index):
+        offset, length, size = self.frames[index].tolist()
+        with self._lock:
+            self._fd.seek(offset)
+            return self._fd.read(length), length, size
+
+    def _decode(self, raw):
+        payload, length, size = raw
+        return payload if length == size else self.codec.decompress(payload, size)
+
+    def read_block(self, index):
+        """ Returns the uncompressed block `index` as a string """
+        if not 0 <= index < self.nblocks:
+            raise VixDiskLibError("Block %d is out of range" % index)
+        return self._decode(self._raw(index))
+
+    def iter(self, start=0, threads=4, window=None):
+        """
+        Yields the uncompressed blocks from `start` on, in order, decompressing them on
+        `threads` threads.
+        """
+        raws = (self._raw(index) for index in xrange(start, self.nblocks))
+        return ordered_map(self._decode, raws, threads, window)
+
+    def close(self):
+        self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export_compressed(disk, path, codec="zlib", level=None, block_size=1048576, threads=4, window=None):
+    """
+    Reads an open disk from start to end into a compressed, framed file.
+
+    :param disk: An open :py:class:`VixDisk`.
+    :param path: The file to create.
+    :param block_size: The bytes per compressed block, a multiple of 512.  This is
+                       the unit of random access.
+    :return: The :py:class:`CompressStats`.
+    """
+    if block_size <= 0 or block_size % SECTOR_SIZE:
+        raise VixDiskLibError("The block size must be a multiple of %d" % SECTOR_SIZE)
+    capacity = disk.info()['capacity']
+    sectors = block_size // SECTOR_SIZE
+
+    def blocks():
+        buff = np.empty(block_size, dtype=np.uint8)
+        for sector in xrange(0, capacity, sectors):
+            count = min(sectors, capacity - sector)
+            data = buff[:count * SECTOR_SIZE]
+            disk.read_extents([(sector, count)], data)
+            yield data.tostring()
+
+    with FrameWriter(path, codec, block_size, level, threads, window) as writer:
+        writer.write(blocks())
+    log.debug("Compressed %s: %s" % (disk.vmdk_path, writer.stats))
+    return writer.stats
+
+def restore_compressed(path, disk, threads=4, window=None):
+    """
+    Decompresses a framed file onto an open disk through :py:meth:`VixDiskBase.write`.
+    The file's block size must be a multiple of the disk's block size.  The write
+    buffer of a :py:class:`VixDisk` is flushed before returning.
+
+    :return: The number of bytes written.
+    """
+    with FrameReader(path) as reader:
+        if reader.block_size % disk.block_size:
+            raise VixDiskLibError("The image block size %d is not a multiple of the disk block size %d" % (
+                reader.block_size, disk.block_size))
+        if disk.info()['capacity'] * SECTOR_SIZE < reader.size:
+            raise VixDiskLibError("The disk is smaller than %s" % path)
+        offset = 0
+        for data in reader.iter(0, threads, window):
+            buff = np.frombuffer(data, dtype=np.uint8)
+            whole = buff.size // disk.block_size * disk.block_size
+            if whole:
+                disk.write(offset // disk.block_size, whole // disk.block_size, buff[:whole])
+            if buff.size > whole:
+                # a last block that ends part way through a disk block
+                disk.write_extents([((offset + whole) // SECTOR_SIZE, (buff.size - whole) // SECTOR_SIZE)],
+                                   buff[whole:])
+            offset += buff.size
+        # only VixDisk buffers writes
+        if hasattr(disk, "flush"):
+            disk.flush()
+    return offset
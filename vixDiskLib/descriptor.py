@@ -0,0 +1,140 @@
+'''
+The VMDK text descriptor.
+
+A descriptor is a small text file (or a text section embedded in a sparse extent) that
+names the extent files holding the data and carries the disk database (ddb) of
+adapter type, geometry and so on:
+
+    # Disk DescriptorFile
+    version=1
+    CID=fffffffe
+    parentCID=ffffffff
+    createType="monolithicFlat"
+
+    # Extent description
+    RW 2097152 FLAT "disk-flat.vmdk" 0
+
+    # The Disk Data Base
+    ddb.adapterType = "lsilogic"
+    ddb.geometry.cylinders = "2080"
+
+Extent lines are "access sectors type [filename [offset]]", where the offset is in
+sectors into the file.  ZERO extents have no file, VMFS ones no offset.
+'''
+import os
+from collections import namedtuple, OrderedDict
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+
+DESCRIPTOR_MAGIC = "# Disk DescriptorFile"
+# a descriptor this big is a data file that happens to start like one
+MAX_DESCRIPTOR_SIZE = 1048576
+
+EXTENT_TYPES = ("FLAT", "SPARSE", "ZERO", "VMFS", "VMFSSPARSE", "VMFSRDM", "VMFSRAW")
+
+class Extent(namedtuple("Extent", "access sectors type filename offset")):
+    """
+    One extent line: the access ("RW", "RDONLY" or "NOACCESS"), its size in sectors,
+    its type (see EXTENT_TYPES), the file name relative to the descriptor (None for
+    ZERO) and the offset into the file in sectors.
+    """
+    __slots__ = ()
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+class Descriptor(object):
+    """
+    A parsed descriptor.
+
+    :param header: The header entries (version, CID, createType, ...), in order.
+    :param extents: The :py:class:`Extent` list, in disk order.
+    :param ddb: The disk database, with the "ddb." prefix stripped from the keys like
+                `VixDiskBase.getMetadata` does.
+    """
+    def __init__(self, header=None, extents=None, ddb=None):
+        self.header = header if header is not None else OrderedDict()
+        self.extents = extents or []
+        self.ddb = ddb if ddb is not None else OrderedDict()
+
+    @property
+    def create_type(self):
+        return self.header.get("createType")
+
+    @property
+    def capacity(self):
+        """ The disk size in sectors, the sum of the extents """
+        return sum(extent.sectors for extent in self.extents)
+
+    def __repr__(self):
+        return "<Descriptor %s: %d extents, %d sectors>" % (self.create_type, len(self.extents), self.capacity)
+
+    @classmethod
+    def parse(cls, text):
+        """ Parses descriptor text, raising VixDiskLibError on a malformed extent line """
+        descriptor = cls()
+        for line in text.splitlines():
+            line = line.strip().rstrip("\0")
+            if not line or line.startswith("#"):
+                continue
+            if "=" in line and line.split("=", 1)[0].strip().replace(".", "").isalnum():
+                key, value = line.split("=", 1)
+                key, value = key.strip(), _unquote(value)
+                if key.startswith("ddb."):
+                    descriptor.ddb[key[4:]] = value
+                else:
+                    descriptor.header[key] = value
+                continue
+            descriptor.extents.append(cls._parse_extent(line))
+        return descriptor
+
+    @staticmethod
+    def _parse_extent(line):
+        # the file name is quoted and may hold spaces
+        before, quote, rest = line.partition('"')
+        fields = before.split()
+        filename = offset = None
+        if quote:
+            filename, _, after = rest.partition('"')
+            offset = after.split()[0] if after.split() else None
+        if len(fields) != 3 or fields[2] not in EXTENT_TYPES or not fields[1].isdigit():
+            raise VixDiskLibError("Bad extent line in descriptor: %s" % line)
+        return Extent(fields[0], int(fields[1]), fields[2], filename, int(offset or 0))
+
+    def text(self):
+        """ Returns the descriptor as text """
+        lines = [DESCRIPTOR_MAGIC]
+        lines += ['%s=%s' % (key, value if key in ("version", "CID", "parentCID") else '"%s"' % value)
+                  for key, value in self.header.items()]
+        lines += ["", "# Extent description"]
+        for extent in self.extents:
+            line = "%s %d %s" % (extent.access, extent.sectors, extent.type)
+            if extent.filename is not None:
+                line += ' "%s"' % extent.filename
+                if extent.type == "FLAT" or extent.offset:
+                    line += " %d" % extent.offset
+            lines.append(line)
+        lines += ["", "# The Disk Data Base", "#DDB", ""]
+        lines += ['ddb.%s = "%s"' % (key, value) for key, value in self.ddb.items()]
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """ Writes the descriptor to `path`, replacing it atomically """
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fd:
+            fd.write(self.text())
+        os.rename(tmp, path)
+
+def read_descriptor(path):
+    """
+    Returns the :py:class:`Descriptor` in a descriptor file, or None if `path` is not
+    one (a raw image or a sparse extent, say).
+    """
+    with open(path, "rb") as fd:
+        head = fd.read(len(DESCRIPTOR_MAGIC))
+        if head != DESCRIPTOR_MAGIC or os.fstat(fd.fileno()).st_size > MAX_DESCRIPTOR_SIZE:
+            return None
+        return Descriptor.parse(head + fd.read())
@@ -0,0 +1,190 @@
+'''
+Several disks on one connection.
+
+A VixDisk opens a single disk, so a VM with 8 disks used to need 8 instances, 8
+connections and 8 library initializations.  A DiskSet makes one connection and opens
+every disk on it, each disk with its own VixDisk (so its own handle, buffers and
+state) sharing the connection through :py:meth:`VixBase.share_connection`.
+'''
+import sys, threading, Queue
+from collections import OrderedDict
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.prefetch import _Failure
+
+class DiskSet(object):
+    """
+    The disks of one VM (or snapshot), open on a single connection.
+
+    :param credentials: The `:py:class:VixCredentials`, None for local disks.
+    :param libdir: The location of the vix-disklib libraries.
+    :param config: The location of the vix-disklib configuration file.
+    :param block_size: The block size of every disk.
+    :param kwargs: Passed on to each disk's :py:class:`VixDisk` (cache_size, ...).
+    """
+    def __init__(self, credentials=None, libdir=None, config=None, block_size=1024, **kwargs):
+        self.credentials = credentials
+        self.libdir = libdir
+        self.config = config
+        self.block_size = block_size
+        self.kwargs = kwargs
+        self.connection = VixDisk(credentials, libdir, config, block_size=block_size)
+        self.disks = OrderedDict()
+        # opening and closing handles on one connection is kept to one thread at a time
+        self._lock = threading.Lock()
+
+    def connect(self, snapshotRef=None, transport=None, readonly=True):
+        """ Makes the shared connection, see :py:meth:`VixBase.connect` """
+        self.connection.connect(snapshotRef, transport, readonly)
+
+    def open(self, path, single=False):
+        """
+        Opens another disk on the connection.
+
+        :return: The :py:class:`VixDisk` for the disk.
+        """
+        with self._lock:
+            if path in self.disks:
+                raise VixDiskLibError("Currently have disk %s opened." % path)
+            disk = VixDisk(self.credentials, self.libdir, self.config, block_size=self.block_size, **self.kwargs)
+            disk.share_connection(self.connection)
+            try:
+                disk.open(path, single)
+            except:
+                disk.disconnect()
+                raise
+            self.disks[path] = disk
+        return disk
+
+    def close(self, path=None):
+        """
+        Closes one disk, or every disk if no path is given.
+        """
+        with self._lock:
+            if path is not None and path not in self.disks:
+                raise VixDiskLibError("No disk %s in the set" % path)
+            paths = [path] if path is not None else self.disks.keys()
+            # every disk is closed even if one fails, and the first failure is raised
+            failure = None
+            for path in paths:
+                disk = self.disks.pop(path)
+                try:
+                    try:
+                        if disk.opened:
+                            disk.close()
+                    finally:
+                        disk.disconnect()
+                except Exception:
+                    if failure is None:
+                        failure = sys.exc_info()
+            if failure is not None:
+                raise failure[0], failure[1], failure[2]
+
+    def disconnect(self):
+        """ Closes every disk, then the connection """
+        try:
+            self.close()
+        finally:
+            self.connection.disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.disks:
+            self.close()
+        if self.connection.connected:
+            self.connection.disconnect()
+
+    def __len__(self):
+        return len(self.disks)
+
+    def __iter__(self):
+        return iter(self.disks.values())
+
+    def __getitem__(self, path):
+        return self.disks[path]
+
+    def for_each(self, fn, nblocks=1, prefetch=0):
+        """
+        Reads every disk from start to end at the same time, one thread per disk, and
+        calls fn(path, block, data) on that disk's thread for every read.  The data is
+        only valid during the call.
+
+        :param fn: Called with the disk path, the block offset and an np.ndarray.
+        :param nblocks: The number of blocks per read.
+        :param prefetch: The read-ahead depth per disk, see :py:meth:`VixDisk.iter`.
+        :return: A dict of the number of blocks read, by path.
+        """
+        results = {}
+        errors = []
+
+        def run(path, disk):
+            try:
+                block = 0
+                for data in disk.iter(nblocks, prefetch):
+                    fn(path, block, data)
+                    block += data.size // disk.block_size
+                results[path] = block
+            except Exception:
+                errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target=run, args=item) for item in self.disks.items()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return results
+
+    def iter(self, nblocks=1, depth=4):
+        """
+        Reads every disk at the same time, one thread per disk, and yields the reads
+        as they complete, interleaved across disks.
+
+        :param nblocks: The number of blocks per read.
+        :param depth: The most reads per disk waiting to be consumed.
+        :return: (path, block, np.ndarray) triples.  Each array is a copy and can be kept.
+        """
+        ready = Queue.Queue()
+        stop = threading.Event()
+        slots = dict((path, threading.Semaphore(max(1, depth))) for path in self.disks)
+
+        def run(path, disk):
+            try:
+                block = 0
+                for data in disk.iter(nblocks):
+                    slots[path].acquire()
+                    if stop.is_set():
+                        break
+                    ready.put((path, block, data.copy()))
+                    block += data.size // disk.block_size
+            except Exception:
+                ready.put(_Failure(sys.exc_info()))
+            ready.put(None)
+
+        threads = [threading.Thread(target=run, args=item) for item in self.disks.items()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        running = len(threads)
+        try:
+            while running:
+                item = ready.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, _Failure):
+                    raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+                else:
+                    slots[item[0]].release()
+                    yield item
+        finally:
+            stop.set()
+            for slot in slots.values():
+                slot.release()
+            for thread in threads:
+                thread.join()
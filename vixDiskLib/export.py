@@ -0,0 +1,253 @@
+'''
+Resumable disk export.
+
+A multi-terabyte export read with `VixDisk.iter()` that fails near the end has to
+start over from block 0.  DiskExport copies a disk to a sparse raw image and records
+every extent it has finished in an extent journal next to the image, so a later run
+with the same destination reads only what is missing.  Transient library errors, such
+as a dropped NBD connection, are retried in place with backoff after reopening the
+disk.
+
+The journal is a 16 byte header (magic and disk capacity in sectors) followed by
+little endian uint64 (start_sector, nsectors) records.  Records are only appended at a
+checkpoint, after the image has been fsync'ed, so the journal never claims data that
+could still be lost.  A torn last record is ignored.
+'''
+import os, time, logging
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.extents import as_extents, normalize, subtract, split, DEFAULT_MAX_IO
+from vixDiskLib.zeros import zero_mask, data_runs
+
+log = logging.getLogger("vixDiskLib.export")
+
+SECTOR_SIZE = 512
+JOURNAL_MAGIC = "VDXJRNL1"
+
+# library errors that retrying or reopening will not fix
+PERMANENT_ERRORS = frozenset([
+    3,      # VIX_E_INVALID_ARG
+    4,      # VIX_E_FILE_NOT_FOUND
+    6,      # VIX_E_NOT_SUPPORTED
+    11,     # VIX_E_FILE_READ_ONLY
+    22,     # VIX_E_FILE_NAME_INVALID
+    32,     # VIX_E_LICENSE
+    35,     # VIX_E_AUTHENTICATION_FAIL
+    16000,  # VIX_E_DISK_INVAL
+    16007,  # VIX_E_DISK_OUTOFRANGE
+])
+
+def is_transient(error):
+    """ True for a library error that is worth retrying """
+    return error.code is not None and error.code not in PERMANENT_ERRORS
+
+class ExtentJournal(object):
+    """
+    The on-disk record of the extents an export has finished.
+
+    :param path: The journal file.  It is created if it does not exist.
+    :param capacity: The capacity of the disk, in sectors.  An existing journal
+                     for a disk of another size is refused.
+    """
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.completed = as_extents([])
+        self._pending = []
+
+        if os.path.exists(path):
+            self._load()
+        self._rewrite()
+        self._fd = open(path, "ab")
+
+    def _load(self):
+        with open(self.path, "rb") as fd:
+            header = fd.read(16)
+            if len(header) < 16 or header[:8] != JOURNAL_MAGIC:
+                raise VixDiskLibError("%s is not an export journal" % self.path)
+            capacity = int(np.frombuffer(header[8:], dtype="<u8")[0])
+            if capacity != self.capacity:
+                raise VixDiskLibError("Journal %s is for a disk of %d sectors, not %d" % (
+                    self.path, capacity, self.capacity))
+            records = fd.read()
+        # a crash while appending can leave a partial record at the end
+        records = records[:len(records) - len(records) % 16]
+        self.completed = normalize(np.frombuffer(records, dtype="<u8").reshape(-1, 2))
+
+    def _rewrite(self):
+        """ Replaces the journal with its compacted form """
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as fd:
+            fd.write(JOURNAL_MAGIC)
+            fd.write(np.array([self.capacity], dtype="<u8").tostring())
+            fd.write(self.completed.astype("<u8").tostring())
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.rename(tmp, self.path)
+
+    def record(self, start, nsectors):
+        """ Notes an extent as finished.  It is written at the next :py:meth:`commit` """
+        self._pending.append((start, nsectors))
+
+    def commit(self):
+        """ Appends the extents recorded since the last commit and syncs the journal """
+        if not self._pending:
+            return
+        self._fd.write(np.array(self._pending, dtype="<u8").tostring())
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        self.completed = normalize(np.concatenate((self.completed, as_extents(self._pending))))
+        self._pending = []
+
+    def close(self):
+        self._fd.close()
+
+    def remove(self):
+        """ Deletes the journal, once the export is complete """
+        self.close()
+        os.unlink(self.path)
+
+class ExportStats(object):
+    """ What an export (or one run of a resumed export) did """
+    def __init__(self):
+        self.bytes = 0
+        self.zero_bytes = 0
+        self.resumed_bytes = 0
+        self.checkpoints = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return "<ExportStats bytes=%d zero_bytes=%d resumed_bytes=%d checkpoints=%d retries=%d>" % (
+            self.bytes, self.zero_bytes, self.resumed_bytes, self.checkpoints, self.retries)
+
+class DiskExport(object):
+    """
+    Copies an open disk to a sparse raw image, resuming where an earlier run stopped.
+
+    :param disk: An open :py:class:`VixDisk`.
+    :param destination: The image file.  If it and its journal exist, the export
+                        resumes; otherwise the image is started from scratch.
+    :param journal: The journal file, `destination` + ".journal" by default.  It is
+                    removed once the export completes.
+    :param extents: The extents to export, such as :py:meth:`VixDiskBase.query_allocated`
+                    or a CBT change set.  Defaults to the whole disk.
+    :param max_io: The largest read, in sectors.  This is also the granularity of
+                   the journal.
+    :param checkpoint_interval: Seconds between checkpoints (syncing the image, then
+                                recording the finished extents).
+    :param retries: The attempts at one read before giving up.
+    :param backoff: Seconds to wait before the first retry, doubled for every
+                    attempt up to `max_backoff`.
+    :param max_backoff: The longest wait between attempts, in seconds.
+    """
+    def __init__(self, disk, destination, journal=None, extents=None, max_io=DEFAULT_MAX_IO,
+                 checkpoint_interval=5.0, retries=5, backoff=1.0, max_backoff=60.0):
+        self.disk = disk
+        self.destination = destination
+        self.journal_path = journal or destination + ".journal"
+        self.extents = extents
+        self.max_io = max_io
+        self.checkpoint_interval = checkpoint_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = ExportStats()
+
+    def run(self):
+        """
+        Exports everything not already recorded in the journal.  A failure raises,
+        leaving the journal at the last checkpoint for the next run.
+
+        :return: The :py:class:`ExportStats` of this run.
+        """
+        start = time.time()
+        capacity = self.disk.info()['capacity']
+        extents = normalize(self.extents if self.extents is not None else [(0, capacity)])
+
+        resume = os.path.exists(self.destination) and os.path.exists(self.journal_path)
+        if not resume and os.path.exists(self.journal_path):
+            os.unlink(self.journal_path)
+        journal = ExtentJournal(self.journal_path, capacity)
+        remaining = subtract(extents, journal.completed)
+        self.stats.resumed_bytes = (int(extents[:, 1].sum()) - int(remaining[:, 1].sum())) * SECTOR_SIZE
+        if resume:
+            log.info("Resuming export of %s, %d bytes already done" % (
+                self.disk.vmdk_path, self.stats.resumed_bytes))
+
+        image = open(self.destination, "r+b" if resume else "wb")
+        try:
+            buff = np.empty(self.max_io * SECTOR_SIZE, dtype=np.uint8)
+            last = time.time()
+            for sector, nsectors in split(remaining, self.max_io).tolist():
+                data = buff[:nsectors * SECTOR_SIZE]
+                self._read(sector, nsectors, data)
+                self._write(image, sector, data)
+                journal.record(sector, nsectors)
+                if time.time() - last >= self.checkpoint_interval:
+                    self._checkpoint(image, journal)
+                    last = time.time()
+
+            image.truncate(capacity * SECTOR_SIZE)
+            self._checkpoint(image, journal)
+        except:
+            try:
+                self._checkpoint(image, journal)
+            except Exception:
+                log.exception("Checkpoint after a failed export failed")
+            image.close()
+            journal.close()
+            self.stats.elapsed += time.time() - start
+            raise
+
+        image.close()
+        journal.remove()
+        self.stats.elapsed += time.time() - start
+        return self.stats
+
+    def _read(self, sector, nsectors, data):
+        attempt = 0
+        while True:
+            try:
+                if not self.disk.opened:
+                    self.disk.open(self.disk.vmdk_path)
+                self.disk.read_extents([(sector, nsectors)], data)
+                return
+            except VixDiskLibError, e:
+                attempt += 1
+                if not is_transient(e) or attempt >= self.retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                log.warning("Reading %d sectors at %d failed (%s), retrying in %.1fs" % (
+                    nsectors, sector, e, delay))
+                self.stats.retries += 1
+                time.sleep(delay)
+                self._reopen()
+
+    def _reopen(self):
+        try:
+            if self.disk.opened:
+                self.disk.reopen()
+        except VixDiskLibError, e:
+            # the disk is left closed, and the next attempt opens it again
+            log.warning("Reopening %s failed: %s" % (self.disk.vmdk_path, e))
+
+    def _write(self, image, sector, data):
+        block_size = self.disk.block_size
+        offset = sector * SECTOR_SIZE
+        written = 0
+        for first, count in data_runs(zero_mask(data, block_size)):
+            chunk = data[first * block_size:(first + count) * block_size]
+            image.seek(offset + first * block_size)
+            image.write(chunk)
+            written += chunk.size
+        self.stats.bytes += data.size
+        self.stats.zero_bytes += data.size - written
+
+    def _checkpoint(self, image, journal):
+        image.flush()
+        os.fsync(image.fileno())
+        journal.commit()
+        self.stats.checkpoints += 1
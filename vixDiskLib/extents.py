@@ -0,0 +1,109 @@
+'''
+Helpers for lists of sector extents.
+
+An extent list is an (N, 2) numpy array of uint64 ``(start_sector, nsectors)``
+pairs.  They are used by the vectored I/O methods on
+:py:class:`vixDiskLib.vixDiskBase.VixDiskBase`.
+'''
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+
+# 8MB worth of sectors per library call
+DEFAULT_MAX_IO  = 16384
+# read through holes of up to 64KB rather than paying for another round trip
+DEFAULT_MAX_GAP = 128
+
+def as_extents(extents):
+    """
+    Converts a sequence of (start_sector, nsectors) pairs into an extent list.
+    """
+    arr = np.asarray(extents, dtype=np.uint64)
+    if arr.size == 0:
+        return arr.reshape(0, 2)
+    if arr.ndim != 2 or arr.shape[1] != 2:
+        raise VixDiskLibError("Extents must be a sequence of (start_sector, nsectors) pairs")
+    return arr
+
+def coalesce(extents, max_io=DEFAULT_MAX_IO, max_gap=0):
+    """
+    Sorts extents and merges the ones that touch, overlap, or are at most `max_gap`
+    sectors apart, as long as the merged run stays within `max_io` sectors.  A single
+    extent larger than `max_io` is never split.
+
+    :param extents: An extent list (see :py:func:`as_extents`).
+    :param max_io: The largest run to build by merging, in sectors.  None for no limit.
+    :param max_gap: The largest hole to read through, in sectors.
+    :return: (runs, members) where `runs` is the extent list of I/Os to issue, and
+             `members[i]` lists the indexes of the input extents covered by run `i`.
+    """
+    extents = as_extents(extents)
+    runs = []
+    members = []
+
+    order = np.argsort(extents[:, 0], kind='mergesort')
+    starts = extents[order, 0].tolist()
+    lengths = extents[order, 1].tolist()
+
+    run_start = run_end = None
+    for index, start, length in zip(order.tolist(), starts, lengths):
+        end = max(start + length, run_end) if run_end is not None else start + length
+        if run_end is not None and start <= run_end + max_gap and \
+                (max_io is None or end - run_start <= max_io):
+            run_end = end
+            members[-1].append(index)
+            continue
+        if run_end is not None:
+            runs.append((run_start, run_end - run_start))
+        run_start, run_end = start, start + length
+        members.append([index])
+    if run_end is not None:
+        runs.append((run_start, run_end - run_start))
+
+    return as_extents(runs), members
+
+def normalize(extents):
+    """
+    Returns the sorted, non-overlapping extent list covering the same sectors.
+    """
+    runs, _ = coalesce(extents, max_io=None, max_gap=0)
+    return runs
+
+def split(extents, max_io=DEFAULT_MAX_IO):
+    """
+    Cuts every extent into pieces of at most `max_io` sectors, keeping the order.
+    """
+    pieces = []
+    for start, length in as_extents(extents).tolist():
+        for offset in xrange(0, length, max_io):
+            pieces.append((start + offset, min(max_io, length - offset)))
+    return as_extents(pieces)
+
+def total_sectors(extents):
+    """
+    Returns the number of sectors covered by an extent list, counting overlaps twice.
+    """
+    return int(as_extents(extents)[:, 1].sum())
+
+def subtract(extents, removed):
+    """
+    Returns the sorted, non-overlapping extent list of the sectors in `extents` that
+    are not in `removed`.
+    """
+    result = []
+    cuts = normalize(removed).tolist()
+    i = 0
+    for start, length in normalize(extents).tolist():
+        end = start + length
+        while i < len(cuts) and cuts[i][0] + cuts[i][1] <= start:
+            i += 1
+        j = i
+        while start < end and j < len(cuts) and cuts[j][0] < end:
+            cut_start, cut_end = cuts[j][0], cuts[j][0] + cuts[j][1]
+            if cut_start > start:
+                result.append((start, cut_start - start))
+            start = max(start, cut_end)
+            j += 1
+        if start < end:
+            result.append((start, end - start))
+    return as_extents(result)
@@ -0,0 +1,211 @@
+'''
+Per-block content digests and the backup manifest.
+
+digest_disk() reads a disk from start to end and hashes every block of it.  hashlib
+releases the GIL while hashing, so the blocks are hashed by a pool of threads while the
+next read is in flight, and hashing does not slow the read loop down.
+
+The result is a :py:class:`Manifest`: an (nblocks, digest_size) uint8 array plus the
+disk's `info()` and `getMetadata()`.  Comparing two manifests gives the blocks that
+changed (to verify a backup, or to skip unchanged blocks when CBT is not available),
+and the blocks of one that already exist anywhere in the other (for deduplication).
+
+A saved manifest is the magic "VDXMANI1", a little endian uint32 header length, the
+JSON header, padding to a multiple of 8 bytes, and the raw digests.
+
+SHA-256 (and the other hashlib algorithms) are always available; BLAKE2 needs a Python
+with hashlib.blake2b, or the pyblake2 package.
+'''
+import sys, json, hashlib, threading, Queue
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.extents import as_extents
+from vixDiskLib.prefetch import _Failure
+
+try:
+    import pyblake2
+except ImportError:
+    pyblake2 = None
+
+SECTOR_SIZE = 512
+MANIFEST_MAGIC = "VDXMANI1"
+DEFAULT_DIGEST_BLOCK = 65536
+
+def hasher(algorithm):
+    """
+    Returns the constructor for a hash algorithm, such as "sha256" or "blake2b".
+    """
+    if algorithm in ("blake2b", "blake2s") and not hasattr(hashlib, algorithm):
+        if pyblake2 is None:
+            raise VixDiskLibError("%s needs the pyblake2 package on this Python" % algorithm)
+        return getattr(pyblake2, algorithm)
+    try:
+        hashlib.new(algorithm)
+    except ValueError:
+        raise VixDiskLibError("Unsupported digest algorithm: %s" % algorithm)
+    return lambda data=b"": hashlib.new(algorithm, data)
+
+class Manifest(object):
+    """
+    The digests of every block of a disk.
+
+    :param digests: An (nblocks, digest_size) uint8 array, block i in row i.
+    :param algorithm: The hash algorithm name.
+    :param block_size: The bytes per digest.  The last block may be short.
+    :param capacity: The disk capacity, in sectors.
+    :param info: The disk's `info()`.
+    :param metadata: The disk's `getMetadata()`.
+    """
+    def __init__(self, digests, algorithm, block_size, capacity, info=None, metadata=None):
+        self.digests = digests
+        self.algorithm = algorithm
+        self.block_size = block_size
+        self.capacity = capacity
+        self.info = info or {}
+        self.metadata = metadata or {}
+
+    @property
+    def nblocks(self):
+        return self.digests.shape[0]
+
+    def __repr__(self):
+        return "<Manifest %s: %d blocks of %d bytes>" % (self.algorithm, self.nblocks, self.block_size)
+
+    def save(self, path):
+        """ Writes the manifest to `path` """
+        header = json.dumps(dict(
+            algorithm=self.algorithm, block_size=self.block_size, capacity=self.capacity,
+            nblocks=self.nblocks, digest_size=self.digests.shape[1],
+            info=self.info, metadata=self.metadata))
+        with open(path, "wb") as fd:
+            fd.write(MANIFEST_MAGIC)
+            fd.write(np.array([len(header)], dtype="<u4").tostring())
+            fd.write(header)
+            fd.write("\0" * (-(12 + len(header)) % 8))
+            fd.write(np.ascontiguousarray(self.digests).tostring())
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a manifest written by :py:meth:`save` """
+        with open(path, "rb") as fd:
+            if fd.read(8) != MANIFEST_MAGIC:
+                raise VixDiskLibError("%s is not a manifest" % path)
+            length = int(np.fromstring(fd.read(4), dtype="<u4")[0])
+            header = json.loads(fd.read(length))
+            fd.read(-(12 + length) % 8)
+            count = header['nblocks'] * header['digest_size']
+            digests = np.fromfile(fd, dtype=np.uint8, count=count)
+        if digests.size != count:
+            raise VixDiskLibError("Manifest %s is truncated" % path)
+        return cls(digests.reshape(header['nblocks'], header['digest_size']), str(header['algorithm']),
+                   header['block_size'], header['capacity'], header['info'], header['metadata'])
+
+    def _check(self, other):
+        if (self.algorithm, self.block_size) != (other.algorithm, other.block_size):
+            raise VixDiskLibError("Manifests with different digests can't be compared: %s, %s" % (self, other))
+
+    def _keys(self):
+        # one fixed size string per digest, so numpy can compare and search whole digests
+        return np.ascontiguousarray(self.digests).view("S%d" % self.digests.shape[1]).ravel()
+
+    def changed(self, other):
+        """
+        Returns a boolean array with one entry per block, True where the block differs
+        from the same block in `other` (or is past the end of `other`).
+        """
+        self._check(other)
+        mask = np.ones(self.nblocks, dtype=bool)
+        common = min(self.nblocks, other.nblocks)
+        mask[:common] = (self.digests[:common] != other.digests[:common]).any(axis=1)
+        return mask
+
+    def changed_extents(self, other):
+        """
+        Returns the sectors of the blocks that differ from `other` as an extent list,
+        ready for :py:meth:`VixDisk.iter_changed`.
+        """
+        sectors = self.block_size // SECTOR_SIZE
+        edges = np.diff(np.concatenate(([0], self.changed(other).astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.minimum(np.flatnonzero(edges == -1) * sectors, self.capacity)
+        return as_extents(np.column_stack((starts * sectors, ends - starts * sectors)))
+
+    def known(self, other):
+        """
+        Returns a boolean array with one entry per block, True where the block's content
+        is in `other` at any position.
+        """
+        self._check(other)
+        return np.in1d(self._keys(), other._keys())
+
+def digest_disk(disk, block_size=DEFAULT_DIGEST_BLOCK, algorithm="sha256", threads=4, read_size=8388608):
+    """
+    Reads an open disk from start to end and returns its :py:class:`Manifest`.
+
+    :param disk: An open :py:class:`VixDisk`.
+    :param block_size: The bytes per digest, a multiple of 512.
+    :param algorithm: The hash algorithm, see :py:func:`hasher`.
+    :param threads: The number of hashing threads.
+    :param read_size: The bytes per read, rounded down to a whole number of blocks.
+    """
+    if block_size <= 0 or block_size % SECTOR_SIZE:
+        raise VixDiskLibError("The digest block size must be a multiple of %d" % SECTOR_SIZE)
+    new = hasher(algorithm)
+    capacity = disk.info()['capacity']
+    nblocks = -(-capacity * SECTOR_SIZE // block_size)
+    digests = np.empty((nblocks, new().digest_size), dtype=np.uint8)
+    read_sectors = max(block_size, read_size // block_size * block_size) // SECTOR_SIZE
+
+    # two buffers per thread: one being hashed, one waiting
+    free = Queue.Queue()
+    for _ in xrange(2 * max(1, threads)):
+        free.put(np.empty(read_sectors * SECTOR_SIZE, dtype=np.uint8))
+    tasks = Queue.Queue()
+    errors = []
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            first, buff, nbytes = task
+            try:
+                for i, offset in enumerate(xrange(0, nbytes, block_size)):
+                    digests[first + i] = np.frombuffer(new(buff[offset:min(offset + block_size, nbytes)]).digest(), dtype=np.uint8)
+            except Exception:
+                errors.append(_Failure(sys.exc_info()))
+            free.put(buff)
+
+    workers = [threading.Thread(target=work) for _ in xrange(max(1, threads))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        for sector in xrange(0, capacity, read_sectors):
+            buff = free.get()
+            if errors:
+                break
+            count = min(read_sectors, capacity - sector)
+            disk.read_extents([(sector, count)], buff[:count * SECTOR_SIZE])
+            tasks.put((sector * SECTOR_SIZE // block_size, buff, count * SECTOR_SIZE))
+    finally:
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+    if errors:
+        exc_info = errors[0].exc_info
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    return Manifest(digests, algorithm, block_size, capacity, disk.info(), disk.getMetadata())
+
+def verify(disk, manifest, threads=4):
+    """
+    Digests an open disk again and compares it with `manifest`.
+
+    :return: The indexes of the blocks that do not match.
+    """
+    current = digest_disk(disk, manifest.block_size, manifest.algorithm, threads)
+    return np.flatnonzero(current.changed(manifest))
@@ -0,0 +1,245 @@
+'''
+Striped parallel reads of a single disk.
+
+A single handle on NBD/NBDSSL only ever has one request in flight, so it tops out well
+below the link speed.  ParallelDiskReader opens the same disk (and snapshot) through
+several connections and handles, cuts the sector range into stripes, and reads the
+stripes concurrently, one worker thread per handle.
+'''
+import os, sys, logging, threading, Queue
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.extents import split, as_extents, DEFAULT_MAX_IO
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.prefetch import _Failure
+
+log = logging.getLogger("vixDiskLib.parallel")
+
+SECTOR_SIZE = 512
+
+class ParallelDiskReader(object):
+    """
+    Reads one disk through `connections` handles at once.
+
+    :param path: The path of the disk to open, as for :py:meth:`VixDiskBase.open`.
+    :param credentials: The `:py:class:VixCredentials`, None for local disks.
+    :param libdir: The location of the vix-disklib libraries.
+    :param config: The location of the vix-disklib configuration file.
+    :param snapshotRef: The snapshot to read from, see :py:meth:`VixBase.connect`.
+    :param transport: The transport to use, see :py:meth:`VixBase.connect`.
+    :param connections: The number of connections (and handles, and threads).
+    :param stripe_size: The number of sectors read per request.
+    """
+    def __init__(self, path, credentials=None, libdir=None, config=None, snapshotRef=None,
+                 transport=None, connections=4, stripe_size=DEFAULT_MAX_IO):
+        if connections < 1:
+            raise VixDiskLibError("Need at least one connection")
+        self.path = path
+        self.credentials = credentials
+        self.libdir = libdir
+        self.config = config
+        self.snapshotRef = snapshotRef
+        self.transport = transport
+        self.connections = connections
+        self.stripe_size = stripe_size
+        self.disks = []
+
+    def open(self):
+        """
+        Connects and opens the disk on every connection.
+        """
+        if self.disks:
+            raise VixDiskLibError("Currently have disk %s opened." % self.path)
+        try:
+            for _ in xrange(self.connections):
+                disk = VixDisk(self.credentials, self.libdir, self.config)
+                disk.connect(self.snapshotRef, self.transport, readonly=True)
+                self.disks.append(disk)
+                disk.open(self.path)
+        except:
+            self.close()
+            raise
+        log.debug("Opened %s on %d connections" % (self.path, self.connections))
+
+    def close(self):
+        """
+        Closes the disk and disconnects every connection.
+        """
+        disks, self.disks = self.disks, []
+        for disk in disks:
+            if disk.opened:
+                disk.close()
+            if disk.connected:
+                disk.disconnect()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def capacity(self):
+        """
+        Returns the disk capacity in sectors.
+        """
+        if not self.disks:
+            raise VixDiskLibError("Need to open a disk before calling capacity")
+        return self.disks[0].info()['capacity']
+
+    def stripes(self, start=0, count=None):
+        """
+        Returns the extent list of stripes covering `count` sectors from `start`.
+        """
+        if count is None:
+            count = self.capacity() - start
+        if count <= 0:
+            return as_extents([])
+        return split([(start, count)], self.stripe_size)
+
+    def iter(self, start=0, count=None, window=None):
+        """
+        Returns an iterator over the stripes in disk order, read ahead by all the
+        connections at once.
+
+        :param start: The first sector to read.
+        :param count: The number of sectors to read, defaults to the rest of the disk.
+        :param window: The most stripes held at once, read but not yet consumed; this
+                       bounds memory use.  Defaults to twice the number of connections.
+        :return: (start_sector, np.ndarray) pairs.  The array is reused, so copy it if it
+                 is needed after the next iteration.
+        """
+        stripes = self.stripes(start, count).tolist()
+        window = max(window or 2 * self.connections, 1)
+        free = [np.empty(self.stripe_size * SECTOR_SIZE, dtype=np.uint8) for _ in xrange(min(window, len(stripes)))]
+
+        done = {}
+        ready = threading.Condition()
+
+        def finished(index, result):
+            with ready:
+                done[index] = result
+                ready.notify()
+
+        tasks = Queue.Queue()
+        abort = threading.Event()
+        workers = self._start(tasks, finished, abort)
+        owners = {}
+        submitted = 0
+        try:
+            for index, (stripe_start, length) in enumerate(stripes):
+                if index:
+                    free.append(owners.pop(index - 1))
+                while free and submitted < len(stripes):
+                    owners[submitted] = free.pop()
+                    sectors = stripes[submitted][1]
+                    tasks.put((submitted, stripes[submitted], owners[submitted][:sectors * SECTOR_SIZE]))
+                    submitted += 1
+
+                with ready:
+                    while index not in done:
+                        ready.wait(1)
+                    result = done.pop(index)
+                if isinstance(result, _Failure):
+                    raise result.exc_info[0], result.exc_info[1], result.exc_info[2]
+                yield stripe_start, result
+        finally:
+            self._stop(tasks, workers)
+
+    def copy_to(self, destination, start=0, count=None):
+        """
+        Reads the stripes concurrently and writes each one at its own offset in a
+        destination file, so no reordering (or buffering) is needed.
+
+        :param destination: The path of the file to write; it is created if missing, and
+                            cut to the end of the copied range once the copy is done.
+        :param start: The first sector to read.  Data lands at the same offset in the file.
+        :param count: The number of sectors to read, defaults to the rest of the disk.
+        :return: The number of bytes copied.
+        """
+        stripes = self.stripes(start, count).tolist()
+        if not stripes:
+            return 0
+        if not os.path.exists(destination):
+            open(destination, "wb").close()
+
+        errors = []
+        files = []
+        local = threading.local()
+        abort = threading.Event()
+
+        def write(index, result):
+            if isinstance(result, _Failure):
+                errors.append(result.exc_info)
+                return
+            if abort.is_set():
+                return
+            try:
+                # one file object per worker, so seek + write pairs don't interleave
+                if not hasattr(local, "fd"):
+                    local.fd = open(destination, "r+b")
+                    files.append(local.fd)
+                local.fd.seek(stripes[index][0] * SECTOR_SIZE)
+                local.fd.write(result)
+            except Exception:
+                # no more stripes are read once one can not be written
+                errors.append(sys.exc_info())
+                abort.set()
+
+        tasks = Queue.Queue()
+        for index, stripe in enumerate(stripes):
+            tasks.put((index, stripe, None))
+        workers = self._start(tasks, write, abort)
+        self._stop(tasks, workers)
+        for fd in files:
+            fd.close()
+
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        # what a larger, older file held past the copy is not left behind
+        end = sum(stripes[-1]) * SECTOR_SIZE
+        with open(destination, "r+b") as fd:
+            fd.truncate(end)
+        return sum(length for _, length in stripes) * SECTOR_SIZE
+
+    def _start(self, tasks, finished, abort):
+        if not self.disks:
+            raise VixDiskLibError("Need to open a disk before reading")
+        workers = [threading.Thread(target=self._work, args=(disk, tasks, finished, abort)) for disk in self.disks]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        return workers
+
+    def _stop(self, tasks, workers):
+        for _ in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+    def _work(self, disk, tasks, finished, abort):
+        """
+        Reads stripes off the task queue with a single handle, until told to stop.  Once
+        `abort` is set, by any worker, the remaining tasks are drained without reading.
+        """
+        own = None
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, (start, length), buff = task
+            if abort.is_set():
+                continue
+            try:
+                if buff is None:
+                    if own is None or own.size < length * SECTOR_SIZE:
+                        own = np.empty(self.stripe_size * SECTOR_SIZE, dtype=np.uint8)
+                    buff = own[:length * SECTOR_SIZE]
+                disk.read_extents([(start, length)], buff)
+            except Exception:
+                abort.set()
+                finished(index, _Failure(sys.exc_info()))
+                continue
+            finished(index, buff)
@@ -0,0 +1,9 @@
+'''
+Helpers for vSphere disk paths, of the form "[datastore] dir/disk.vmdk".
+'''
+
+def datastore_of(path):
+    """ Returns the datastore of a "[datastore] dir/disk.vmdk" path, or None """
+    if path.startswith("[") and "]" in path:
+        return path[1:path.index("]")]
+    return None
@@ -0,0 +1,107 @@
+'''
+Background read-ahead.
+
+A worker thread keeps up to `depth` reads in flight ahead of the consumer, reading into
+a ring of preallocated buffers.  When every buffer is full the worker waits for the
+consumer (backpressure), and when none are ready the consumer waits for the worker.
+vix-disklib handles must not be used from two threads at once, so while a ReadAhead is
+running only its worker touches the disk.
+'''
+import sys, threading, Queue, time
+
+import numpy as np
+
+# an exception raised by the worker, handed to the consumer
+class _Failure(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+class PrefetchStats(object):
+    """ Counts how often, and for how long, each side of a ReadAhead had to wait """
+    def __init__(self):
+        self.reads = 0
+        self.consumer_waits = 0
+        self.consumer_wait_time = 0.0
+        self.producer_waits = 0
+        self.producer_wait_time = 0.0
+
+    def __repr__(self):
+        return "<PrefetchStats reads=%d consumer_waits=%d (%.3fs) producer_waits=%d (%.3fs)>" % (
+            self.reads, self.consumer_waits, self.consumer_wait_time,
+            self.producer_waits, self.producer_wait_time)
+
+class ReadAhead(object):
+    """
+    Iterates over (key, buffer) pairs, filling each buffer on a worker thread with
+    ``reader(key, buffer)``.  A buffer is only valid until the next iteration.
+
+    :param reader: Called as reader(key, buffer) on the worker thread.
+    :param items: A sequence of (key, nbytes) pairs, read in order.
+    :param buffer_size: The size of each ring buffer, at least the largest nbytes.
+    :param depth: The most reads to have done ahead of the consumer.  The ring holds one
+                  more buffer than this, for the one the consumer is working on.
+    """
+    def __init__(self, reader, items, buffer_size, depth=2):
+        self.reader = reader
+        self.items = items
+        self.depth = max(1, depth)
+        self.ring = [np.empty(buffer_size, dtype=np.uint8) for _ in xrange(self.depth + 1)]
+        self.stats = PrefetchStats()
+
+    def __iter__(self):
+        free = Queue.Queue()
+        filled = Queue.Queue()
+        stop = threading.Event()
+        for buff in self.ring:
+            free.put(buff)
+
+        worker = threading.Thread(target=self._produce, args=(free, filled, stop))
+        worker.daemon = True
+        worker.start()
+
+        buff = None
+        try:
+            while True:
+                if buff is not None:
+                    free.put(buff)
+
+                if filled.empty():
+                    self.stats.consumer_waits += 1
+                    start = time.time()
+                    entry = filled.get()
+                    self.stats.consumer_wait_time += time.time() - start
+                else:
+                    entry = filled.get()
+
+                if entry is None:
+                    return
+                if isinstance(entry, _Failure):
+                    raise entry.exc_info[0], entry.exc_info[1], entry.exc_info[2]
+                key, buff, nbytes = entry
+                yield key, buff[:nbytes]
+        finally:
+            # make sure the worker is off the disk handle before the caller gets it back
+            stop.set()
+            free.put(None)
+            worker.join()
+
+    def _produce(self, free, filled, stop):
+        try:
+            for key, nbytes in self.items:
+                if free.empty():
+                    self.stats.producer_waits += 1
+                    start = time.time()
+                    buff = free.get()
+                    self.stats.producer_wait_time += time.time() - start
+                else:
+                    buff = free.get()
+                if buff is None or stop.is_set():
+                    return
+
+                self.reader(key, buff[:nbytes])
+                self.stats.reads += 1
+                filled.put((key, buff, nbytes))
+        except Exception:
+            filled.put(_Failure(sys.exc_info()))
+            return
+        filled.put(None)
@@ -0,0 +1,254 @@
+'''
+Multi-VM backup scheduling.
+
+Runs many backup jobs, each the disks of one VM snapshot, at once without overloading
+any single ESX host or datastore.  Every job runs in its own worker process, so each
+has its own vix-disklib state and a crash in the library only fails that job.  Jobs are
+started largest first, as soon as the global, per-host and per-datastore limits allow.
+
+Workers are forked, so the scheduling process itself should not have initialized the
+library.
+'''
+import os, time, traceback, logging, multiprocessing, Queue
+
+from vixDiskLib.zeros import zero_mask, data_runs
+from vixDiskLib.paths import datastore_of
+
+log = logging.getLogger("vixDiskLib.scheduler")
+
+class BackupJob(object):
+    """
+    The disks of one VM snapshot to back up.
+
+    :param name: A name for the job, used in results and logs.
+    :param credentials: The `:py:class:VixCredentials`, None for local disks.
+    :param snapshotRef: The snapshot to read from.
+    :param disks: The disk paths.
+    :param destination: The directory the disk images are written to, one
+                        <disk name>.raw sparse file per disk.
+    :param size: The estimated size in bytes, used to start the largest jobs first.
+    :param transport: The transport to use, see :py:meth:`VixBase.connect`.
+    :param libdir: The location of the vix-disklib libraries.
+    :param config: The location of the vix-disklib configuration file.
+    :param block_size: The read size, in bytes.
+    """
+    def __init__(self, name, credentials, snapshotRef, disks, destination, size=0,
+                 transport=None, libdir=None, config=None, block_size=1048576):
+        self.name = name
+        self.credentials = credentials
+        self.snapshotRef = snapshotRef
+        self.disks = list(disks)
+        self.destination = destination
+        self.size = size
+        self.transport = transport
+        self.libdir = libdir
+        self.config = config
+        self.block_size = block_size
+
+    @property
+    def host(self):
+        return getattr(self.credentials, "host", None)
+
+    @property
+    def datastores(self):
+        return set(filter(None, (datastore_of(path) for path in self.disks)))
+
+    def __repr__(self):
+        return "<BackupJob %s: %d disks on %s>" % (self.name, len(self.disks), self.host)
+
+class JobResult(object):
+    """ What happened to one job """
+    def __init__(self, job, nbytes=0, elapsed=0.0, error=None):
+        self.job = job
+        self.bytes = nbytes
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "<JobResult %s: %s, %d bytes in %.1fs>" % (
+            self.job.name, "ok" if self.ok else "failed", self.bytes, self.elapsed)
+
+class SchedulerStats(object):
+    """ Totals over all the jobs run by a Scheduler """
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.bytes_by_host = {}
+        self.max_running = 0
+
+    @property
+    def throughput(self):
+        """ Bytes per second over the whole run """
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def add(self, result):
+        if result.ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.bytes += result.bytes
+        host = result.job.host
+        self.bytes_by_host[host] = self.bytes_by_host.get(host, 0) + result.bytes
+
+    def __repr__(self):
+        return "<SchedulerStats succeeded=%d failed=%d bytes=%d %.1fMB/s>" % (
+            self.succeeded, self.failed, self.bytes, self.throughput / 1048576)
+
+def output_names(paths):
+    """
+    Returns the image name of each disk of a job, the VMDK name without its extension.
+    Names that would collide, such as "[ds1] vm/vm.vmdk" and "[ds2] vm/vm.vmdk", get
+    their datastore in front, and then their position in the job if that is not enough.
+    """
+    bases = [os.path.splitext(os.path.basename(path.split("]")[-1].strip()))[0] for path in paths]
+    names = ["%s-%s" % (datastore_of(path), base) if bases.count(base) > 1 and datastore_of(path) else base
+             for path, base in zip(paths, bases)]
+    counts = dict((name, names.count(name)) for name in names)
+    return [name if counts[name] == 1 else "%s-%d" % (name, i) for i, name in enumerate(names)]
+
+def backup_job(job):
+    """
+    The default job: copies every disk of the snapshot to a sparse raw image in the
+    job's destination, leaving zero blocks as holes.
+
+    :return: The number of bytes read.
+    """
+    from vixDiskLib.diskset import DiskSet
+
+    files = {}
+    with DiskSet(job.credentials, job.libdir, job.config, block_size=job.block_size) as disks:
+        disks.connect(job.snapshotRef, job.transport, readonly=True)
+        for path, name in zip(job.disks, output_names(job.disks)):
+            disks.open(path)
+            files[path] = open(os.path.join(job.destination, name + ".raw"), "wb")
+
+        def write(path, block, data):
+            fd = files[path]
+            for first, count in data_runs(zero_mask(data, job.block_size)):
+                fd.seek((block + first) * job.block_size)
+                fd.write(data[first * job.block_size:(first + count) * job.block_size])
+
+        try:
+            disks.for_each(write, nblocks=max(1, 8388608 // job.block_size), prefetch=1)
+            nbytes = 0
+            for path, disk in disks.disks.items():
+                capacity = disk.info()['capacity'] * 512
+                files[path].truncate(capacity)
+                nbytes += capacity
+        finally:
+            for fd in files.values():
+                fd.close()
+    return nbytes
+
+def _run(worker, index, job, results):
+    """ The body of a worker process """
+    start = time.time()
+    try:
+        nbytes = worker(job)
+        results.put((index, nbytes, time.time() - start, None))
+    except Exception:
+        results.put((index, 0, time.time() - start, traceback.format_exc()))
+
+class Scheduler(object):
+    """
+    Runs backup jobs in worker processes, largest first, within concurrency limits.
+
+    :param max_workers: The most jobs running at once.
+    :param per_host: The most jobs running at once against one ESX host.
+    :param per_datastore: The most jobs running at once reading one datastore.
+    :param worker: Called as worker(job) in the worker process, returning the number of
+                   bytes moved.  Defaults to :py:func:`backup_job`.
+    """
+    def __init__(self, max_workers=4, per_host=2, per_datastore=2, worker=backup_job):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.per_datastore = per_datastore
+        self.worker = worker
+        self.stats = SchedulerStats()
+
+    def run(self, jobs):
+        """
+        Runs every job, and returns once all of them are done.  A job that fails, even
+        by crashing its worker process, does not affect the others.
+
+        :return: A list of :py:class:`JobResult`, in the order of `jobs`.
+        """
+        jobs = list(jobs)
+        # largest first, keeping the given order among equals
+        pending = sorted(xrange(len(jobs)), key=lambda i: -(jobs[i].size or 0))
+        outcome = [None] * len(jobs)
+        running = {}    # index -> (process, started)
+        hosts = {}
+        datastores = {}
+        results = multiprocessing.Queue()
+        start = time.time()
+
+        def finish(index, result):
+            process, _ = running.pop(index)
+            process.join()
+            job = jobs[index]
+            hosts[job.host] -= 1
+            for ds in job.datastores:
+                datastores[ds] -= 1
+            outcome[index] = result
+            self.stats.add(result)
+            if result.ok:
+                log.info("%s: %d bytes in %.1fs" % (job.name, result.bytes, result.elapsed))
+            else:
+                log.error("%s failed:\n%s" % (job.name, result.error))
+
+        def report(message):
+            index, nbytes, elapsed, error = message
+            # the job may already have been given up on as crashed
+            if index not in running:
+                log.warning("Ignoring the late result of %s" % jobs[index].name)
+                return
+            finish(index, JobResult(jobs[index], nbytes, elapsed, error))
+
+        while pending or running:
+            for index in list(pending):
+                if len(running) >= self.max_workers:
+                    break
+                job = jobs[index]
+                if hosts.get(job.host, 0) >= self.per_host:
+                    continue
+                if any(datastores.get(ds, 0) >= self.per_datastore for ds in job.datastores):
+                    continue
+                pending.remove(index)
+                hosts[job.host] = hosts.get(job.host, 0) + 1
+                for ds in job.datastores:
+                    datastores[ds] = datastores.get(ds, 0) + 1
+                process = multiprocessing.Process(target=_run, args=(self.worker, index, job, results),
+                                                  name="backup-%s" % job.name)
+                process.daemon = True
+                process.start()
+                running[index] = (process, time.time())
+                self.stats.max_running = max(self.stats.max_running, len(running))
+
+            try:
+                report(results.get(timeout=0.2))
+            except Queue.Empty:
+                # a worker that died without reporting back: a crash in the library, or an
+                # exit (even with status 0) that skipped the result.  A worker's result is
+                # in the queue before it exits, so the ones posted since the wait timed out
+                # are taken first.
+                dead = [index for index, (process, _) in running.items() if not process.is_alive()]
+                while True:
+                    try:
+                        report(results.get_nowait())
+                    except Queue.Empty:
+                        break
+                for index in dead:
+                    if index in running:
+                        process, started = running[index]
+                        finish(index, JobResult(jobs[index], 0, time.time() - started,
+                                                "Worker exited with code %s without a result" % process.exitcode))
+
+        self.stats.elapsed += time.time() - start
+        return outcome
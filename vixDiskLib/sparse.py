@@ -0,0 +1,222 @@
+'''
+A reader for hosted sparse VMDK extents, the files of MONOLITHIC_SPARSE, SPLIT_SPARSE
+and STREAM_OPTIMIZED disks.
+
+A sparse extent stores the disk in grains (64KB by default).  A grain directory points
+at grain tables of 512 entries, and each entry is the sector of a grain in the file, or
+0 if the grain was never written (1 for a grain known to be zero).  The directory and
+all the tables are loaded once into one uint32 array with an entry per grain, so
+mapping any sector range to file offsets is a slice of it, and the unallocated parts
+of the disk are known without any further I/O.
+
+In STREAM_OPTIMIZED extents every grain is deflate compressed and starts with a small
+marker giving its sector and compressed size, and the real header, with the grain
+directory's location, is a footer at the end of the file.  Compressed grains are
+inflated when read, and the last few are kept for reads smaller than a grain.
+
+Parent disks are not followed: unallocated grains read as zeros.
+'''
+import zlib, logging, threading
+from collections import OrderedDict
+
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.extents import as_extents
+from vixDiskLib.descriptor import Descriptor
+
+log = logging.getLogger("vixDiskLib.sparse")
+
+SECTOR_SIZE = 512
+SPARSE_MAGIC = 0x564d444b       # "KDMV"
+GD_AT_END = 0xffffffffffffffff
+
+FLAG_COMPRESSED = 1 << 16
+FLAG_MARKERS = 1 << 17
+COMPRESSION_DEFLATE = 1
+
+HEADER = np.dtype([
+    ('magic', '<u4'), ('version', '<u4'), ('flags', '<u4'),
+    ('capacity', '<u8'), ('grainSize', '<u8'),
+    ('descriptorOffset', '<u8'), ('descriptorSize', '<u8'),
+    ('numGTEsPerGT', '<u4'), ('rgdOffset', '<u8'), ('gdOffset', '<u8'), ('overHead', '<u8'),
+    ('uncleanShutdown', 'u1'), ('newlineChars', 'S4'),
+    ('compressAlgorithm', '<u2'), ('pad', 'u1', 433)])
+
+# the start of a compressed grain: its first sector, and the compressed size in bytes
+GRAIN_MARKER = np.dtype([('lba', '<u8'), ('size', '<u4')])
+
+# decompressed grains kept for reads smaller than a grain
+GRAIN_CACHE_SIZE = 8
+
+def is_sparse(head):
+    """ True if `head`, the start of a file, is a sparse extent header """
+    return len(head) >= 4 and int(np.frombuffer(head[:4], dtype='<u4')[0]) == SPARSE_MAGIC
+
+class SparseExtent(object):
+    """
+    One sparse extent file.
+
+    :param fd: The open file, an object with `read_into(out, offset)`, `size()` and
+               `close()` like :py:class:`vixDiskLib.backends.ExtentFile`.  It is closed
+               by :py:meth:`close`.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.header = header = self._read_header(0)
+        if int(header['gdOffset']) == GD_AT_END:
+            # stream optimized: the footer, two sectors from the end, has the real one
+            self.header = header = self._read_header(fd.size() - 2 * SECTOR_SIZE)
+            if int(header['gdOffset']) == GD_AT_END:
+                raise VixDiskLibError("%s has no grain directory" % self._name())
+        if header['version'] > 3 or header['numGTEsPerGT'] == 0 or header['grainSize'] < 1:
+            raise VixDiskLibError("Unsupported sparse extent %s: version %d, %d sector grains" % (
+                self._name(), header['version'], header['grainSize']))
+        self.compressed = bool(header['flags'] & FLAG_COMPRESSED)
+        if self.compressed and header['compressAlgorithm'] != COMPRESSION_DEFLATE:
+            raise VixDiskLibError("Unsupported grain compression %d in %s" % (header['compressAlgorithm'], self._name()))
+        if header['uncleanShutdown']:
+            log.warning("%s was not closed cleanly, its grain tables may be stale" % self._name())
+
+        self.capacity = int(header['capacity'])
+        self.grain_size = int(header['grainSize'])
+        self.descriptor = self._read_descriptor()
+        self.grains = self._read_grain_tables()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _name(self):
+        return getattr(self.fd, "path", "sparse extent")
+
+    def _read(self, offset, nbytes, dtype=np.uint8):
+        buff = np.empty(nbytes, dtype=np.uint8)
+        self.fd.read_into(buff, offset)
+        return buff.view(dtype)
+
+    def _read_header(self, offset):
+        header = self._read(offset, HEADER.itemsize, HEADER)[0]
+        if header['magic'] != SPARSE_MAGIC:
+            raise VixDiskLibError("%s is not a sparse extent" % self._name())
+        return header
+
+    def _read_descriptor(self):
+        if not self.header['descriptorOffset'] or not self.header['descriptorSize']:
+            return None
+        text = self._read(int(self.header['descriptorOffset']) * SECTOR_SIZE,
+                          int(self.header['descriptorSize']) * SECTOR_SIZE).tostring()
+        return Descriptor.parse(text.split("\0", 1)[0])
+
+    def _read_grain_tables(self):
+        """ Returns the grain table entries of the whole extent as one array, in grain order """
+        per_table = int(self.header['numGTEsPerGT'])
+        ngrains = -(-self.capacity // self.grain_size)
+        ntables = -(-ngrains // per_table)
+        directory = self._read(int(self.header['gdOffset']) * SECTOR_SIZE, ntables * 4, '<u4')
+        tables = np.zeros((ntables, per_table), dtype=np.uint32)
+
+        # tables stored back to back are read together
+        present = np.flatnonzero(directory)
+        present = present[np.argsort(directory[present], kind="mergesort")]
+        offsets = directory[present].astype(np.int64)
+        table_sectors = -(-per_table * 4 // SECTOR_SIZE)
+        breaks = np.flatnonzero(np.diff(offsets) != table_sectors) + 1
+        for run in np.split(np.arange(present.size), breaks):
+            if run.size:
+                data = self._read(int(offsets[run[0]]) * SECTOR_SIZE, run.size * table_sectors * SECTOR_SIZE, '<u4')
+                tables[present[run]] = data.reshape(run.size, -1)[:, :per_table]
+        return tables.ravel()[:ngrains]
+
+    def allocated(self, start, count):
+        """
+        Returns the allocated sectors of a range as an extent list, from the grain
+        tables alone.
+        """
+        if count <= 0:
+            return as_extents([])
+        first = start // self.grain_size
+        last = (start + count - 1) // self.grain_size
+        used = (self.grains[first:last + 1] > 1).astype(np.int8)
+        edges = np.diff(np.concatenate(([0], used, [0])))
+        starts = (np.flatnonzero(edges == 1) + first) * self.grain_size
+        ends = (np.flatnonzero(edges == -1) + first) * self.grain_size
+        starts = np.maximum(starts, start)
+        ends = np.minimum(ends, start + count)
+        return as_extents(np.column_stack((starts, ends - starts)))
+
+    def read_into(self, out, offset):
+        """
+        Fills the uint8 array `out` with the extent's data from byte `offset`, which like
+        the length of `out` is a whole number of sectors.  Unallocated grains are filled
+        with zeros without any I/O.
+        """
+        sector, nsectors = offset // SECTOR_SIZE, out.size // SECTOR_SIZE
+        if sector + nsectors > self.capacity:
+            raise VixDiskLibError("Sectors %d-%d are past the end of %s (%d)" % (sector, sector + nsectors, self._name(), self.capacity))
+        if nsectors == 0:
+            return
+        size = self.grain_size
+        first = sector // size
+        entries = self.grains[first:(sector + nsectors - 1) // size + 1].astype(np.int64)
+        # the piece of each grain in the range: its sectors [lo, hi) and where it goes in out
+        lo = np.maximum((np.arange(entries.size) + first) * size, sector)
+        hi = np.minimum((np.arange(1, entries.size + 1) + first) * size, sector + nsectors)
+        pos = (lo - sector) * SECTOR_SIZE
+
+        if self.compressed:
+            for i in xrange(entries.size):
+                dest = out[pos[i]:pos[i] + (hi[i] - lo[i]) * SECTOR_SIZE]
+                if entries[i] <= 1:
+                    dest[:] = 0
+                else:
+                    inside = (lo[i] - (first + i) * size) * SECTOR_SIZE
+                    dest[:] = self._grain(first + i, entries[i])[inside:inside + dest.size]
+            return
+
+        # grains that follow each other in the file are read together
+        files = entries + (lo - (np.arange(entries.size) + first) * size)
+        hole = entries <= 1
+        breaks = np.flatnonzero((hole[1:] != hole[:-1]) | (~hole[1:] & (np.diff(files) != np.diff(lo)))) + 1
+        for run in np.split(np.arange(entries.size), breaks):
+            dest = out[pos[run[0]]:pos[run[-1]] + (hi[run[-1]] - lo[run[-1]]) * SECTOR_SIZE]
+            if hole[run[0]]:
+                dest[:] = 0
+            else:
+                self.fd.read_into(dest, int(files[run[0]]) * SECTOR_SIZE)
+
+    def _grain(self, index, sector):
+        """ Returns grain `index`, stored compressed at `sector`, inflated """
+        with self._lock:
+            grain = self._cache.pop(index, None)
+            if grain is not None:
+                self._cache[index] = grain
+                return grain
+
+        grain_bytes = self.grain_size * SECTOR_SIZE
+        # most grains compress, so one read usually gets the marker and all the data
+        data = self._read(int(sector) * SECTOR_SIZE, grain_bytes + SECTOR_SIZE)
+        marker = data[:GRAIN_MARKER.itemsize].view(GRAIN_MARKER)[0]
+        if marker['lba'] != index * self.grain_size:
+            raise VixDiskLibError("Grain %d of %s is marked as sector %d" % (index, self._name(), marker['lba']))
+        end = GRAIN_MARKER.itemsize + int(marker['size'])
+        if end > data.size:
+            data = self._read(int(sector) * SECTOR_SIZE, end)
+        try:
+            inflated = zlib.decompress(data[GRAIN_MARKER.itemsize:end].tostring())
+        except zlib.error, e:
+            raise VixDiskLibError("Grain %d of %s is corrupt: %s" % (index, self._name(), e))
+        grain = np.zeros(grain_bytes, dtype=np.uint8)
+        inflated = np.frombuffer(inflated, dtype=np.uint8)[:grain_bytes]
+        grain[:inflated.size] = inflated
+
+        with self._lock:
+            self._cache[index] = grain
+            while len(self._cache) > GRAIN_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return grain
+
+    def write_from(self, data, offset):
+        raise VixDiskLibError("Sparse extents are read only: %s" % self._name())
+
+    def close(self):
+        self.fd.close()
+        self._cache.clear()
@@ -0,0 +1,161 @@
+'''
+Transport mode selection by measurement.
+
+Left alone, vix-disklib picks the transport itself, and the one it picks is not always
+the fastest: hotadd or SAN can be available yet slower than NBD on some hosts, or only
+fail once a disk is opened.  TransportSelector opens a disk over each candidate
+transport, reads a short sample, and ranks the transports that worked by throughput.
+The ranking is cached per host and datastore for a while, and opening falls back to
+the next transport (and finally to the library's own choice) when one fails.
+'''
+import time, threading, logging
+
+import numpy as np
+
+from vixDiskLib.consts import VixDiskTransportModes
+from vixDiskLib.vixExceptions import VixDiskLibError
+from vixDiskLib.vixDisk import VixDisk
+from vixDiskLib.paths import datastore_of
+
+log = logging.getLogger("vixDiskLib.transport")
+
+SECTOR_SIZE = 512
+
+class ProbeResult(object):
+    """ How one transport did in a probe """
+    def __init__(self, transport, open_time=None, throughput=None, error=None):
+        self.transport = transport
+        self.open_time = open_time
+        self.throughput = throughput
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if not self.ok:
+            return "<ProbeResult %s: %s>" % (self.transport, self.error)
+        return "<ProbeResult %s: open %.3fs, %.1fMB/s>" % (
+            self.transport, self.open_time, self.throughput / 1048576)
+
+class TransportSelector(object):
+    """
+    Picks the fastest working transport per host and datastore.
+
+    :param libdir: The location of the vix-disklib libraries.
+    :param config: The location of the vix-disklib configuration file.
+    :param candidates: The transports to try, in order of preference when they are
+                       equally fast.  Defaults to all of `VixDiskTransportModes`.
+    :param ttl: Seconds a ranking is trusted before the next probe.
+    :param sample_size: Bytes read from the start of the disk to measure throughput.
+    """
+    def __init__(self, libdir=None, config=None, candidates=None, ttl=3600, sample_size=8388608):
+        self.libdir = libdir
+        self.config = config
+        self.candidates = list(candidates or VixDiskTransportModes)
+        self.ttl = ttl
+        self.sample_size = sample_size
+        self.results = {}     # key -> the ProbeResults of the last probe
+        self._rankings = {}   # key -> (expires, [transport, ...])
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(credentials, path):
+        """ The cache key, (host, datastore) """
+        return (getattr(credentials, "host", None), datastore_of(path))
+
+    def probe(self, credentials, path, snapshotRef=None):
+        """
+        Opens `path` over every candidate transport and reads the sample.
+
+        :return: The ProbeResults, working transports first, fastest first.
+        """
+        results = [self._probe(credentials, path, snapshotRef, transport) for transport in self.candidates]
+        order = dict((transport, i) for i, transport in enumerate(self.candidates))
+        results.sort(key=lambda r: (not r.ok, -(r.throughput or 0), r.open_time, order[r.transport]))
+        log.debug("Probed %s: %s" % (path, results))
+
+        key = self.key(credentials, path)
+        with self._lock:
+            self.results[key] = results
+            self._rankings[key] = (time.time() + self.ttl, [r.transport for r in results if r.ok])
+        return results
+
+    def _probe(self, credentials, path, snapshotRef, transport):
+        disk = VixDisk(credentials, self.libdir, self.config)
+        try:
+            start = time.time()
+            disk.connect(snapshotRef, transport, readonly=True)
+            disk.open(path)
+            open_time = time.time() - start
+            if disk.transport_mode != transport:
+                return ProbeResult(transport, error="library used %s instead" % disk.transport_mode)
+
+            sectors = min(disk.info()['capacity'], self.sample_size // SECTOR_SIZE)
+            buff = np.empty(sectors * SECTOR_SIZE, dtype=np.uint8)
+            start = time.time()
+            disk.read_extents([(0, sectors)], buff)
+            elapsed = max(time.time() - start, 1e-6)
+            return ProbeResult(transport, open_time, buff.size / elapsed)
+        except VixDiskLibError, e:
+            return ProbeResult(transport, error=str(e))
+        finally:
+            if disk.opened:
+                disk.close()
+            if disk.connected:
+                disk.disconnect()
+
+    def ranking(self, credentials, path, snapshotRef=None):
+        """
+        Returns the working transports for the host and datastore of `path`, fastest
+        first, probing if there is no ranking or it has expired.
+        """
+        key = self.key(credentials, path)
+        with self._lock:
+            expires, transports = self._rankings.get(key, (0, None))
+        if transports is None or expires < time.time():
+            self.probe(credentials, path, snapshotRef)
+            with self._lock:
+                expires, transports = self._rankings[key]
+        return list(transports)
+
+    def invalidate(self, credentials=None, path=None):
+        """ Forgets the ranking for the host and datastore of `path`, or every ranking """
+        with self._lock:
+            if path is None:
+                self._rankings.clear()
+            else:
+                self._rankings.pop(self.key(credentials, path), None)
+
+    def open(self, disk, path, snapshotRef=None, readonly=True, single=False):
+        """
+        Connects `disk` (a :py:class:`VixDisk` that is not connected yet) and opens `path`
+        over the fastest transport.  When that fails, the transport is dropped from the
+        ranking and the next one is tried, and finally the library's own choice.
+
+        :return: The transport in use.
+        """
+        transports = self.ranking(disk.cred, path, snapshotRef) + [None]
+        error = None
+        for transport in transports:
+            try:
+                disk.connect(snapshotRef, transport, readonly)
+                disk.open(path, single)
+                return disk.transport_mode
+            except VixDiskLibError, e:
+                log.warning("Opening %s over %s failed: %s" % (path, transport or "default transport", e))
+                error = e
+                if disk.connected:
+                    disk.disconnect()
+                if transport is not None:
+                    self._demote(disk.cred, path, transport)
+        raise error
+
+    def _demote(self, credentials, path, transport):
+        key = self.key(credentials, path)
+        with self._lock:
+            expires, transports = self._rankings.get(key, (0, []))
+            if transport in transports:
+                transports = [t for t in transports if t != transport]
+                self._rankings[key] = (expires, transports)
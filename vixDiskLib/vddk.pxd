@@ -533,12 +533,12 @@ cdef extern from "vixDiskLib.h":
                          bint readOnly,
                          char *snapshotRef,
                          char *transportModes,
-                         VixDiskLibConnection *connection)
+                         VixDiskLibConnection *connection) nogil
     
     #  Breaks an existing connection.
     #  @param connection [in] Valid handle to a (local/remote) connection.
     #  @return VIX_OK if success suitable VIX error code otherwise.
-    VixError VixDiskLib_Disconnect(VixDiskLibConnection connection)
+    VixError VixDiskLib_Disconnect(VixDiskLibConnection connection) nogil
     
     #  Creates a local disk. Remote disk creation is not supported.
     #  @param connection [in] A valid connection.
@@ -582,7 +582,7 @@ cdef extern from "vixDiskLib.h":
     VixError VixDiskLib_Open(VixDiskLibConnection connection,
                     char *path,
                     uint32 flags,
-                    VixDiskLibHandle *diskHandle)
+                    VixDiskLibHandle *diskHandle) nogil
     
     #  Retrieves information about a disk.
     #  @param diskHandle [in] Handle to an open virtual disk.
@@ -614,7 +614,7 @@ cdef extern from "vixDiskLib.h":
     #  Closes the disk.
     #  @param diskHandle [in] Handle to an open virtual disk.
     #  @return VIX_OK if success, suitable VIX error code otherwise.
-    VixError VixDiskLib_Close(VixDiskLibHandle diskHandle)
+    VixError VixDiskLib_Close(VixDiskLibHandle diskHandle) nogil
     
     #  Reads a sector range.
     #  @param diskHandle [in] Handle to an open virtual disk.
@@ -625,7 +625,7 @@ cdef extern from "vixDiskLib.h":
     VixError VixDiskLib_Read(VixDiskLibHandle diskHandle,
                     VixDiskLibSectorType startSector,
                     VixDiskLibSectorType numSectors,
-                    uint8 *readBuffer)
+                    uint8 *readBuffer) nogil
     
     #  Writes a sector range.
     #  @param diskHandle [in] Handle to an open virtual disk.
@@ -636,7 +636,7 @@ cdef extern from "vixDiskLib.h":
     VixError VixDiskLib_Write(VixDiskLibHandle diskHandle,
                      VixDiskLibSectorType startSector,
                      VixDiskLibSectorType numSectors,
-                     uint8 *writeBuffer)
+                     uint8 *writeBuffer) nogil
     
     #  Retrieves the value of a metadata entry corresponding to the supplied key.
     #  @param diskHandle [in] Handle to an open virtual disk.
@@ -711,7 +711,7 @@ cdef extern from "vixDiskLib.h":
     #  @return VIX_OK if success, suitable VIX error code otherwise.
     VixError VixDiskLib_Shrink(VixDiskLibHandle diskHandle,
                       VixDiskLibProgressFunc progressFunc,
-                      void *progressCallbackData)
+                      void *progressCallbackData) nogil
     
     #  Defragments an existing disk.
     #  @param diskHandle [in] Handle to an open virtual disk.
@@ -721,7 +721,7 @@ cdef extern from "vixDiskLib.h":
     #  @return VIX_OK if success, suitable VIX error code otherwise.
     VixError VixDiskLib_Defragment(VixDiskLibHandle diskHandle,
                           VixDiskLibProgressFunc progressFunc,
-                          void *progressCallbackData)
+                          void *progressCallbackData) nogil
     
     #  Renames a virtual disk.
     #  @param srcFileName [in] Virtual disk file to rename.
@@ -754,7 +754,7 @@ cdef extern from "vixDiskLib.h":
                      VixDiskLibCreateParams *vixCreateParams,
                      VixDiskLibProgressFunc progressFunc,
                      void *progressCallbackData,
-                     bint overWrite)
+                     bint overWrite) nogil
     
     #  Returns the textual description of an error.
     #  @param err [in] A VIX error code.
@@ -811,3 +811,21 @@ cdef extern from "vixDiskLib.h":
     #  @return None.
     void VixDiskLib_FreeConnectParams(VixDiskLibConnectParams* connectParams)
 
+# Allocated block queries (VDDK 6.7 and later).  These are not in the headers this module
+# is built against, so the entry points are looked up at run time (see VixDiskBase.query_allocated)
+# and the structures are declared here with the same layout.
+ctypedef struct AllocatedBlock:
+    VixDiskLibSectorType offset
+    VixDiskLibSectorType length
+
+ctypedef struct AllocatedBlockList:
+    uint32 numBlocks
+    AllocatedBlock blocks[1]
+
+ctypedef VixError (*QueryAllocatedBlocksFunc)(VixDiskLibHandle diskHandle,
+                                              VixDiskLibSectorType startSector,
+                                              VixDiskLibSectorType numSectors,
+                                              VixDiskLibSectorType chunkSize,
+                                              AllocatedBlockList **blockList) nogil
+
+ctypedef VixError (*FreeBlockListFunc)(AllocatedBlockList *blockList) nogil
@@ -1,6 +1,6 @@
 # distutils: language = C
-# distutils: libraries = vixDiskLib vixMntapi
-# distutils: include_dirs = /usr/lib/vmware-vix-disklib/include
+# distutils: libraries = vixDiskLib vixMntapi dl
+# distutils: include_dirs = VMWARE_INCDIR
 # distutils: library_dirs = VMWARE_LIBDIR
 
 from common cimport *
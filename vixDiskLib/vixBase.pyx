@@ -1,5 +1,5 @@
 
-import logging, time
+import logging, time, threading
 
 from common cimport *
 from vddk cimport *
@@ -16,8 +16,24 @@ def usleep(x):
 cdef int VIXDISKLIB_VERSION_MAJOR = 1
 cdef int VIXDISKLIB_VERSION_MINOR = 2
 
-# Add callback for logging
-cdef void LogFunc(char *format, va_list args):
+# The library is process wide: InitEx loads the transport plugins (seconds on remote
+# setups) and Exit tears everything down, including other instances' connections.
+# So it is initialized once per (libdir, config), every VixBase holds a reference, and
+# Exit is only called once the last reference is gone.
+_library_lock = threading.RLock()
+_library_users = {}
+library_stats = {'initializations': 0, 'exits': 0}
+
+def library_users():
+    """
+    Returns the number of VixBase instances holding the library, by (libdir, config).
+    """
+    with _library_lock:
+        return dict(_library_users)
+
+# Add callback for logging.  The library may log from inside calls that were made
+# without the GIL (see VixDiskBase.read), so the callback has to take it back.
+cdef void LogFunc(char *format, va_list args) with gil:
     cdef char buffer[1000]
     PyOS_vsnprintf(buffer, 1000, format, args)
     out = PyString_FromString(buffer)
@@ -36,6 +52,8 @@ cdef class VixBase(object):
         self.is_remote  = False
         self._libdir    = None
         self._config    = None
+        self._library_key = None
+        self._lease     = None
         
         if credentials:
             if credentials.vmxSpec:
@@ -70,7 +88,7 @@ cdef class VixBase(object):
         cdef char *cerror = VixDiskLib_GetErrorText(error_num, NULL)
         error = "[%d] %s.  %s" % (error_num, PyString_FromString(cerror), PyString_FromString(msg))
         VixDiskLib_FreeErrorText(cerror)
-        raise VixDiskLibError(error)
+        raise VixDiskLibError(error, code=error_num)
         
     def cleanup(self):
         """
@@ -81,8 +99,23 @@ cdef class VixBase(object):
 
     def initialize(self):
         """
-        Initialize the vix-disklib library and setup logging 
+        Takes a reference on the vix-disklib library, initializing it (and setting up
+        logging) if this is the first user of this libdir and config.  Does nothing if
+        this instance already holds a reference.
         """
+        if self._library_key is not None:
+            return
+        key = (self._libdir, self._config) if self.is_remote else (None, self._config)
+        with _library_lock:
+            if key not in _library_users:
+                self._initialize()
+                _library_users[key] = 0
+                library_stats['initializations'] += 1
+            _library_users[key] += 1
+        self._library_key = key
+        
+    def _initialize(self):
+        cdef char *config = NULL
         log.debug("Initializing vixDiskLib")
         if self.is_remote:
             vix_error = VixDiskLib_InitEx(VIXDISKLIB_VERSION_MAJOR, VIXDISKLIB_VERSION_MINOR, 
@@ -92,32 +125,56 @@ cdef class VixBase(object):
                                           PyString_AsString(self._libdir), 
                                           PyString_AsString(self._config))
         else:
+            # local disks still read the config, for the settings that aren't transport ones
+            if self._config:
+                config = PyString_AsString(self._config)
             vix_error = VixDiskLib_InitEx(VIXDISKLIB_VERSION_MAJOR, VIXDISKLIB_VERSION_MINOR,
-                                          NULL, NULL, NULL, NULL, NULL);
+                                          NULL, NULL, NULL, NULL, config);
         
         if vix_error != VIX_OK:
             self._handleError("Error initializing the vixDiskLib library", vix_error)
         
         # perform a cleanup operation just in case something bad happened last time around...
         self.cleanup()
+        
+    def release(self):
+        """
+        Drops this instance's reference on the vix-disklib library, and exits the
+        library if that was the last one in the process.
+        """
+        key, self._library_key = self._library_key, None
+        if key is None:
+            return
+        with _library_lock:
+            _library_users[key] -= 1
+            if not _library_users[key]:
+                del _library_users[key]
+            if not _library_users:
+                log.debug("Last user gone, exiting vixDiskLib")
+                VixDiskLib_Exit()
+                library_stats['exits'] += 1
       
     def finalize(self):
         """
-        Frees any memory that we maybe hanging on too.
+        Frees any memory that we maybe hanging on too, and releases the library.
         """
         if self.connected:
             self.disconnect()
             
         if self.params.vmxSpec != NULL:
             free(self.params.vmxSpec)
+            self.params.vmxSpec = NULL
         if self.params.serverName != NULL:
             free(self.params.serverName)
+            self.params.serverName = NULL
         if self.params.creds.uid.userName != NULL:
             free(self.params.creds.uid.userName)
+            self.params.creds.uid.userName = NULL
         if self.params.creds.uid.password != NULL:
             free(self.params.creds.uid.password)
+            self.params.creds.uid.password = NULL
 
-        VixDiskLib_Exit()
+        self.release()
         
     def __del__(self):
         log.debug("Closing any open connections and exiting")
@@ -127,24 +184,41 @@ cdef class VixBase(object):
         """
         Closes any open connections, cleans up, and then reconnects.
         """
-        self.finalize()
+        if self.connected:
+            self.disconnect()
         usleep(100)
         self.connect()
         
-    def connect(self, snapshotRef=None, transport=None, readonly=True):
+    def connect(self, snapshotRef=None, transport=None, readonly=True, pool=None):
         """
         Connects the library to the drive using the snapshot reference if provided.
         
         :param snapshotRef: The reference to a snapshot.  This is only needed if we are connecting to a remote disk.
         :param transport: The transport to use.  If not provided, the best match will be selected.
         :param readonly: If true, opens the disk in read only mode.  This is the default.
+        :param pool: A :py:class:`ConnectionPool` to borrow the connection from, instead of
+                     making a new one.  `:py:meth:disconnect` hands it back.
 
         """
+        cdef VixBase lease
+        if pool is not None:
+            if self.connected:
+                raise VixDiskLibError("Already Connected, and trying to connect...")
+            lease = pool.checkout(self.cred, snapshotRef, transport, readonly)
+            self._lease = (pool, lease)
+            self.conn = lease.conn
+            self._read_only = readonly
+            self.connected = True
+            return
         
         if hasattr(self.cred, "host"):
             log.debug("Connecting to %s as %s" % (self.cred.host, self.cred.username))
         cdef char *_transport
         cdef char *_snapshotRef
+        cdef bint _read_only
+        cdef VixError vix_error
+        cdef VixDiskLibConnection conn
+        cdef VixDiskLibConnectParams *params = &(self.params)
         
         if self.connected:
             raise VixDiskLibError("Already Connected, and trying to connect...")
@@ -160,10 +234,31 @@ cdef class VixBase(object):
         if snapshotRef:
             _snapshotRef = snapshotRef
             
-        vix_error = VixDiskLib_ConnectEx(&(self.params), self._read_only, _snapshotRef, _transport, &(self.conn))
+        _read_only = self._read_only
+        
+        # ConnectEx can take seconds against a vCenter, so let other threads run
+        with nogil:
+            vix_error = VixDiskLib_ConnectEx(params, _read_only, _snapshotRef, _transport, &conn)
         if vix_error != VIX_OK:
             self._handleError("Error connecting to %s" % self.params.serverName, vix_error)
             
+        self.conn = conn
+        self.connected = True
+        
+    def share_connection(self, VixBase other):
+        """
+        Uses the connection of another connected instance instead of making one, so that
+        several disks can be open on one connection.  `:py:meth:disconnect` then only
+        detaches; the connection stays with `other`, which must outlive this instance's
+        use of it.
+        """
+        if self.connected:
+            raise VixDiskLibError("Already Connected, and trying to connect...")
+        if not other.connected:
+            raise VixDiskLibError("Can not share a connection that is not connected")
+        self._lease = (None, other)
+        self.conn = other.conn
+        self._read_only = other._read_only
         self.connected = True
         
     def disconnect(self):
@@ -177,7 +272,17 @@ cdef class VixBase(object):
         if not self.connected:
             raise VixDiskLibError("Not Connected, and trying to disconnect...")
         
-        VixDiskLib_Disconnect(self.conn)
+        if self._lease is not None:
+            (pool, lease), self._lease = self._lease, None
+            self.conn = NULL
+            self.connected = False
+            if pool is not None:
+                pool.checkin(lease)
+            return
+        
+        cdef VixDiskLibConnection conn = self.conn
+        with nogil:
+            VixDiskLib_Disconnect(conn)
         
         # clean up after disconnecting just in case...
         self.cleanup()
@@ -211,7 +316,203 @@ cdef class VixBase(object):
                 doc="The location of the vix-disklib libraries.")
     config = property(_getconfig, _setconfig,
                 doc="The location of the vix-disklib configuration file.")
-        
-        
-        
-        
+
+
+class PooledConnection(VixBase):
+    """ A connection owned by a :py:class:`ConnectionPool` """
+    pass
+
+
+class PoolStats(object):
+    """ Counts what a ConnectionPool did """
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.unhealthy = 0
+        self.waits = 0
+
+    def __repr__(self):
+        return "<PoolStats created=%d reused=%d expired=%d unhealthy=%d waits=%d>" % (
+            self.created, self.reused, self.expired, self.unhealthy, self.waits)
+
+
+class ConnectionPool(object):
+    """
+    Keeps connections open between uses.  A vCenter connect (authentication and
+    transport negotiation) costs seconds, and a job typically opens many disks of the
+    same snapshot, and many VMs on the same host.
+
+    Connections are keyed by the credential fields, snapshotRef, transport and
+    readonly flag.  Use :py:meth:`checkout` and :py:meth:`checkin` directly, or pass
+    the pool to :py:meth:`VixBase.connect` or :py:meth:`VixDiskBase.open`.
+
+    :param libdir: The location of the vix-disklib libraries.
+    :param config: The location of the vix-disklib configuration file.
+    :param max_idle: Seconds a connection may sit unused before it is closed.
+    :param max_per_host: The most connections, busy or idle, to any one host.  A
+                         checkout beyond that waits for a checkin.
+    :param health_check: Called as health_check(connection) before an idle connection
+                         is handed out; connections it returns False for are closed.
+    """
+    def __init__(self, libdir=None, config=None, max_idle=300, max_per_host=8, health_check=None):
+        self.libdir = libdir
+        self.config = config
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.health_check = health_check
+        self.stats = PoolStats()
+        self.closed = False
+        self._idle = {}       # key -> [(last used, connection), ...]
+        self._hosts = {}      # host -> connections open, busy or idle
+        self._keys = {}       # id(connection) -> key
+        self._dropped = []
+        self._lock = threading.Condition()
+
+    @staticmethod
+    def key(credentials, snapshotRef=None, transport=None, readonly=True):
+        """ The pool key for a connection """
+        if not credentials:
+            return (None, None, None, None, snapshotRef, transport, bool(readonly))
+        vmxSpec = credentials.vmxSpec
+        if vmxSpec and not vmxSpec.startswith("moref="):
+            vmxSpec = "moref=" + vmxSpec
+        return (vmxSpec, credentials.host, credentials.username, credentials.password,
+                snapshotRef, transport, bool(readonly))
+
+    def idle(self):
+        """ Returns the number of idle connections """
+        with self._lock:
+            return sum(len(conns) for conns in self._idle.values())
+
+    def checkout(self, credentials=None, snapshotRef=None, transport=None, readonly=True, timeout=None):
+        """
+        Returns a connected :py:class:`PooledConnection`, reusing an idle one if there is
+        one for the same key, or making a new one.
+
+        :param timeout: Seconds to wait when the host is at `max_per_host`, None for ever.
+        """
+        key = self.key(credentials, snapshotRef, transport, readonly)
+        host = key[1]
+        deadline = None if timeout is None else time.time() + timeout
+
+        try:
+            with self._lock:
+                while True:
+                    if self.closed:
+                        raise VixDiskLibError("Connection pool is closed")
+                    self._expire()
+                    conn = self._reuse(key)
+                    if conn is not None:
+                        return conn
+                    if self._hosts.get(host, 0) < self.max_per_host:
+                        self._hosts[host] = self._hosts.get(host, 0) + 1
+                        break
+                    # make room by closing an idle connection to the same host for another key
+                    if self._evict(host):
+                        continue
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise VixDiskLibError("Timed out waiting for a connection to %s" % host)
+                    self.stats.waits += 1
+                    self._lock.wait(remaining)
+        finally:
+            self._close_dropped()
+
+        # connect outside the lock, it can take seconds
+        try:
+            conn = PooledConnection(credentials, self.libdir, self.config)
+            conn.connect(snapshotRef, transport, readonly)
+        except:
+            with self._lock:
+                self._hosts[host] -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._keys[id(conn)] = key
+            self.stats.created += 1
+        return conn
+
+    def checkin(self, conn, discard=False):
+        """
+        Hands a connection back to the pool.
+
+        :param discard: Close the connection rather than keep it, for instance after an
+                        error that may have broken it.
+        """
+        with self._lock:
+            key = self._keys.get(id(conn))
+            if key is None:
+                raise VixDiskLibError("Connection does not belong to this pool")
+            if discard or self.closed or not conn.connected:
+                self._drop(key, conn)
+            else:
+                self._idle.setdefault(key, []).append((time.time(), conn))
+            self._expire()
+            self._lock.notify_all()
+        self._close_dropped()
+
+    def prune(self):
+        """ Closes the connections that have been idle longer than `max_idle` """
+        with self._lock:
+            self._expire()
+            self._lock.notify_all()
+        self._close_dropped()
+
+    def close(self):
+        """
+        Closes every idle connection.  Connections still checked out are closed when
+        they are checked in.
+        """
+        with self._lock:
+            self.closed = True
+            for key, conns in self._idle.items():
+                for _, conn in conns:
+                    self._drop(key, conn)
+            self._idle.clear()
+            self._lock.notify_all()
+        self._close_dropped()
+
+    def _reuse(self, key):
+        conns = self._idle.get(key)
+        while conns:
+            _, conn = conns.pop()
+            if self.health_check is None or self.health_check(conn):
+                self.stats.reused += 1
+                return conn
+            self.stats.unhealthy += 1
+            self._drop(key, conn)
+        return None
+
+    def _evict(self, host):
+        for key, conns in self._idle.items():
+            if key[1] == host and conns:
+                _, conn = conns.pop(0)
+                self._drop(key, conn)
+                return True
+        return False
+
+    def _expire(self):
+        if self.max_idle is None:
+            return
+        oldest = time.time() - self.max_idle
+        for key, conns in self._idle.items():
+            while conns and conns[0][0] < oldest:
+                _, conn = conns.pop(0)
+                self.stats.expired += 1
+                self._drop(key, conn)
+
+    def _drop(self, key, conn):
+        # disconnecting can be slow, so it is done by _close_dropped once the lock is released
+        del self._keys[id(conn)]
+        self._hosts[key[1]] -= 1
+        self._dropped.append(conn)
+
+    def _close_dropped(self):
+        with self._lock:
+            dropped, self._dropped = self._dropped, []
+        for conn in dropped:
+            try:
+                conn.finalize()
+            except VixDiskLibError, e:
+                log.warning("Error closing pooled connection: %s" % e)
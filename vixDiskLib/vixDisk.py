@@ -2,20 +2,243 @@
 :author: eplaster
 '''
 
+import numpy as np
+
 from vixDiskLib.vixExceptions import VixDiskLibError
-from vixDiskBase import VixDiskBase
+from vixDiskLib.extents import normalize, split, DEFAULT_MAX_IO, DEFAULT_MAX_GAP
+from vixDiskLib.prefetch import ReadAhead
+from vixDiskLib.cache import BlockCache
+from vixDiskLib.writebuffer import WriteBuffer
+from vixDiskLib.zeros import ZeroStats, zero_mask, data_runs
+from vixDiskBase import VixDiskBase, DEFAULT_ALLOCATION_CHUNK
         
 class VixDisk(VixDiskBase):
-    """ A file IO interface to the vixDiskLib SDK """
+    """
+    A file IO interface to the vixDiskLib SDK
+    
+    Takes the same arguments as :py:class:`VixDiskBase`, plus:
+    
+    :param cache_size: When non zero, `read()` goes through a block cache (see
+                       :py:mod:`vixDiskLib.cache`) holding up to this many bytes.  Its
+                       counters are in `cache.stats`.
+    :param write_buffer_size: When non zero, `write()` and `write_from()` go through a
+                       staging buffer of this many bytes (see :py:mod:`vixDiskLib.writebuffer`)
+                       that merges sequential writes.  It is flushed on a gap, by `flush()`,
+                       before any read and on `close()`; write errors are raised from there.
+                       Its counters are in `write_buffer.stats`.
+    :param skip_zeros: When True, the all zero blocks passed to `write()` and
+                       `write_from()` are not written, for restores onto freshly created
+                       (so already zero) disks.  What was skipped is counted in `zero_stats`.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        cache_size = kwargs.pop('cache_size', 0)
+        write_buffer_size = kwargs.pop('write_buffer_size', 0)
+        self.skip_zeros = kwargs.pop('skip_zeros', False)
+        super(VixDisk, self).__init__(*args, **kwargs)
+        self.zero_stats = ZeroStats()
+        self.cache = BlockCache(cache_size, self.block_size) if cache_size else None
+        self.write_buffer = None
+        if write_buffer_size:
+            self.write_buffer = WriteBuffer(super(VixDisk, self).write_from, write_buffer_size, self.block_size)
+    
+    def flush(self):
+        """
+        Writes out anything held in the write buffer.
+        """
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+    
+    def read(self, offset, nblocks=1):
+        """
+        Reads a block range, see :py:meth:`VixDiskBase.read`.  With a cache, blocks are
+        served from it when possible, only the missing runs are read from the disk, and a
+        new np.ndarray is returned every time.
+        """
+        self.flush()
+        cache = self.cache
+        if cache is None or nblocks * self.block_size > cache.capacity:
+            return super(VixDisk, self).read(offset, nblocks)
+        if cache.block_size != self.block_size:
+            cache.clear(self.block_size)
+        
+        size = self.block_size
+        out = np.empty(nblocks * size, dtype=np.uint8)
+        missing = None
+        for i in xrange(nblocks):
+            data = cache.get(offset + i)
+            if data is None:
+                if missing is None:
+                    missing = i
+                continue
+            out[i * size:(i + 1) * size] = data
+            if missing is not None:
+                self._fill(out, offset, missing, i)
+                missing = None
+        if missing is not None:
+            self._fill(out, offset, missing, nblocks)
+        return out
+    
+    def _fill(self, out, offset, first, last):
+        """ Reads blocks [first, last) of a cached read from the disk, and caches them """
+        size = self.block_size
+        self.read_into(offset + first, out[first * size:last * size])
+        for i in xrange(first, last):
+            self.cache.put(offset + i, out[i * size:(i + 1) * size])
+    
+    def read_into(self, offset, buffer):
+        self.flush()
+        return super(VixDisk, self).read_into(offset, buffer)
+    read_into.__doc__ = VixDiskBase.read_into.__doc__
+    
+    def read_extents(self, extents, out=None, max_io=DEFAULT_MAX_IO, max_gap=DEFAULT_MAX_GAP):
+        self.flush()
+        return super(VixDisk, self).read_extents(extents, out, max_io, max_gap)
+    read_extents.__doc__ = VixDiskBase.read_extents.__doc__
+    
+    def write(self, offset, nblocks, buff):
+        if self.cache is not None:
+            self.cache.invalidate(offset, nblocks)
+        if self.write_buffer is None and not self.skip_zeros:
+            return super(VixDisk, self).write(offset, nblocks, buff)
+        self._write_blocks(offset, buff[:nblocks * self.block_size])
+    write.__doc__ = VixDiskBase.write.__doc__
+    
+    def write_from(self, offset, buffer):
+        if self.cache is not None:
+            self.cache.invalidate(offset, np.frombuffer(buffer, dtype=np.uint8).size // self.block_size)
+        if self.write_buffer is None and not self.skip_zeros:
+            return super(VixDisk, self).write_from(offset, buffer)
+        return self._write_blocks(offset, buffer)
+    write_from.__doc__ = VixDiskBase.write_from.__doc__
+    
+    def _write_blocks(self, offset, buffer):
+        """ Writes through the write buffer and/or around zero blocks """
+        if not self.opened:
+            raise VixDiskLibError("Need to open a disk before writing to it")
+        size = self.block_size
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        if data.size % size:
+            raise VixDiskLibError("Buffer size %d is not a multiple of the block size %d" % (data.size, size))
+        
+        runs = [(0, data.size // size)]
+        if self.skip_zeros:
+            mask = zero_mask(data, size)
+            self.zero_stats.count(mask, size)
+            runs = data_runs(mask)
+        
+        staging = self.write_buffer
+        if staging is not None and staging.block_size != size:
+            staging.flush()
+            staging = self.write_buffer = WriteBuffer(staging.writer, staging.buff.size, size)
+        for first, count in runs:
+            chunk = data[first * size:(first + count) * size]
+            if staging is not None:
+                staging.write(offset + first, chunk)
+            else:
+                super(VixDisk, self).write_from(offset + first, chunk)
+        return data.size
+    
+    def write_extents(self, extents, data, max_io=DEFAULT_MAX_IO):
+        self.flush()
+        if self.cache is not None:
+            spb = self.sectors_per_block
+            for start, length in normalize(extents).tolist():
+                first = start // spb
+                self.cache.invalidate(first, (start + length + spb - 1) // spb - first)
+        return super(VixDisk, self).write_extents(extents, data, max_io)
+    write_extents.__doc__ = VixDiskBase.write_extents.__doc__
     
-    def iter(self, nblocks=1):
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.cache is not None:
+                self.cache.clear()
+            super(VixDisk, self).close()
+    close.__doc__ = VixDiskBase.close.__doc__
+    
+    def iter(self, nblocks=1, prefetch=0):
         """
         Returns an iterator that will read from the currently open disk using `nblocks`
+        
+        :param nblocks: The number of blocks per read.
+        :param prefetch: When non zero, a worker thread keeps up to this many reads in
+                         flight ahead of the consumer, so that reading overlaps with
+                         whatever the consumer does with the data.  How often either side
+                         had to wait is kept in `prefetch_stats`.
+        :return: np.ndarray of bytes per read.  The array is reused, so copy it if it is
+                 needed after the next iteration.
+        """
+        if not self.opened:
+            raise VixDiskLibError("Disk must be open to use the generator method")
+        
+        blocks = self.info()['capacity'] / self.sectors_per_block
+        if not prefetch:
+            return self._iter_blocks(blocks, nblocks)
+        
+        items = [(b, min(nblocks, blocks - b) * self.block_size) for b in xrange(0, blocks, nblocks)]
+        ahead = ReadAhead(self.read_into, items, nblocks * self.block_size, prefetch)
+        self.prefetch_stats = ahead.stats
+        return (buff for _, buff in ahead)
+    
+    def iter_nonzero(self, nblocks=1, prefetch=0):
+        """
+        Like :py:meth:`iter`, but leaves out the blocks that are all zeros, counting them
+        in `zero_stats`.  To export to a sparse file, seek to each block and write it,
+        then truncate the file to the disk size; the zero blocks are left as holes.
+        
+        :param nblocks: The number of blocks per read.
+        :param prefetch: The read-ahead depth, see :py:meth:`iter`.
+        :return: (block, np.ndarray) pairs, one per run of blocks holding data.  The
+                 array is reused, so copy it if it is needed after the next iteration.
+        """
+        size = self.block_size
+        block = 0
+        for buff in self.iter(nblocks, prefetch):
+            mask = zero_mask(buff, size)
+            self.zero_stats.count(mask, size)
+            for first, count in data_runs(mask):
+                yield block + first, buff[first * size:(first + count) * size]
+            block += nblocks
+    
+    def _iter_blocks(self, blocks, nblocks):
+        for b in xrange(0, blocks, nblocks):
+            yield self.read(b, min(nblocks, blocks - b))
+    
+    def iter_changed(self, change_set, max_io=DEFAULT_MAX_IO):
+        """
+        Returns an iterator that reads only the sectors in `change_set`, typically the
+        result of :py:meth:`vixDiskLib.cbt.ChangeSource.changed_extents`.
+        
+        :param change_set: An extent list of (start_sector, nsectors) pairs.
+        :param max_io: The largest read to issue, in sectors.
+        :return: (start_sector, np.ndarray) pairs.  The array is reused, so copy it if it
+                 is needed after the next iteration.
+        """
+        return self._iter_extents(normalize(change_set), max_io)
+    
+    def iter_allocated(self, max_io=DEFAULT_MAX_IO, chunk=DEFAULT_ALLOCATION_CHUNK):
+        """
+        Returns an iterator that reads only the allocated parts of the disk, skipping the
+        unallocated space of thin and sparse disks (see :py:meth:`VixDiskBase.query_allocated`).
+        
+        :param max_io: The largest read to issue, in sectors.
+        :param chunk: The allocation granularity to query with, in sectors.
+        :return: (start_sector, np.ndarray) pairs.  The array is reused, so copy it if it
+                 is needed after the next iteration.
         """
-        if not self.open:
+        if not self.opened:
             raise VixDiskLibError("Disk must be open to use the generator method")
         
-        _info = self.info()
-        for b in xrange(0, _info['blocks'], step=nblocks):
-            yield self.read(b, nblocks)
+        return self._iter_extents(self.query_allocated(chunk=chunk), max_io)
     
+    def _iter_extents(self, extents, max_io):
+        if not self.opened:
+            raise VixDiskLibError("Disk must be open to use the generator method")
+        
+        buff = np.empty(max_io * 512, dtype=np.uint8)
+        for start, length in split(extents, max_io).tolist():
+            data = buff[:length * 512]
+            self.read_extents([(start, length)], data)
+            yield start, data
@@ -1,6 +1,8 @@
 
 import logging, os.path
 from vixDiskLib.vixExceptions import VixDiskLibError, VixDiskUnimplemented
+from vixDiskLib.extents import as_extents, coalesce, normalize, DEFAULT_MAX_IO, DEFAULT_MAX_GAP
+from vixDiskLib.backends import get_backend
 
 from common cimport *
 from vddk cimport *
@@ -27,22 +29,57 @@ cdef uint32 SECTORS_PER_BLOCK   = DEFAULT_BLOCK_SIZE/VIXDISKLIB_SECTOR_SIZE
 cdef unsigned short TRUE = 1
 cdef unsigned short FALSE = 0
 
+# smallest chunk size VixDiskLib_QueryAllocatedBlocks accepts (64KB)
+DEFAULT_ALLOCATION_CHUNK = 128
+# sectors per VixDiskLib_QueryAllocatedBlocks call, keeps the returned lists small (1GB)
+cdef VixDiskLibSectorType ALLOCATION_QUERY_SECTORS = 2097152
+
+# only present in newer libraries, NULL otherwise
+cdef QueryAllocatedBlocksFunc query_allocated_blocks = <QueryAllocatedBlocksFunc>vix_lookup_symbol(
+            <void *>VixDiskLib_Read, "VixDiskLib_QueryAllocatedBlocks")
+cdef FreeBlockListFunc free_block_list = <FreeBlockListFunc>vix_lookup_symbol(
+            <void *>VixDiskLib_Read, "VixDiskLib_FreeBlockList")
+
 cdef truth(value):
     if value:
         return TRUE
     return FALSE
 
+cdef unsigned char[::1] writable_view(object buf) except *:
+    # python 2's mmap (and buffer) only speak the old buffer protocol, numpy bridges them
+    try:
+        return buf
+    except (TypeError, ValueError):
+        return np.frombuffer(buf, dtype=DTYPE)
+
+cdef const unsigned char[::1] readable_view(object buf) except *:
+    try:
+        return buf
+    except (TypeError, ValueError):
+        return np.frombuffer(buf, dtype=DTYPE)
+
 cdef class VixDiskBase(VixBase):
-    """ A file IO interface to the vixDiskLib SDK """
+    """
+    A file IO interface to the vixDiskLib SDK
+    
+    :param backend: A storage backend (see :py:mod:`vixDiskLib.backends`), or the name
+                    of one, such as "flat".  Disks are then opened, read and written
+                    through it, and the library is never initialized or connected.
+    """
     
     cdef VixDiskLibHandle handle
     cdef np.ndarray buff
+    cdef readonly object backend
     
-    def __init__(self, credentials=None, libdir=None, config=None, block_size=DEFAULT_BLOCK_SIZE, callback=None):
+    def __init__(self, credentials=None, libdir=None, config=None, block_size=DEFAULT_BLOCK_SIZE, callback=None, backend=None):
+        # before VixBase initializes the library, which a backend does not need
+        if backend is not None:
+            self.backend = get_backend(backend)
         super(VixDiskBase, self).__init__(credentials, libdir, config, callback)
         
         self.vmdk_path = None
         self.opened = False
+        self._borrowed = False
         self._transport_mode = None
         self._block_size = block_size
         self.sectors_per_block = self._block_size / VIXDISKLIB_SECTOR_SIZE
@@ -66,6 +103,8 @@ cdef class VixDiskBase(VixBase):
         """
         if not self.opened:
             raise VixDiskLibError("Transport mode is not available until a disk is opened.")
+        if self.backend is not None:
+            return [self.backend.transport_mode]
         return VixDiskLib_ListTransportModes().split(":")
     available_modes = property(getAvailableTransportModes)
     
@@ -79,14 +118,72 @@ cdef class VixDiskBase(VixBase):
     
     block_size = property(_getblocksize, _setblocksize,
                 doc="The block size.")
+    
+    def initialize(self):
+        """
+        Takes a reference on the vix-disklib library, see :py:meth:`VixBase.initialize`.
+        Does nothing with a backend.
+        """
+        if self.backend is None:
+            VixBase.initialize(self)
+    
+    def connect(self, snapshotRef=None, transport=None, readonly=True, pool=None):
+        """
+        Connects the library to the drive, see :py:meth:`VixBase.connect`.  With a
+        backend this only sets the access mode.
+        """
+        if self.backend is None:
+            return VixBase.connect(self, snapshotRef, transport, readonly, pool)
+        if self.connected:
+            raise VixDiskLibError("Already Connected, and trying to connect...")
+        if pool is not None:
+            raise VixDiskLibError("Connection pools are not used with the %s backend" % self.backend.name)
+        self._read_only = readonly
+        self.connected = True
+    
+    def disconnect(self):
+        """
+        Disconnects the library from the drive, see :py:meth:`VixBase.disconnect`.
+        """
+        if self.backend is None:
+            return VixBase.disconnect(self)
+        if not self.connected:
+            raise VixDiskLibError("Not Connected, and trying to disconnect...")
+        self.connected = False
+    
+    def _library_only(self, what):
+        if self.backend is not None:
+            raise VixDiskUnimplemented("%s is not supported by the %s backend" % (what, self.backend.name))
 
-    def open(self, path, single=False):
+    def open(self, path, single=False, pool=None, snapshotRef=None, transport=None, readonly=True):
         """
         Open a vmdk for editing or reading (see readonly)
         
         :param path: Path to the vmdk.  Example: [System-Disk] DEV-BOX-01/DEV-BOX-01.vmdk
         :param single: Open the disk in single mode.
-        """
+        :param pool: A :py:class:`vixDiskLib.vixBase.ConnectionPool`.  If not connected
+                     yet, a connection for `snapshotRef`, `transport` and `readonly` is
+                     borrowed from it (see :py:meth:`VixBase.connect`), and handed back
+                     by :py:meth:`close`.
+        """
+        cdef uint32 _flag
+        cdef char *_path
+        cdef VixError vix_error
+        cdef VixDiskLibConnection conn
+        cdef VixDiskLibHandle handle
+        
+        if pool is not None and not self.connected and not self.opened:
+            self.connect(snapshotRef, transport, readonly, pool=pool)
+            self._borrowed = True
+            try:
+                self.open(path, single)
+            except:
+                self._borrowed = False
+                self.disconnect()
+                raise
+            return
+        
+        conn = self.conn
         self.vmdk_path = path
         
         if not self.connected:
@@ -95,6 +192,13 @@ cdef class VixDiskBase(VixBase):
         if self.opened:
             raise VixDiskLibError("Currently have disk %s opened.  Can not open another drive until this one is closed." % self.vmdk_path)
         
+        if self.backend is not None:
+            self.backend.open(path, self.readonly)
+            self.opened = True
+            self._allocation_supported = True
+            self._transport_mode = self.backend.transport_mode
+            return
+        
         if self.readonly:
             _flag = VIXDISKLIB_FLAG_OPEN_READ_ONLY
         else:
@@ -103,10 +207,15 @@ cdef class VixDiskBase(VixBase):
                 _flag |= VIXDISKLIB_FLAG_OPEN_SINGLE_LINK
         log.debug("Opening drive: [flags: %d] %s" % (_flag, self.vmdk_path))
         
-        vix_error = VixDiskLib_Open(self.conn, self.vmdk_path, _flag, &(self.handle))
+        # self.vmdk_path keeps the string (and so _path) alive while the GIL is released
+        _path = PyString_AsString(self.vmdk_path)
+        with nogil:
+            vix_error = VixDiskLib_Open(conn, _path, _flag, &handle)
         if vix_error != VIX_OK:
             self._handleError("Error opening %s" % self.vmdk_path, vix_error)
+        self.handle = handle
         self.opened = True
+        self._allocation_supported = True
         
         self._transport_mode = VixDiskLib_GetTransportMode(self.handle)
         
@@ -119,18 +228,31 @@ cdef class VixDiskBase(VixBase):
         if not self.opened:
             raise VixDiskLibError("Need to open a disk before closing it")
         
-        vix_error = VixDiskLib_Close(self.handle)
-        if vix_error != VIX_OK:
-            self._handleError("Error closing the disk", vix_error)
+        cdef VixError vix_error
+        cdef VixDiskLibHandle handle = self.handle
+        if self.backend is not None:
+            self.backend.close()
+        else:
+            with nogil:
+                vix_error = VixDiskLib_Close(handle)
+            if vix_error != VIX_OK:
+                self._handleError("Error closing the disk", vix_error)
+        self.handle = NULL
         self.opened = False
         self._transport_mode = None
         
+        if self._borrowed:
+            self._borrowed = False
+            self.disconnect()
+        
     def reopen(self):
         """
-        Closes and re-opens the current disk.
+        Closes and re-opens the current disk, keeping a borrowed connection.
         """
+        borrowed, self._borrowed = self._borrowed, False
         self.close()
         self.open(self.vmdk_path)
+        self._borrowed = borrowed
         
     def info(self):
         """
@@ -140,14 +262,16 @@ cdef class VixDiskBase(VixBase):
         if not self.opened:
             raise VixDiskLibError("Need to open a disk before calling getInfo")
         
+        if self.backend is not None:
+            pyinfo = self.backend.info()
+            pyinfo['blocks'] = pyinfo['capacity'] / SECTORS_PER_BLOCK
+            return pyinfo
+        
         cdef VixDiskLibInfo *info
         vix_error = VixDiskLib_GetInfo(self.handle, &info)
         if vix_error != VIX_OK:
-            VixDiskLib_FreeInfo(info)
             self._handleError("Error getting info for: %s" % self.vmdk_path, vix_error)
             
-        VixDiskLib_FreeInfo(info)
-        
         biosGeo = {
             "cylinders": info.biosGeo.cylinders, 
             "heads": info.biosGeo.heads, 
@@ -165,15 +289,100 @@ cdef class VixDiskBase(VixBase):
             'adapterType': info.adapterType,
             'links' : info.numLinks,
             'blocks' : info.capacity / SECTORS_PER_BLOCK}
+        VixDiskLib_FreeInfo(info)
         return pyinfo
         
+    def query_allocated(self, start=0, count=None, chunk=DEFAULT_ALLOCATION_CHUNK):
+        """
+        Returns the allocated parts of a sector range, so that unallocated space on thin
+        and sparse disks does not have to be read.
+        
+        This uses VixDiskLib_QueryAllocatedBlocks when the library provides it.  When it
+        does not (older libraries, or disks and transports it does not support), the whole
+        range is reported as allocated; check `allocation_supported` to tell the two apart.
+        
+        :param start: The first sector of the range.
+        :param count: The number of sectors in the range, defaults to the rest of the disk.
+        :param chunk: The allocation granularity to query with, in sectors (at least 128).
+        :return: A sorted extent list of (start_sector, nsectors) pairs.
+        """
+        cdef VixDiskLibHandle handle = self.handle
+        cdef VixDiskLibSectorType offset, end, aligned_end, length
+        cdef VixDiskLibSectorType _chunk
+        cdef AllocatedBlockList *blocks
+        cdef VixError vix_error
+        cdef uint32 i
+        
+        if not self.opened:
+            raise VixDiskLibError("Need to open a disk before querying allocated blocks")
+        if chunk < DEFAULT_ALLOCATION_CHUNK:
+            raise VixDiskLibError("The allocation chunk must be at least %d sectors, not %d" % (DEFAULT_ALLOCATION_CHUNK, chunk))
+        _chunk = chunk
+        
+        capacity = self.info()['capacity']
+        if count is None:
+            count = capacity - start
+        if start + count > capacity:
+            raise VixDiskLibError("Sectors %d-%d are past the end of the disk (%d)" % (start, start + count, capacity))
+        if count == 0:
+            return as_extents([])
+        
+        if not self.allocation_supported:
+            return as_extents([(start, count)])
+        
+        if self.backend is not None:
+            return as_extents(self.backend.allocated(start, count))
+        
+        # the query only takes chunk aligned ranges, anything outside them counts as allocated
+        extents = []
+        offset = (start // chunk) * chunk
+        end = start + count
+        aligned_end = min(((end + chunk - 1) // chunk) * chunk, (capacity // chunk) * chunk)
+        if aligned_end < end:
+            extents.append((aligned_end, end - aligned_end))
+        
+        while offset < aligned_end:
+            # whole chunks per call, and at least one
+            length = min(max(_chunk, ALLOCATION_QUERY_SECTORS - ALLOCATION_QUERY_SECTORS % _chunk), aligned_end - offset)
+            with nogil:
+                vix_error = query_allocated_blocks(handle, offset, length, _chunk, &blocks)
+            if vix_error == VIX_E_NOT_SUPPORTED or vix_error == VIX_E_DISK_NOTSUPPORTED:
+                log.debug("Allocated block queries are not supported for %s" % self.vmdk_path)
+                self._allocation_supported = False
+                return as_extents([(start, count)])
+            if vix_error != VIX_OK:
+                self._handleError("Error querying allocated blocks: %s" % self.vmdk_path, vix_error)
+            
+            for i in range(blocks.numBlocks):
+                extents.append((blocks.blocks[i].offset, blocks.blocks[i].length))
+            free_block_list(blocks)
+            offset += length
+        
+        # trim the chunk aligned answer back down to the range asked for
+        result = []
+        for ext_start, ext_length in normalize(extents).tolist():
+            ext_end = min(ext_start + ext_length, end)
+            ext_start = max(ext_start, start)
+            if ext_start < ext_end:
+                result.append((ext_start, ext_end - ext_start))
+        return as_extents(result)
+    
+    def _getallocationsupported(self):
+        if self.backend is not None:
+            return self.backend.allocation_supported
+        return query_allocated_blocks != NULL and getattr(self, '_allocation_supported', True)
+    
+    allocation_supported = property(_getallocationsupported,
+                doc="False when query_allocated can not tell allocated from unallocated space.")
+    
     def read(self, VixDiskLibSectorType offset, uint32 nblocks=1):
         """
         Reads a sector range.
         
         :param offset: Absolute offset.
         :param nblocks: Number of blocks to read.
-        :return: np.ndarray of bytes
+        :return: np.ndarray of bytes.  With a backend that maps the disk (such as
+                 "mmap"), a read only view of the mapped file rather than a copy.
         
         Note: SECTORS_PER_BLOCK = DEFAULT_BLOCK_SIZE (1048576 or 1MB) / VIXDISKLIB_SECTOR_SIZE (512)
               SECTORS_PER_BLOCK = 2048 sectors
@@ -185,21 +394,36 @@ cdef class VixDiskBase(VixBase):
         sectors_to_read = (nblocks * self.sectors_per_block)  # number of sectors to read
         sector_offset = offset * self.sectors_per_block       # from blocks to sectors
         
+        if self.backend is not None and hasattr(self.backend, "view"):
+            return self.backend.view(sector_offset, sectors_to_read)
+        
         nbytes = (sectors_to_read * VIXDISKLIB_SECTOR_SIZE)
         
-        if self.buff == None:
-            self.buff = np.empty(nbytes, dtype=DTYPE)
-            
-        if self.buff.size != nbytes:
+        if self.buff is None or self.buff.size != nbytes:
+            # a new array rather than resize(), the caller may still hold the old one
             log.debug("Resizing buffer to %d" % nbytes)
-            self.buff.resize(nbytes)
-            
-        vix_error = VixDiskLib_Read(self.handle, sector_offset, sectors_to_read, <uint8 *>self.buff.data)
-        if vix_error != VIX_OK:
-            self._handleError("Error reading the disk: %s" % self.vmdk_path, vix_error)
+            self.buff = np.empty(nbytes, dtype=DTYPE)
             
+        self._read_sectors(sector_offset, sectors_to_read, <uint8 *>self.buff.data)
         return self.buff
     
+    def read_into(self, VixDiskLibSectorType offset, object buffer):
+        """
+        Reads whole blocks straight into a caller supplied buffer, without going
+        through the internal buffer used by `:py:meth:VixDiskBase.read`.
+        
+        :param offset: Absolute offset, in blocks.
+        :param buffer: Any writable, contiguous buffer (bytearray, mmap, numpy array, ...).
+                    Its length must be a multiple of the block size, and decides how
+                    many blocks are read.
+        :return: The number of bytes read.
+        """
+        cdef unsigned char[::1] buf = writable_view(buffer)
+        cdef VixDiskLibSectorType nblocks = self._buffer_blocks(buf.shape[0])
+        
+        self._read_sectors(offset * self.sectors_per_block, nblocks * self.sectors_per_block, &buf[0])
+        return buf.shape[0]
+    
     def write(self, VixDiskLibSectorType offset, VixDiskLibSectorType nblocks, np.ndarray[dtype=DTYPE_t] buff):
         """
         Writes a sector range.
@@ -220,9 +444,166 @@ cdef class VixDiskBase(VixBase):
         
         #nbytes = (sectors_to_write * VIXDISKLIB_SECTOR_SIZE)
        
-        vix_error = VixDiskLib_Write(self.handle, sector_offset, sectors_to_write, <uint8 *>buff.data)
+        self._write_sectors(sector_offset, sectors_to_write, <uint8 *>buff.data)
+    
+    def write_from(self, VixDiskLibSectorType offset, object buffer):
+        """
+        Writes whole blocks straight from a caller supplied buffer.
+        
+        :param offset: Absolute offset, in blocks.
+        :param buffer: Any contiguous buffer (str, bytearray, mmap, numpy array, ...).
+                    Its length must be a multiple of the block size, and decides how
+                    many blocks are written.
+        :return: The number of bytes written.
+        """
+        cdef const unsigned char[::1] buf = readable_view(buffer)
+        cdef VixDiskLibSectorType nblocks = self._buffer_blocks(buf.shape[0])
+        
+        self._write_sectors(offset * self.sectors_per_block, nblocks * self.sectors_per_block, <uint8 *>&buf[0])
+        return buf.shape[0]
+    
+    def read_extents(self, extents, out=None, max_io=DEFAULT_MAX_IO, max_gap=DEFAULT_MAX_GAP):
+        """
+        Reads a list of sector extents using as few library calls as possible.  Extents
+        are sorted and merged into runs of at most `max_io` sectors, reading through holes
+        of up to `max_gap` sectors, and the data is then scattered back out.
+        
+        :param extents: A sequence or (N, 2) array of (start_sector, nsectors) pairs.
+        :param out: Where the data goes.  Either a single buffer that receives the extents
+                    back to back in the order given, or a sequence of buffers with one
+                    per extent.  If not given, a new np.ndarray is allocated.
+        :param max_io: The largest merged read, in sectors.
+        :param max_gap: The largest hole to read through, in sectors.
+        :return: `out`, or the new np.ndarray.
+        """
+        cdef unsigned char[::1] view
+        cdef np.ndarray scratch = None
+        
+        extents = as_extents(extents)
+        if out is None:
+            out = np.empty(int(extents[:, 1].sum()) * VIXDISKLIB_SECTOR_SIZE, dtype=DTYPE)
+        dests = self._extent_buffers(extents, out, writable=True)
+        
+        runs, members = coalesce(extents, max_io, max_gap)
+        for (start, length), indexes in zip(runs.tolist(), members):
+            if length == 0:
+                continue
+            if len(indexes) == 1:
+                # nothing to scatter, read straight into the caller's buffer
+                view = dests[indexes[0]]
+                self._read_sectors(start, length, &view[0])
+                continue
+            
+            nbytes = length * VIXDISKLIB_SECTOR_SIZE
+            if scratch is None or scratch.size < nbytes:
+                scratch = np.empty(nbytes, dtype=DTYPE)
+            self._read_sectors(start, length, <uint8 *>scratch.data)
+            for index in indexes:
+                offset = (int(extents[index, 0]) - start) * VIXDISKLIB_SECTOR_SIZE
+                dest = dests[index]
+                dest[:] = scratch[offset:offset + dest.size]
+        return out
+    
+    def write_extents(self, extents, data, max_io=DEFAULT_MAX_IO):
+        """
+        Writes a list of sector extents using as few library calls as possible.  Extents
+        that are exactly adjacent are gathered into runs of at most `max_io` sectors.
+        
+        :param extents: A sequence or (N, 2) array of (start_sector, nsectors) pairs.
+        :param data: Either a single buffer holding the extents back to back in the order
+                     given, or a sequence of buffers with one per extent.
+        :param max_io: The largest merged write, in sectors.
+        """
+        cdef const unsigned char[::1] view
+        cdef np.ndarray scratch = None
+        
+        extents = as_extents(extents)
+        sources = self._extent_buffers(extents, data, writable=False)
+        
+        runs, members = coalesce(extents, max_io, 0)
+        for (start, length), indexes in zip(runs.tolist(), members):
+            if length == 0:
+                continue
+            if len(indexes) == 1:
+                view = sources[indexes[0]]
+                self._write_sectors(start, length, <uint8 *>&view[0])
+                continue
+            
+            nbytes = length * VIXDISKLIB_SECTOR_SIZE
+            if scratch is None or scratch.size < nbytes:
+                scratch = np.empty(nbytes, dtype=DTYPE)
+            for index in indexes:
+                offset = (int(extents[index, 0]) - start) * VIXDISKLIB_SECTOR_SIZE
+                source = sources[index]
+                scratch[offset:offset + source.size] = source
+            self._write_sectors(start, length, <uint8 *>scratch.data)
+    
+    def _extent_buffers(self, extents, buffers, writable):
+        """
+        Returns one uint8 np.ndarray per extent, viewing into `buffers`.
+        """
+        nbytes = (extents[:, 1] * VIXDISKLIB_SECTOR_SIZE).tolist()
+        if isinstance(buffers, (list, tuple)):
+            if len(buffers) != len(nbytes):
+                raise VixDiskLibError("Got %d buffers for %d extents" % (len(buffers), len(nbytes)))
+            views = [np.asarray(writable_view(b) if writable else readable_view(b)) for b in buffers]
+        else:
+            whole = np.asarray(writable_view(buffers) if writable else readable_view(buffers))
+            if whole.size != sum(nbytes):
+                raise VixDiskLibError("Buffer length %d does not match the extents (%d bytes)" % (whole.size, sum(nbytes)))
+            bounds = np.cumsum([0] + nbytes).tolist()
+            views = [whole[bounds[i]:bounds[i + 1]] for i in xrange(len(nbytes))]
+        
+        for view, size in zip(views, nbytes):
+            if view.size != size:
+                raise VixDiskLibError("Buffer length %d does not match its extent (%d bytes)" % (view.size, size))
+        return views
+    
+    cdef VixDiskLibSectorType _buffer_blocks(self, Py_ssize_t nbytes) except? 0:
+        """
+        Returns the number of whole blocks held by a buffer of `nbytes` bytes.
+        """
+        if nbytes == 0 or nbytes % self._block_size:
+            raise VixDiskLibError("Buffer length %d is not a multiple of the block size %d" % (nbytes, self._block_size))
+        return nbytes / self._block_size
+    
+    cdef _read_sectors(self, VixDiskLibSectorType sector_offset, VixDiskLibSectorType sectors, uint8 *data):
+        """
+        Reads `sectors` sectors into `data` with the GIL released.
+        """
+        cdef VixDiskLibHandle handle = self.handle
+        cdef VixError vix_error
+        
+        if not self.opened:
+            raise VixDiskLibError("Need to open a disk before reading from it")
+        
+        if self.backend is not None:
+            self.backend.read(sector_offset, sectors, np.asarray(<uint8[:sectors * VIXDISKLIB_SECTOR_SIZE]>data))
+            return
+        
+        with nogil:
+            vix_error = VixDiskLib_Read(handle, sector_offset, sectors, data)
         if vix_error != VIX_OK:
             self._handleError("Error reading the disk: %s" % self.vmdk_path, vix_error)
+    
+    cdef _write_sectors(self, VixDiskLibSectorType sector_offset, VixDiskLibSectorType sectors, uint8 *data):
+        """
+        Writes `sectors` sectors from `data` with the GIL released.
+        """
+        cdef VixDiskLibHandle handle = self.handle
+        cdef VixError vix_error
+        
+        if not self.opened:
+            raise VixDiskLibError("Need to open a disk before writing to it")
+        
+        if self.backend is not None:
+            self.backend.write(sector_offset, sectors, np.asarray(<uint8[:sectors * VIXDISKLIB_SECTOR_SIZE]>data))
+            return
+        
+        with nogil:
+            vix_error = VixDiskLib_Write(handle, sector_offset, sectors, data)
+        if vix_error != VIX_OK:
+            self._handleError("Error writing the disk: %s" % self.vmdk_path, vix_error)
 
     def getMetadata(self):
         """
@@ -234,6 +615,9 @@ cdef class VixDiskBase(VixBase):
         if not self.connected:
             raise VixDiskLibError("Currently not connected, and trying to open vmdk")
         
+        if self.backend is not None:
+            return self.backend.metadata()
+        
         cdef size_t requiredLen
         cdef np.ndarray buffer = np.ndarray(1024, dtype=np.uint8)
         cdef np.ndarray val
@@ -273,6 +657,9 @@ cdef class VixDiskBase(VixBase):
         if not self.connected:
             raise VixDiskLibError("Currently not connected, and trying to open vmdk")
         
+        if self.backend is not None:
+            return self.backend.set_metadata(metadata)
+        
         for name, value in metadata.items():
             vixError = VixDiskLib_WriteMetadata(self.handle, PyString_AsString(name), PyString_AsString(value))
             if vixError != VIX_OK:
@@ -289,7 +676,10 @@ cdef class VixDiskBase(VixBase):
         if not self.connected:
             raise VixDiskLibError("Currently not connected, and trying to open vmdk")
         
-        if self.is_remote:
+        if self.backend is not None:
+            self.backend.create(path, create_params.blocks * self.sectors_per_block, create_params.disk_type,
+                                create_params.adapter_type, create_params.hw_version)
+        elif self.is_remote:
             self._create_remote(path, local_path, create_params)
         else:
             self._create_local(path, create_params)
@@ -319,6 +709,10 @@ cdef class VixDiskBase(VixBase):
     def _create_remote(self, dest_path, local_path, create_params):
         cdef VixDiskLibCreateParams params
         cdef VixDiskLibHandle srcHandle
+        cdef VixDiskLibConnection conn = self.conn
+        cdef char *_dest_path
+        cdef char *_local_path
+        cdef VixError vixError
         
         # 1) make a local connection
         cdef VixDiskLibConnection local_conn
@@ -355,8 +749,11 @@ cdef class VixDiskBase(VixBase):
         print "Required space for cloning: %d" % spaceNeeded
         
         # 4) Start cloning the empty drive over
-        vixError = VixDiskLib_Clone(self.conn, dest_path, local_conn, local_path,
-                                 &params, <VixDiskLibProgressFunc>clone_progress_func, NULL, TRUE)
+        _dest_path = PyString_AsString(dest_path)
+        _local_path = PyString_AsString(local_path)
+        with nogil:
+            vixError = VixDiskLib_Clone(conn, _dest_path, local_conn, _local_path,
+                                        &params, <VixDiskLibProgressFunc>clone_progress_func, NULL, TRUE)
         if vixError != VIX_OK:
             self._handleError("Error cloning disk to %s" % dest_path, vixError)
 
@@ -380,6 +777,8 @@ cdef class VixDiskBase(VixBase):
         parent disk, the child (redo log) will be orphaned.
         Unlinking the child does not affect the parent.
         """
+        if self.backend is not None:
+            return self.backend.unlink(path)
         vixError = VixDiskLib_Unlink(self.conn, PyString_AsString(path))
         if vixError != VIX_OK:
             self._handleError("Error unlinking disk", vixError)
@@ -388,7 +787,11 @@ cdef class VixDiskBase(VixBase):
         """
         Shrinks an existing disk, only local disks are shrunk.
         """
-        vixError = VixDiskLib_Shrink(self.handle, NULL, NULL)
+        self._library_only("shrink")
+        cdef VixError vixError
+        cdef VixDiskLibHandle handle = self.handle
+        with nogil:
+            vixError = VixDiskLib_Shrink(handle, NULL, NULL)
         if vixError != VIX_OK:
             self._handleError("Error shrinking disk", vixError)
         
@@ -396,6 +799,7 @@ cdef class VixDiskBase(VixBase):
         """
         Grows an existing disk, only local disks are grown.
         """
+        self._library_only("grow")
         vixError = VixDiskLib_Grow(self.conn, PyString_AsString(path), 
                        size, truth(update_geometry), NULL, NULL)
         if vixError != VIX_OK:
@@ -405,7 +809,11 @@ cdef class VixDiskBase(VixBase):
         """
         Defragments an existing disk.
         """
-        vixError = VixDiskLib_Defragment(self.handle, NULL, NULL)
+        self._library_only("defragment")
+        cdef VixError vixError
+        cdef VixDiskLibHandle handle = self.handle
+        with nogil:
+            vixError = VixDiskLib_Defragment(handle, NULL, NULL)
         if vixError != VIX_OK:
             self._handleError("Error defragementing disk", vixError)
 
@@ -413,6 +821,7 @@ cdef class VixDiskBase(VixBase):
         """
         Renames a virtual disk.
         """
+        self._library_only("rename")
         vixError = VixDiskLib_Rename(PyString_AsString(source), PyString_AsString(destination))
         if vixError != VIX_OK:
             self._handleError("Error renaming disk", vixError)
@@ -435,6 +844,7 @@ cdef class VixDiskBase(VixBase):
         """
         Check a sparse disk for internal consistency.
         """
+        self._library_only("needs_repair")
         vixError = VixDiskLib_CheckRepair(self.conn, PyString_AsString(filename), truth(repair))
         if vixError != VIX_OK:
             self._handleError("Error renaming disk", vixError)
@@ -445,13 +855,13 @@ cdef class VixDiskBase(VixBase):
 #
 # Progress callback for shrink.
 #
-cdef Bool shrink_progress_func(void * data, int percent):
+cdef Bool shrink_progress_func(void * data, int percent) nogil:
     return TRUE
 
 #
 # Progress callback for Clone.
 #
-cdef Bool clone_progress_func(void* data, int percent):
+cdef Bool clone_progress_func(void* data, int percent) nogil:
     return TRUE
 
 #
@@ -1,8 +1,13 @@
 from exceptions import Exception
 
 class VixDiskLibError(Exception):
-    """ VixDiskLib exception class """
-    pass
+    """
+    VixDiskLib exception class.  `code` is the vix-disklib error number, when the
+    error came from the library.
+    """
+    def __init__(self, *args, **kwargs):
+        self.code = kwargs.pop('code', None)
+        Exception.__init__(self, *args)
 
 class VixDiskUnimplemented(Exception):
     """ VixDiskLib exception class for unimplemented features """
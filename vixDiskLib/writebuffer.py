@@ -0,0 +1,94 @@
+'''
+Write coalescing.
+
+Restores tend to write a block at a time, and over NBD every VixDiskLib_Write is a round
+trip.  WriteBuffer collects contiguous writes in a staging buffer and hands them on as
+one large write when the buffer fills up, when a write does not follow on from the
+previous one, or when flushed.  :py:class:`vixDiskLib.vixDisk.VixDisk` uses it for
+`write()` and `write_from()` when created with a `write_buffer_size`.
+'''
+import numpy as np
+
+from vixDiskLib.vixExceptions import VixDiskLibError
+
+class WriteStats(object):
+    """ Counts the writes a WriteBuffer took in, and the ones it issued """
+    def __init__(self):
+        self.writes = 0
+        self.flushes = 0
+        self.bytes = 0
+
+    def __repr__(self):
+        return "<WriteStats writes=%d flushes=%d bytes=%d>" % (self.writes, self.flushes, self.bytes)
+
+class WriteBuffer(object):
+    """
+    Merges sequential block writes into writes of up to `size` bytes.
+
+    :param writer: Called as writer(block_offset, buffer) to really write, typically
+                   :py:meth:`VixDiskBase.write_from`.
+    :param size: The staging buffer size in bytes, rounded down to whole blocks.
+    :param block_size: The size of a block, in bytes.
+    """
+    def __init__(self, writer, size, block_size):
+        self.writer = writer
+        self.block_size = block_size
+        self.buff = np.empty(max(1, size // block_size) * block_size, dtype=np.uint8)
+        self.start = None
+        self.nbytes = 0
+        self.stats = WriteStats()
+
+    @property
+    def pending(self):
+        """ The number of bytes written but not yet flushed """
+        return self.nbytes
+
+    def write(self, offset, data):
+        """
+        Queues whole blocks for writing at block `offset`.  Anything already queued is
+        flushed first unless the new data follows straight on from it.
+
+        :param offset: Absolute offset, in blocks.
+        :param data: A contiguous buffer, its length a multiple of the block size.
+        :return: The number of bytes taken.
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        if data.size % self.block_size:
+            raise VixDiskLibError("Buffer size %d is not a multiple of the block size %d" % (data.size, self.block_size))
+        self.stats.writes += 1
+
+        if self.nbytes and offset != self.start + self.nbytes // self.block_size:
+            self.flush()
+        if not self.nbytes and data.size >= self.buff.size:
+            # nothing to merge with, and too big to stage anyway
+            self._issue(offset, data)
+            return data.size
+
+        done = 0
+        while done < data.size:
+            if not self.nbytes:
+                self.start = offset + done // self.block_size
+            count = min(data.size - done, self.buff.size - self.nbytes)
+            self.buff[self.nbytes:self.nbytes + count] = data[done:done + count]
+            self.nbytes += count
+            done += count
+            if self.nbytes == self.buff.size:
+                self.flush()
+        return data.size
+
+    def flush(self):
+        """
+        Writes out whatever is queued.  A failed write is raised from here, and the data
+        that was queued is dropped.
+        """
+        if not self.nbytes:
+            return
+        start, nbytes = self.start, self.nbytes
+        self.start = None
+        self.nbytes = 0
+        self._issue(start, self.buff[:nbytes])
+
+    def _issue(self, offset, data):
+        self.stats.flushes += 1
+        self.stats.bytes += data.size
+        self.writer(offset, data)
@@ -0,0 +1,60 @@
+'''
+Zero block detection.
+
+Exported images and restores are mostly runs of zero blocks, and every one of them
+would otherwise be written, or sent over the wire.  zero_mask() checks every block of
+a buffer at once with numpy, 8 bytes at a time, and data_runs() turns the mask into
+the runs of blocks that do hold data.  :py:meth:`vixDiskLib.vixDisk.VixDisk.iter_nonzero`
+uses them to leave the zero blocks out of a full disk read, and `VixDisk` skips them
+when writing if created with ``skip_zeros=True``.
+'''
+import numpy as np
+
+class ZeroStats(object):
+    """ Counts the blocks checked, the zero ones among them, and the bytes not moved """
+    def __init__(self):
+        self.blocks = 0
+        self.zero_blocks = 0
+        self.bytes_saved = 0
+
+    def count(self, mask, block_size):
+        """ Adds the blocks in a mask from :py:func:`zero_mask` """
+        zeros = int(np.count_nonzero(mask))
+        self.blocks += mask.size
+        self.zero_blocks += zeros
+        self.bytes_saved += zeros * block_size
+
+    def __repr__(self):
+        return "<ZeroStats blocks=%d zero_blocks=%d bytes_saved=%d>" % (
+            self.blocks, self.zero_blocks, self.bytes_saved)
+
+def zero_mask(data, block_size):
+    """
+    Returns a boolean array with one entry per block of `data`, True where the block
+    is all zeros.  A short last block is checked on its own.
+
+    :param data: A contiguous buffer, such as the np.ndarray returned by `read()`.
+    :param block_size: The size of a block, in bytes.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    full = data.size // block_size
+    mask = np.empty(-(-data.size // block_size), dtype=bool)
+
+    if full:
+        body = data[:full * block_size]
+        if block_size % 8 == 0 and body.ctypes.data % 8 == 0:
+            body = body.view(np.uint64)
+        np.logical_not(body.reshape(full, -1).any(axis=1), out=mask[:full])
+    if mask.size > full:
+        mask[full] = not data[full * block_size:].any()
+    return mask
+
+def data_runs(mask):
+    """
+    Returns the runs of blocks that are not zero as a list of (first_block, nblocks)
+    pairs, given a mask from :py:func:`zero_mask`.
+    """
+    edges = np.diff(np.concatenate(([True], mask, [True])).astype(np.int8))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+    return zip(starts.tolist(), (ends - starts).tolist())